@@ -10,21 +10,40 @@ from types import GeneratorType
 from adminapi import api
 from adminapi.datatype import validate_value, json_to_datatype
 from adminapi.filters import Any, BaseFilter, ContainedOnlyBy
-from adminapi.request import send_request, json_encode_extra
+from adminapi.request import (
+    json_encode_extra,
+    send_request,
+    send_request_stream,
+)
 from adminapi.exceptions import DatasetError, AdminapiException
 
 NEW_OBJECT_ENDPOINT = '/dataset/new_object'
 COMMIT_ENDPOINT = '/dataset/commit'
 QUERY_ENDPOINT = '/dataset/query'
+MULTI_QUERY_ENDPOINT = '/dataset/multi_query'
+COUNT_ENDPOINT = '/dataset/count'
 
 
 class BaseQuery(object):
-    def __init__(self, filters=None, restrict=['hostname'], order_by=None):
+    def __init__(
+        self,
+        filters=None,
+        restrict=['hostname'],
+        order_by=None,
+        limit=None,
+        offset=None,
+        after=None,
+    ):
         if filters is None:
             self._filters = None
             self._restrict = None
             self._order_by = None
+            self._limit = None
+            self._offset = None
+            self._after = None
             self._results = []
+            self._stream = None
+            self._received = []
             return
 
         self._filters = {
@@ -34,13 +53,26 @@ class BaseQuery(object):
 
         self._restrict = restrict
         self._order_by = order_by
+        self._limit = limit
+        self._offset = offset
+        self._after = after
         self._results = None
+        self._stream = None
+        self._received = []
 
     def __iter__(self):
-        return iter(self._get_results())
+        if self._results is not None:
+            return iter(self._results)
+
+        # Start the stream right away, so that the length hint list() asks
+        # for after calling this is taken from the results instead of
+        # sending a separate count request.
+        if self._stream is None:
+            self._stream = self._stream_results()
+        return self._iter_stream()
 
     def __len__(self):
-        return len(self._get_results())
+        return self.count()
 
     def __bool__(self):
         return bool(self._get_results())
@@ -53,6 +85,12 @@ class BaseQuery(object):
             args.append('restrict=' + repr(self._restrict))
         if self._order_by is not None:
             args.append('order_by=' + repr(self._order_by))
+        if self._limit is not None:
+            args.append('limit=' + repr(self._limit))
+        if self._offset is not None:
+            args.append('offset=' + repr(self._offset))
+        if self._after is not None:
+            args.append('after=' + repr(self._after))
         return 'Query({})'.format(', '.join(args))
 
     @property
@@ -91,12 +129,92 @@ class BaseQuery(object):
 
     def _get_results(self):
         if self._results is None:
-            self._results = self._fetch_results()
+            for obj in self._iter_stream():
+                pass
         return self._results
 
+    def _iter_stream(self):
+        """Iterate the results while they are being received
+
+        The received objects are kept, so iterating again returns the same
+        objects without fetching them again, even if the previous iteration
+        was stopped in between.  The stream cannot be continued after
+        a failure.  The next iteration starts it over.
+        """
+        if self._stream is None:
+            self._stream = self._stream_results()
+        received = self._received
+        index = 0
+        while self._results is None:
+            if received is not self._received:
+                raise DatasetError('Receiving the results failed')
+            if index == len(received):
+                try:
+                    received.append(next(self._stream))
+                except StopIteration:
+                    self._results = received
+                    break
+                except Exception:
+                    self._stream = None
+                    self._received = []
+                    raise
+            yield received[index]
+            index += 1
+
+        yield from self._results[index:]
+
+    def _stream_results(self):
+        return iter(self._fetch_results())
+
     def _fetch_results(self):
         raise NotImplementedError()
 
+    def _fetch_count(self):
+        raise NotImplementedError()
+
+    @classmethod
+    def _fetch_batch_results(cls, queries):
+        raise NotImplementedError()
+
+    @classmethod
+    def batch(cls, queries):
+        """Fetch the results of the queries all together
+
+        The queries are executed in a single snapshot of the database, so
+        their results are consistent with each other.  The ones which are
+        already fetched or being received are left alone.  Returns
+        the queries.
+        """
+        queries = list(queries)
+        pending = [
+            q for q in queries if q._results is None and q._stream is None
+        ]
+        if pending:
+            for query, results in zip(
+                pending, cls._fetch_batch_results(pending)
+            ):
+                query._results = results
+
+        return queries
+
+    def count(self):
+        """Return the number of matching objects
+
+        The objects are not fetched for this, unless they already are or
+        are being received.  The server counts them without materializing
+        any attributes.
+        """
+        if self._results is not None or self._stream is not None:
+            return len(self._get_results())
+
+        count = self._fetch_count()
+        if self._offset is not None:
+            count = max(count - self._offset, 0)
+        if self._limit is not None:
+            count = min(count, self._limit)
+
+        return count
+
     def _fetch_new_object(self, servertype):
         raise NotImplementedError()
 
@@ -284,17 +402,52 @@ class Query(BaseQuery):
 
         return result['commit_id']
 
-    def _fetch_results(self):
+    def _get_request_data(self):
         request_data = {'filters': self._filters}
         if self._restrict is not None:
             request_data['restrict'] = self._restrict
         if self._order_by is not None:
             request_data['order_by'] = self._order_by
+        if self._limit is not None:
+            request_data['limit'] = self._limit
+        if self._offset is not None:
+            request_data['offset'] = self._offset
+        if self._after is not None:
+            request_data['after'] = self._after
+
+        return request_data
+
+    def _stream_results(self):
+        request_data = self._get_request_data()
+        request_data['stream'] = True
+
+        for obj in send_request_stream(
+            QUERY_ENDPOINT, post_params=request_data
+        ):
+            yield _format_obj(obj)
+
+    @classmethod
+    def _fetch_batch_results(cls, queries):
+        response = send_request(MULTI_QUERY_ENDPOINT, post_params={
+            'queries': [q._get_request_data() for q in queries],
+        })
+        if response['status'] == 'error':
+            _handle_exception(response)
+
+        return [
+            [_format_obj(o) for o in results]
+            for results in response['result']
+        ]
+
+    def _fetch_count(self):
+        request_data = {'filters': self._filters}
+        if self._after is not None:
+            request_data['after'] = self._after
 
-        response = send_request(QUERY_ENDPOINT, post_params=request_data)
+        response = send_request(COUNT_ENDPOINT, post_params=request_data)
         if response['status'] == 'error':
             _handle_exception(response)
-        return [_format_obj(s) for s in response['result']]
+        return response['result']
 
 
 class DatasetObject(dict):
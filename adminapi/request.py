@@ -128,19 +128,63 @@ def calc_app_id(auth_token):
 
 
 def send_request(endpoint, get_params=None, post_params=None):
+    response = _send_request(endpoint, get_params, post_params)
+    content = _decompress_gzip(response)
+    return json.loads(content)
+
+
+def send_request_stream(endpoint, get_params=None, post_params=None):
+    """Send the request and iterate the results of the response
+
+    The response is expected to contain one JSON document per line.  They
+    are parsed one by one while reading the response.  The last line is
+    the status of the query.  ApiError is raised after the received
+    results, if it is not success, or if the response ended before it.
+    """
+    response = _send_request(endpoint, get_params, post_params)
+
+    # Older servers ignore the request for streaming and send all results
+    # in a regular response.
+    if response.info().get('Content-Type') != 'application/x-ndjson':
+        content = json.loads(_decompress_gzip(response))
+        if content.get('status') == 'error':
+            raise ApiError(content.get('message', 'Unknown error'))
+        yield from content['result']
+        return
+
+    if response.info().get('Content-Encoding') == 'gzip':
+        lines = gzip.GzipFile(fileobj=response)
+    else:
+        lines = response
+
+    # Every line is held back until the next one is received to tell
+    # the status apart from the results.
+    last = None
+    with response:
+        for line in lines:
+            if line.strip():
+                if last is not None:
+                    yield last
+                last = json.loads(line)
+
+    if last != {'status': 'success'}:
+        if isinstance(last, dict) and last.get('status') == 'error':
+            raise ApiError(last.get('message', 'Unknown error'))
+        raise ApiError('The response ended before the status of the query')
+
+
+def _send_request(endpoint, get_params, post_params):
     for retry in reversed(range(Settings.tries)):
         request = _build_request(endpoint, get_params, post_params)
         response = _try_request(request, retry != 0)
         if response:
-            break
+            return response
 
         # In case of an error, sleep before trying again
         time.sleep(Settings.sleep_interval)
-    else:
-        raise ApiError(f'Received no response after {Settings.tries} retries!')
 
-    content = _decompress_gzip(response)
-    return json.loads(content)
+    raise ApiError(f'Received no response after {Settings.tries} retries!')
+
 
 def _build_request(endpoint, get_params, post_params, retry=1):
     """Wrap request data in an urllib Request instance
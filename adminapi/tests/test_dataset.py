@@ -1,6 +1,18 @@
+import json
 import unittest
+from unittest import mock
 
-from adminapi.dataset import strtobool
+from adminapi.dataset import BaseQuery, strtobool
+from adminapi.exceptions import ApiError, DatasetError
+from adminapi.request import send_request_stream
+
+
+class CountingQuery(BaseQuery):
+    def _fetch_results(self):
+        raise AssertionError('Results should not be fetched for counting')
+
+    def _fetch_count(self):
+        return 10
 
 
 class TestStrtobool(unittest.TestCase):
@@ -22,3 +34,166 @@ class TestStrtobool(unittest.TestCase):
             with self.subTest(value=value):
                 with self.assertRaises(ValueError):
                     strtobool(value)
+
+
+class TestQueryCount(unittest.TestCase):
+    def test_len_counts_without_fetching(self):
+        self.assertEqual(len(CountingQuery({})), 10)
+
+    def test_count_with_pagination(self):
+        self.assertEqual(CountingQuery({}, limit=3).count(), 3)
+        self.assertEqual(CountingQuery({}, offset=8).count(), 2)
+        self.assertEqual(CountingQuery({}, limit=5, offset=7).count(), 3)
+        self.assertEqual(CountingQuery({}, offset=20).count(), 0)
+
+    def test_count_of_fetched_results(self):
+        query = CountingQuery()
+        self.assertEqual(query.count(), 0)
+
+
+class StreamingQuery(BaseQuery):
+    def _stream_results(self):
+        self.fetched = getattr(self, 'fetched', 0) + 1
+        for hostname in ['test0', 'test1', 'test2']:
+            yield {'hostname': hostname}
+
+
+class TestQueryStream(unittest.TestCase):
+    def test_iterate_twice(self):
+        query = StreamingQuery({})
+        self.assertEqual(list(query), list(query))
+        self.assertEqual(query.fetched, 1)
+
+    def test_stop_in_between(self):
+        query = StreamingQuery({})
+        first = next(iter(query))
+        objects = list(query)
+        self.assertIs(objects[0], first)
+        self.assertEqual(len(objects), 3)
+        self.assertEqual(query.fetched, 1)
+
+    def test_iterate_concurrently(self):
+        query = StreamingQuery({})
+        self.assertEqual(
+            [(a['hostname'], b['hostname']) for a, b in zip(query, query)],
+            [('test0', 'test0'), ('test1', 'test1'), ('test2', 'test2')],
+        )
+        self.assertEqual(query.fetched, 1)
+
+
+class FailingQuery(BaseQuery):
+    fail = True
+
+    def _stream_results(self):
+        yield {'hostname': 'test0'}
+        if self.fail:
+            raise IOError('Connection reset')
+        yield {'hostname': 'test1'}
+
+
+class TestQueryStreamFailure(unittest.TestCase):
+    def test_start_over(self):
+        query = FailingQuery({})
+        with self.assertRaises(IOError):
+            list(query)
+
+        query.fail = False
+        self.assertEqual(len(list(query)), 2)
+
+    def test_concurrent_iteration_fails(self):
+        query = FailingQuery({})
+        other = iter(query)
+        next(other)
+        with self.assertRaises(IOError):
+            list(query)
+        with self.assertRaises(DatasetError):
+            next(other)
+
+
+class TestStreamFallback(unittest.TestCase):
+    def _response(self, content):
+        response = mock.Mock()
+        response.info.return_value = {'Content-Type': 'application/x-json'}
+        response.read.return_value = json.dumps(content).encode()
+        return response
+
+    def test_result(self):
+        with mock.patch('adminapi.request._send_request', return_value=(
+            self._response({'status': 'success', 'result': [{'a': 1}]})
+        )):
+            self.assertEqual(list(send_request_stream('/')), [{'a': 1}])
+
+    def test_error(self):
+        with mock.patch('adminapi.request._send_request', return_value=(
+            self._response({'status': 'error', 'message': 'Failed'})
+        )):
+            with self.assertRaisesRegex(ApiError, 'Failed'):
+                list(send_request_stream('/'))
+
+
+class TestStream(unittest.TestCase):
+    def _response(self, *lines):
+        response = mock.MagicMock()
+        response.info.return_value = {'Content-Type': 'application/x-ndjson'}
+        response.__iter__.return_value = [
+            json.dumps(line).encode() + b'\n' for line in lines
+        ]
+        return response
+
+    def _stream(self, *lines):
+        with mock.patch('adminapi.request._send_request', return_value=(
+            self._response(*lines)
+        )):
+            return list(send_request_stream('/'))
+
+    def test_result(self):
+        self.assertEqual(
+            self._stream({'a': 1}, {'a': 2}, {'status': 'success'}),
+            [{'a': 1}, {'a': 2}],
+        )
+
+    def test_error(self):
+        with self.assertRaisesRegex(ApiError, 'Failed'):
+            self._stream({'a': 1}, {'status': 'error', 'message': 'Failed'})
+
+    def test_truncated(self):
+        with self.assertRaises(ApiError):
+            self._stream({'a': 1}, {'a': 2})
+
+
+class BatchQuery(StreamingQuery):
+    batches = []
+
+    @classmethod
+    def _fetch_batch_results(cls, queries):
+        cls.batches.append(queries)
+        return [[{'hostname': q._filters['hostname'].value}] for q in queries]
+
+
+class TestQueryBatch(unittest.TestCase):
+    def setUp(self):
+        BatchQuery.batches = []
+
+    def test_batch(self):
+        queries = [BatchQuery({'hostname': h}) for h in ['test0', 'test1']]
+        self.assertIs(BatchQuery.batch(queries)[1], queries[1])
+        self.assertEqual(
+            [list(q) for q in queries],
+            [[{'hostname': 'test0'}], [{'hostname': 'test1'}]],
+        )
+        self.assertEqual(len(BatchQuery.batches), 1)
+        self.assertFalse(any(hasattr(q, 'fetched') for q in queries))
+
+    def test_skip_fetched(self):
+        fetched = BatchQuery({'hostname': 'test0'})
+        list(fetched)
+        started = BatchQuery({'hostname': 'test1'})
+        next(iter(started))
+        pending = BatchQuery({'hostname': 'test2'})
+        BatchQuery.batch([fetched, started, pending])
+        self.assertEqual(BatchQuery.batches, [[pending]])
+        self.assertEqual(len(list(started)), 3)
+
+    def test_nothing_pending(self):
+        BatchQuery.batch([BatchQuery()])
+        self.assertEqual(BatchQuery.batches, [])
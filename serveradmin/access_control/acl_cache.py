@@ -0,0 +1,111 @@
+"""Serveradmin - ACL Cache
+
+The ACLs are checked for every object of every commit.  We compile them
+on their first use into the form needed for the checks, and keep them in
+memory of the process.  They are compiled again when either the metadata
+version or the ACL version changes.  The latter is incremented by the
+triggers of the ACL tables.  The memberships of the users and the
+applications are not cached, they are queried once per commit.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from django.db import connection
+
+from adminapi.parse import parse_query
+from serveradmin.access_control.models import AccessControlGroup
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.models import Attribute
+
+
+class CompiledACL:
+    def __init__(self, acl, all_attribute_ids, related_via_attribute_ids):
+        """Compile the ACL
+
+        The objects are shared by all users of the cache.  They must be
+        treated as read-only.
+        """
+        self.name = acl.name
+        self.filters = parse_query(acl.query)
+
+        # The attribute ids this ACL allows changing
+        attribute_ids = frozenset(a.pk for a in acl.attributes.all())
+        if acl.is_whitelist:
+            # XXX: There is currently no option to whitelist special
+            # attributes
+            self.attribute_ids = attribute_ids
+        else:
+            self.attribute_ids = all_attribute_ids - attribute_ids
+
+        # The attributes related via another one by servertypes are shared
+        # by all ACLs.
+        self.related_via_attribute_ids = related_via_attribute_ids
+
+    def __str__(self):
+        return self.name
+
+
+class _Cache:
+    def __init__(self, metadata, version):
+        self.metadata_version = metadata.version
+        self.version = version
+
+        self.all_attribute_ids = frozenset(
+            list(metadata.attributes) + list(Attribute.specials)
+        )
+        self.related_via_attribute_ids = {
+            servertype_id: frozenset(
+                a for a, sa in attributes.items()
+                if sa.related_via_attribute_id is not None
+            )
+            for servertype_id, attributes
+            in metadata.servertype_attributes.items()
+        }
+        self.acls = {}
+
+    def compile(self, acl_ids):
+        """Compile the given ACLs, if they are not already
+
+        An ACL which fails to compile is not kept, so the error is raised
+        again on its next use, and only for the commits using it.
+        """
+        missing_ids = [i for i in acl_ids if i not in self.acls]
+        if not missing_ids:
+            return
+
+        acls = AccessControlGroup.objects.filter(
+            pk__in=missing_ids
+        ).prefetch_related('attributes')
+        for acl in acls:
+            self.acls[acl.pk] = CompiledACL(
+                acl, self.all_attribute_ids, self.related_via_attribute_ids
+            )
+
+
+_cache = None
+
+
+def get_acls(acl_ids):
+    """Get the compiled ACLs compiling them if necessary"""
+    global _cache
+
+    acl_ids = list(acl_ids)
+    metadata = get_metadata()
+    version = _get_version()
+    cache = _cache
+    if (
+        cache is None or
+        cache.metadata_version != metadata.version or
+        cache.version != version
+    ):
+        cache = _cache = _Cache(metadata, version)
+    cache.compile(acl_ids)
+
+    # The ACLs deleted meanwhile are missing.  This can only deny the commit.
+    return [cache.acls[i] for i in acl_ids if i in cache.acls]
+
+
+def _get_version():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT version FROM access_control_version')
+        return cursor.fetchone()[0]
@@ -0,0 +1,65 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('access_control', '0003_accesscontrolgroup_description'),
+    ]
+
+    operations = [
+        # Version of the ACLs compiled by the processes.  See the acl_cache
+        # module.  The table has a single row.  It is set from a sequence,
+        # so a version of a rolled back transaction never comes back.
+        migrations.RunSQL(
+            'CREATE SEQUENCE access_control_version_seq',
+            'DROP SEQUENCE access_control_version_seq',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE access_control_version ('
+            '   version bigint NOT NULL'
+            ')',
+            'DROP TABLE access_control_version',
+        ),
+        migrations.RunSQL(
+            'INSERT INTO access_control_version (version) '
+            "VALUES (nextval('access_control_version_seq'))",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION access_control_version_increment()
+            RETURNS trigger AS $$
+            BEGIN
+                UPDATE access_control_version
+                SET version = nextval('access_control_version_seq');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP FUNCTION access_control_version_increment()',
+        ),
+        # The memberships are not cached, so they don't need to increment it.
+        migrations.RunSQL(
+            """
+            CREATE TRIGGER access_control_group_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON access_control_group
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION access_control_version_increment();
+
+            CREATE TRIGGER access_control_group_attributes_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON access_control_group_attributes
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION access_control_version_increment()
+            """,
+            """
+            DROP TRIGGER access_control_group_attributes_version
+            ON access_control_group_attributes;
+
+            DROP TRIGGER access_control_group_version
+            ON access_control_group
+            """,
+        ),
+    ]
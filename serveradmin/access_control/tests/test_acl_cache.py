@@ -0,0 +1,112 @@
+"""Serveradmin - ACL Cache tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+from adminapi.exceptions import DatatypeError
+from serveradmin.access_control.acl_cache import get_acls
+from serveradmin.access_control.models import AccessControlGroup
+from serveradmin.serverdb import query_committer
+from serveradmin.serverdb.models import Attribute
+from serveradmin.serverdb.query_materializer import (
+    get_default_attribute_values,
+)
+
+
+class TestACLCache(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        self.acl = AccessControlGroup.objects.create(
+            name='test', query='servertype=test0'
+        )
+        self.acl.attributes.add(Attribute.objects.get(pk='os'))
+
+    def test_compiled(self):
+        acl, = get_acls([self.acl.pk])
+        self.assertEqual(str(acl), 'test')
+        self.assertEqual(set(acl.filters), {'servertype'})
+        self.assertEqual(acl.attribute_ids, {'os'})
+
+    def test_blacklist(self):
+        self.acl.is_whitelist = False
+        self.acl.save()
+
+        acl, = get_acls([self.acl.pk])
+        self.assertNotIn('os', acl.attribute_ids)
+        self.assertIn('database', acl.attribute_ids)
+        self.assertIn('hostname', acl.attribute_ids)
+
+    def test_cached(self):
+        acl, = get_acls([self.acl.pk])
+        with self.assertNumQueries(2):
+            self.assertEqual(get_acls([self.acl.pk]), [acl])
+
+    def test_compiled_lazily(self):
+        get_acls([self.acl.pk])
+        other = AccessControlGroup.objects.create(
+            name='other', query='servertype=test1'
+        )
+
+        acl, = get_acls([other.pk])
+        self.assertEqual(str(acl), 'other')
+
+    def test_invalid(self):
+        invalid = AccessControlGroup.objects.create(
+            name='invalid', query='hostname=Invalid(1)'
+        )
+
+        with self.assertRaises(DatatypeError):
+            get_acls([self.acl.pk, invalid.pk])
+        with self.assertRaises(DatatypeError):
+            get_acls([invalid.pk])
+        acl, = get_acls([self.acl.pk])
+        self.assertEqual(str(acl), 'test')
+
+    def test_invalidated_by_query_change(self):
+        get_acls([self.acl.pk])
+        self.acl.query = 'hostname=test0'
+        self.acl.save()
+
+        acl, = get_acls([self.acl.pk])
+        self.assertEqual(set(acl.filters), {'hostname'})
+
+    def test_invalidated_by_attributes_change(self):
+        get_acls([self.acl.pk])
+        self.acl.attributes.add(Attribute.objects.get(pk='database'))
+
+        acl, = get_acls([self.acl.pk])
+        self.assertEqual(acl.attribute_ids, {'os', 'database'})
+
+    def test_invalidated_by_delete(self):
+        get_acls([self.acl.pk])
+        acl_id = self.acl.pk
+        self.acl.delete()
+
+        self.assertEqual(get_acls([acl_id]), [])
+
+    def test_access_control_queries(self):
+        user = User.objects.get(pk=1)
+        user.is_superuser = False
+        user.save()
+        self.acl.is_whitelist = False
+        self.acl.save()
+        self.acl.members.add(user)
+
+        created_objects = {}
+        for object_id in range(100, 150):
+            obj = get_default_attribute_values('test0')
+            obj.update(object_id=object_id, hostname='new{}'.format(object_id))
+            created_objects[object_id] = obj
+
+        # Only the metadata version, the memberships of the user and
+        # the ACL version after compiling the ACLs
+        get_acls([self.acl.pk])
+        with self.assertNumQueries(3):
+            query_committer._access_control(
+                user, None, {}, created_objects, {}, {}
+            )
@@ -15,11 +15,12 @@ from django.core.exceptions import (
     SuspiciousOperation,
     ValidationError,
 )
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBase
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.crypto import constant_time_compare
 from django.utils import timezone, dateformat
 
+from asgiref.sync import sync_to_async
 from paramiko.message import Message
 
 from adminapi.exceptions import ApiError
@@ -40,78 +41,120 @@ logger = getLogger('serveradmin')
 TIMESTAMP_GRACE_PERIOD = timedelta(seconds=16)
 
 
+# The errors to respond to the clients with the reasons and status codes
+API_ERRORS = (
+    FilterValueError,
+    ValidationError,
+    PermissionDenied,
+    ObjectDoesNotExist,
+    SuspiciousOperation,
+    ApiError,
+)
+
+
 def api_view(view):
     @csrf_exempt
     def _wrapper(request):
-        logger.debug('api: Start processing request: {} {}'.format(
-            request.scheme, request.path
-        ))
-
         now = timezone.now()
-        body = request.body.decode('utf8') if request.body else None
-        public_keys = request.META.get('HTTP_X_PUBLICKEYS')
-        signatures = request.META.get('HTTP_X_SIGNATURES')
-        app_id = request.META.get('HTTP_X_APPLICATION')
-        token = request.META.get('HTTP_X_SECURITYTOKEN')
-        then = datetime.utcfromtimestamp(
-            int(request.META['HTTP_X_TIMESTAMP'])
-        ).replace(tzinfo=dt_timezone.utc)
-        body_json = json.loads(body) if body else None
-        status_code = 200
+        try:
+            app, body_json = _authenticate_request(request, now)
+            return_value = view(request, app, body_json)
+        except API_ERRORS as error:
+            return _get_error_response(error)
+
+        _log_call(view, app, now)
+        return _get_response(return_value)
+
+    return update_wrapper(_wrapper, view)
+
 
+def async_api_view(view):
+    """Decorate the coroutine views like api_view()
+
+    The authentication is done on a thread, because it hits the database.
+    """
+    @csrf_exempt
+    async def _wrapper(request):
+        now = timezone.now()
         try:
-            app = authenticate_app(
-                public_keys, signatures, app_id, token, then, now, body
+            app, body_json = await sync_to_async(_authenticate_request)(
+                request, now
             )
-            return_value = view(request, app, body_json)
+            return_value = await view(request, app, body_json)
+        except API_ERRORS as error:
+            return _get_error_response(error)
 
-            logger.info('api: Call: ' + (', '.join([
-                'Method: {}'.format(view.__name__),
-                'Application: {}'.format(app),
-                'Time elapsed: {:.3f}s'.format(
-                    (timezone.now() - now).total_seconds()
-                ),
-            ])))
-        except (
-            FilterValueError,
-            ValidationError,
-            PermissionDenied,
-            ObjectDoesNotExist,
-            SuspiciousOperation,
-            ApiError
-        ) as error:
-            reason = ''
-
-            if isinstance(
-                error,
-                (FilterValueError, ValidationError, SuspiciousOperation, ApiError)
-            ):
-                status_code = 400
-                reason = 'Bad Request'
-            if isinstance(error, PermissionDenied):
-                status_code = 403
-                reason = 'Forbidden'
-            if isinstance(error, ObjectDoesNotExist):
-                status_code = 404
-                reason = 'Not Found'
-
-            message = '{}: {}'.format(reason, str(error))
-            logger.error('api: {}'.format(message))
-            return_value = {
-                'error': {
-                    'message': message,
-                }
-            }
-
-        return HttpResponse(
-            json.dumps(return_value, default=json_encode_extra),
-            content_type='application/x-json',
-            status=status_code,
-        )
+        _log_call(view, app, now)
+        return _get_response(return_value)
 
     return update_wrapper(_wrapper, view)
 
 
+def _authenticate_request(request, now):
+    """Authenticate the request and return the app with the parsed body"""
+
+    logger.debug('api: Start processing request: {} {}'.format(
+        request.scheme, request.path
+    ))
+
+    body = request.body.decode('utf8') if request.body else None
+    public_keys = request.META.get('HTTP_X_PUBLICKEYS')
+    signatures = request.META.get('HTTP_X_SIGNATURES')
+    app_id = request.META.get('HTTP_X_APPLICATION')
+    token = request.META.get('HTTP_X_SECURITYTOKEN')
+    then = datetime.utcfromtimestamp(
+        int(request.META['HTTP_X_TIMESTAMP'])
+    ).replace(tzinfo=dt_timezone.utc)
+    body_json = json.loads(body) if body else None
+
+    app = authenticate_app(
+        public_keys, signatures, app_id, token, then, now, body
+    )
+
+    return app, body_json
+
+
+def _log_call(view, app, now):
+    logger.info('api: Call: ' + (', '.join([
+        'Method: {}'.format(view.__name__),
+        'Application: {}'.format(app),
+        'Time elapsed: {:.3f}s'.format(
+            (timezone.now() - now).total_seconds()
+        ),
+    ])))
+
+
+def _get_error_response(error):
+    if isinstance(
+        error,
+        (FilterValueError, ValidationError, SuspiciousOperation, ApiError)
+    ):
+        status_code = 400
+        reason = 'Bad Request'
+    if isinstance(error, PermissionDenied):
+        status_code = 403
+        reason = 'Forbidden'
+    if isinstance(error, ObjectDoesNotExist):
+        status_code = 404
+        reason = 'Not Found'
+
+    message = '{}: {}'.format(reason, str(error))
+    logger.error('api: {}'.format(message))
+
+    return _get_response({'error': {'message': message}}, status_code)
+
+
+def _get_response(return_value, status_code=200):
+    if isinstance(return_value, HttpResponseBase):
+        return return_value
+
+    return HttpResponse(
+        json.dumps(return_value, default=json_encode_extra),
+        content_type='application/x-json',
+        status=status_code,
+    )
+
+
 def authenticate_app(
     public_keys, signatures, app_id, token, then, now, body
 ):
@@ -0,0 +1,185 @@
+"""Serveradmin - Remote HTTP API tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import (
+    AsyncRequestFactory,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from adminapi.filters import Regexp
+from adminapi.request import calc_security_token, json_encode_extra
+from serveradmin.api.views import dataset_query_async
+from serveradmin.apps.models import Application
+from serveradmin.serverdb import query_executer
+
+
+class TestDatasetQuery(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        self.app = Application.objects.create(
+            name='test', owner=User.objects.first(), location='test'
+        )
+
+        # The threads of the query executer have their own connections
+        # which have to be closed before the test database is dropped.
+        query_executer._executor = ThreadPoolExecutor(1)
+        self.addCleanup(self._shutdown_executor)
+
+    def _shutdown_executor(self):
+        async_to_sync(query_executer.run_async)(lambda: connection.close())
+        query_executer._executor.shutdown()
+        query_executer._executor = None
+
+    def _get_headers(self, body):
+        timestamp = int(time.time())
+        return {
+            'X-Application': self.app.app_id,
+            'X-Timestamp': str(timestamp),
+            'X-SecurityToken': calc_security_token(
+                self.app.auth_token, timestamp, body
+            ),
+        }
+
+    def _get_body(self, **data):
+        return json.dumps(
+            dict({'filters': {'hostname': Regexp('^test')}}, **data),
+            default=json_encode_extra,
+        )
+
+    def _post(self, **data):
+        body = self._get_body(**data)
+        return self.client.post(
+            '/api/dataset/query', body, 'application/x-json',
+            headers=self._get_headers(body),
+        )
+
+    def _query(self, **data):
+        response = self._post(**data)
+        return response.status_code, json.loads(response.content)
+
+    def _query_async(self, **data):
+        body = self._get_body(**data)
+        request = AsyncRequestFactory().post(
+            '/api/dataset/query', body, 'application/x-json',
+            headers=self._get_headers(body),
+        )
+        response = async_to_sync(dataset_query_async)(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_async(self):
+        for data in [
+            {'restrict': ['hostname', 'os']},
+            {'restrict': ['hostname'], 'order_by': ['os'], 'limit': 2},
+            {'restrict': ['nonexistent']},
+        ]:
+            with self.subTest(data=data):
+                self.assertEqual(
+                    self._query_async(**data), self._query(**data)
+                )
+
+        status_code, response = self._query_async(restrict=['hostname'])
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(response['result']), 5)
+
+    def _get_lines(self, response):
+        return [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+
+    def test_stream(self):
+        response = self._post(restrict=['hostname'], stream=True)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        *results, status = self._get_lines(response)
+        self.assertEqual(
+            [r['hostname'] for r in results],
+            ['test0', 'test1', 'test2', 'test3', 'test4'],
+        )
+        self.assertEqual(status, {'status': 'success'})
+        self.assertFalse(connection.in_atomic_block)
+
+    def test_stream_closed(self):
+        response = self._post(restrict=['hostname'], stream=True)
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertFalse(connection.in_atomic_block)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=-1)
+    def test_stream_slow_query(self):
+        response = self._post(restrict=['hostname'], stream=True)
+        b''.join(response.streaming_content)
+        response.close()
+
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.slow_queries, 1)
+
+    def test_stream_rejected_query(self):
+        self.app.query_max_rows = 2
+        self.app.save()
+        response = self._post(restrict=['hostname'], stream=True)
+        self.assertEqual(response.status_code, 400)
+
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.rejected_queries, 1)
+
+    @override_settings(QUERY_CHUNK_SIZE=2)
+    def test_stream_rejected_after_first_chunk(self):
+        self.app.query_max_rows = 3
+        self.app.save()
+        response = self._post(
+            restrict=['hostname'], order_by=['hostname'], stream=True
+        )
+        self.assertEqual(response.status_code, 200)
+        *results, status = self._get_lines(response)
+        response.close()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(status['status'], 'error')
+        self.assertIn('more than 3 objects', status['message'])
+
+        self.app.refresh_from_db()
+        self.assertEqual(self.app.rejected_queries, 1)
+
+    def test_fast_query_not_counted(self):
+        # The first one updates the last login of the application.
+        self._query(restrict=['hostname'])
+        with CaptureQueriesContext(connection) as context:
+            self._query(restrict=['hostname'])
+        self.assertFalse(any(
+            q['sql'].startswith('UPDATE') for q in context.captured_queries
+        ))
+
+    def test_async_stream(self):
+        status_code, response = self._query_async(
+            restrict=['hostname'], stream=True
+        )
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(response['result']), 5)
+
+        # The connection of the thread is left alone outside of any
+        # transaction.
+        self.assertFalse(async_to_sync(query_executer.run_async)(
+            lambda: connection.in_atomic_block
+        ))
+
+    def test_invalid_token(self):
+        body = self._get_body()
+        headers = self._get_headers(body)
+        headers['X-SecurityToken'] = 'invalid'
+        request = AsyncRequestFactory().post(
+            '/api/dataset/query', body, 'application/x-json', headers=headers
+        )
+        response = async_to_sync(dataset_query_async)(request)
+        self.assertEqual(response.status_code, 403)
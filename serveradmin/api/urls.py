@@ -3,11 +3,15 @@
 Copyright (c) 2020 InnoGames GmbH
 """
 
+from django.conf import settings
 from django.urls import path
 
 from serveradmin.api.views import (
     health_check,
     dataset_query,
+    dataset_query_async,
+    dataset_multi_query,
+    dataset_count,
     dataset_commit,
     dataset_new_object,
     dataset_attributes,
@@ -16,7 +20,12 @@ from serveradmin.api.views import (
 
 urlpatterns = [
     path('health_check', health_check),
-    path('dataset/query', dataset_query),
+    path(
+        'dataset/query',
+        dataset_query_async if settings.ASYNC_API else dataset_query,
+    ),
+    path('dataset/multi_query', dataset_multi_query),
+    path('dataset/count', dataset_count),
     path('dataset/commit', dataset_commit),
     path('dataset/new_object', dataset_new_object),
     path('dataset/attributes', dataset_attributes),
@@ -3,23 +3,43 @@
 Copyright (c) 2019 InnoGames GmbH
 """
 
+import json
+from contextlib import contextmanager
+from time import monotonic
+
+from django.conf import settings
 from django.core.exceptions import (
     SuspiciousOperation,
     PermissionDenied,
     ValidationError,
 )
-from django.http import JsonResponse
+from django.db.models import F
+from django.http import JsonResponse, StreamingHttpResponse
 from django.template.response import HttpResponse
 
 from adminapi.filters import BaseFilter, FilterValueError
+from adminapi.request import json_encode_extra
 from serveradmin.api import ApiError, AVAILABLE_API_FUNCTIONS
-from serveradmin.api.decorators import api_view
+from serveradmin.api.decorators import api_view, async_api_view
+from serveradmin.apps.models import Application
 from serveradmin.serverdb.models import Attribute
+from serveradmin.serverdb.query_budget import (
+    QueryBudget,
+    QueryBudgetExceeded,
+)
+from serveradmin.serverdb.query_cache import get_query_cache
 from serveradmin.serverdb.query_committer import commit_query
-from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_executer import (
+    execute_count,
+    execute_queries,
+    execute_query,
+    run_async,
+    stream_query,
+)
 from serveradmin.serverdb.query_materializer import (
     get_default_attribute_values
 )
+from serveradmin.serverdb.query_profiler import QueryProfile
 
 
 class StringEncoder(object):
@@ -47,11 +67,124 @@ def health_check(request):
 
 @api_view
 def dataset_query(request, app, data):
-    if 'filters' not in data or not isinstance(data['filters'], dict):
-        raise SuspiciousOperation('Filters must be a dictionary')
-    filters = {}
-    for attr, filter_obj in data['filters'].items():
-        filters[attr] = BaseFilter.deserialize(filter_obj)
+    return _query_dataset(app, data)
+
+
+@async_api_view
+async def dataset_query_async(request, app, data):
+    """Execute the query like dataset_query without blocking the event loop
+
+    The whole view runs on the threads of the query executer, as it hits
+    the database not only for the query itself.  The results are not
+    streamed, because the stream would keep the transaction open on
+    the connection of the thread, and Django would consume it at once
+    anyway.
+    """
+    return await run_async(_query_dataset, app, data, stream=False)
+
+
+def _query_dataset(app, data, stream=True):
+    args = _get_query_args(data)
+
+    if data.get('explain'):
+        return _explain_query(app, args)
+
+    # The cached results are not streamed even if it is requested, which
+    # the clients handle as well.
+    query_cache = get_query_cache()
+    if stream and data.get('stream') and query_cache is None:
+        return _stream_query(app, args, _get_budget(app))
+
+    with _account_query(app):
+        return _execute_query(query_cache, args, _get_budget(app))
+
+
+def _execute_query(query_cache, args, budget):
+    # The cached results are already encoded, so we build the response
+    # ourselves.
+    if query_cache is not None:
+        return HttpResponse(
+            '{"status": "success", "result": ' +
+            query_cache.get_result(*args, budget=budget) +
+            '}',
+            content_type='application/x-json',
+        )
+
+    return {
+        'status': 'success',
+        'result': execute_query(*args, budget=budget),
+    }
+
+
+def _stream_query(app, args, budget):
+    """Stream the results as one JSON document per line
+
+    The client can start processing them before all are materialized.
+    The transaction of the query is kept open until the response is closed,
+    so the query is accounted only after that.
+    """
+    start = monotonic()
+    try:
+        results = stream_query(*args, budget=budget)
+    except QueryBudgetExceeded:
+        _count_query(app, start, rejected=True)
+        raise
+
+    return StreamingHttpResponse(
+        _EncodedLines(app, results, start),
+        content_type='application/x-ndjson',
+    )
+
+
+class _EncodedLines:
+    """Encode the streamed results as one JSON document per line
+
+    The status of the query follows the results as the last line, because
+    the status code of the response is already sent, when the query fails
+    after the first chunk.  The clients must not take the results without
+    the success status as complete.
+
+    The response closes this when it is done even if the client went away
+    before reading anything, so we close the results for the transaction
+    of the query to end before accounting it.
+    """
+
+    def __init__(self, app, results, start):
+        self.app = app
+        self.results = results
+        self.start = start
+        self.rejected = False
+
+    def __iter__(self):
+        try:
+            for obj in self.results:
+                yield json.dumps(obj, default=json_encode_extra) + '\n'
+        except QueryBudgetExceeded as error:
+            self.rejected = True
+            yield self._encode_status('error', 'Bad Request: {}'.format(error))
+            return
+        except Exception:
+            yield self._encode_status('error', 'Internal Server Error')
+            raise
+
+        yield self._encode_status('success')
+
+    def _encode_status(self, status, message=None):
+        if message is None:
+            return json.dumps({'status': status}) + '\n'
+        return json.dumps({'status': status, 'message': message}) + '\n'
+
+    def close(self):
+        if self.results is not None:
+            self.results.close()
+            self.results = None
+            _count_query(self.app, self.start, self.rejected)
+
+
+def _get_query_args(data):
+    if not isinstance(data, dict):
+        raise SuspiciousOperation('Query must be a dictionary')
+    filters = _get_filters(data)
 
     # Empty list means query all attributes to the older versions of
     # the adminapi.
@@ -60,12 +193,111 @@ def dataset_query(request, app, data):
     else:
         restrict = data['restrict']
 
-    order_by = data.get('order_by')
+    return (
+        filters,
+        restrict,
+        data.get('order_by'),
+        data.get('limit'),
+        data.get('offset'),
+        data.get('after'),
+    )
 
-    return {
-        'status': 'success',
-        'result': execute_query(filters, restrict, order_by),
-    }
+
+def _explain_query(app, args):
+    """Execute the query profiling it instead of using the cache
+
+    The response includes the generated SQL and its plan which expose
+    the internals of the database, so it is only for the superusers.
+    """
+    if not app.superuser and not app.owner.is_superuser:
+        raise PermissionDenied('Only superusers can explain queries')
+
+    profile = QueryProfile()
+    result = execute_query(*args, profile=profile)
+    with profile.phase('serialization'):
+        result = json.dumps(result, default=json_encode_extra)
+
+    return HttpResponse(
+        '{"status": "success", "result": ' + result +
+        ', "explain": ' + json.dumps(profile.as_dict()) + '}',
+        content_type='application/x-json',
+    )
+
+
+@api_view
+def dataset_multi_query(request, app, data):
+    """Execute multiple queries in a single snapshot
+
+    The queries are given in the same format as the ones to dataset_query.
+    The results are neither cached nor streamed.
+    """
+    if not isinstance(data.get('queries'), list):
+        raise SuspiciousOperation('Queries must be a list')
+    queries = [_get_query_args(q) for q in data['queries']]
+
+    with _account_query(app):
+        return {
+            'status': 'success',
+            'result': execute_queries(queries, _get_budget(app)),
+        }
+
+
+@api_view
+def dataset_count(request, app, data):
+    filters = _get_filters(data)
+
+    with _account_query(app):
+        return {
+            'status': 'success',
+            'result': execute_count(
+                filters, data.get('after'), _get_budget(app)
+            ),
+        }
+
+
+def _get_budget(app):
+    return QueryBudget(
+        app.query_timeout, app.query_max_rows, app.query_max_cells
+    )
+
+
+@contextmanager
+def _account_query(app):
+    """Count the rejected and the slow queries of the application"""
+    start = monotonic()
+    try:
+        yield
+    except QueryBudgetExceeded:
+        _count_query(app, start, rejected=True)
+        raise
+
+    _count_query(app, start)
+
+
+def _count_query(app, start, rejected=False):
+    """Count the query on the application, if it was rejected or slow
+
+    The other queries are not counted to avoid updating the application
+    on every query.
+    """
+    if rejected:
+        _increment_counter(app, 'rejected_queries')
+    elif monotonic() - start > settings.SLOW_QUERY_THRESHOLD:
+        _increment_counter(app, 'slow_queries')
+
+
+def _increment_counter(app, field):
+    Application.objects.filter(pk=app.pk).update(**{field: F(field) + 1})
+
+
+def _get_filters(data):
+    if 'filters' not in data or not isinstance(data['filters'], dict):
+        raise SuspiciousOperation('Filters must be a dictionary')
+    filters = {}
+    for attr, filter_obj in data['filters'].items():
+        filters[attr] = BaseFilter.deserialize(filter_obj)
+
+    return filters
 
 
 @api_view
@@ -24,6 +24,8 @@ class ApplicationAdmin(admin.ModelAdmin):
         'superuser',
         'disabled',
         'last_login',
+        'rejected_queries',
+        'slow_queries',
     ]
     search_fields = ['name', 'owner__username', ]
     list_filter = ['superuser', 'disabled', ]
@@ -32,6 +34,8 @@ class ApplicationAdmin(admin.ModelAdmin):
     readonly_fields = [
         'auth_token',
         'last_login',
+        'rejected_queries',
+        'slow_queries',
     ]
     autocomplete_fields = ['owner']
     inlines = [
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0004_application_last_login'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='query_max_cells',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of materialized attribute values', null=True),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='query_max_rows',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of matched objects', null=True),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='query_timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Statement timeout in milliseconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='rejected_queries',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='slow_queries',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
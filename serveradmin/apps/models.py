@@ -37,6 +37,22 @@ class Application(models.Model):
     superuser = models.BooleanField(default=False)
     allowed_methods = models.TextField(blank=True)
 
+    # The budgets of the queries of the application.  See
+    # serveradmin.serverdb.query_budget.
+    query_timeout = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Statement timeout in milliseconds'
+    )
+    query_max_rows = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Maximum number of matched objects'
+    )
+    query_max_cells = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Maximum number of materialized attribute values',
+    )
+    rejected_queries = models.PositiveIntegerField(default=0, editable=False)
+    slow_queries = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,16 @@
+"""
+ASGI config for Serveradmin project.
+
+This module contains the ASGI application to be served by any ASGI server
+like uvicorn or daphne alongside or instead of the WSGI one.  It should be
+combined with the ASYNC_API setting to serve the queries through the API by
+the coroutine views.  The requests waiting for the database then don't hold
+a worker each.
+
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "serveradmin.settings")
+
+from django.core.asgi import get_asgi_application  # NOQA: E402
+application = get_asgi_application()
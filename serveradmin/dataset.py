@@ -5,7 +5,11 @@ Copyright (c) 2019 InnoGames GmbH
 
 from adminapi.dataset import BaseQuery, DatasetObject as ApiDatasetObject
 from serveradmin.serverdb.query_committer import commit_query
-from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_executer import (
+    execute_count,
+    execute_queries,
+    execute_query,
+)
 from serveradmin.serverdb.query_materializer import (
     get_default_attribute_values
 )
@@ -23,7 +27,31 @@ class Query(BaseQuery):
         return commit_id
 
     def _fetch_results(self):
-        return execute_query(self._filters, self._restrict, self._order_by)
+        return execute_query(
+            self._filters,
+            self._restrict,
+            self._order_by,
+            self._limit,
+            self._offset,
+            self._after,
+        )
+
+    def _fetch_count(self):
+        return execute_count(self._filters, self._after)
+
+    @classmethod
+    def _fetch_batch_results(cls, queries):
+        return execute_queries([
+            (
+                q._filters,
+                q._restrict,
+                q._order_by,
+                q._limit,
+                q._offset,
+                q._after,
+            )
+            for q in queries
+        ])
 
 
 class DatasetObject(ApiDatasetObject):
@@ -0,0 +1,207 @@
+"""Serveradmin - Filter Optimizer
+
+The SQL generator module translates the filters literally.  This module
+rewrites them to simpler equivalent ones before.  Every nested logical
+filter ends up as another condition, often another EXISTS sub-query, on
+the database.
+
+The rewrites are only equivalent in the semantics of the SQL generator
+module.  The comparison filters are only merged for numbers, because
+the strings are compared by the collation of the database.  Conflicting
+conditions are only folded for the attributes which can have only one
+value for an object.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from adminapi.filters import (
+    All,
+    Any,
+    BaseFilter,
+    GreaterThan,
+    GreaterThanOrEquals,
+    LessThan,
+    LessThanOrEquals,
+    Not,
+)
+
+
+def optimize_filter(attribute, filt, related_vias):
+    """Return a simpler filter equivalent to the given one
+
+    The result is a constant filter, i.e. the destiny of it is known, if
+    it would always match or never match.
+    """
+    if isinstance(filt, Not):
+        return _optimize_not(attribute, filt, related_vias)
+    if isinstance(filt, Any):
+        return _optimize_logical(attribute, filt, related_vias)
+    return filt
+
+
+def _optimize_not(attribute, filt, related_vias):
+    value = optimize_filter(attribute, filt.value, related_vias)
+    if isinstance(value, Not):
+        return value.value
+
+    destiny = value.destiny()
+    if destiny is not None:
+        return _get_constant(not destiny)
+
+    return Not(value)
+
+
+def _optimize_logical(attribute, filt, related_vias):
+    conjunction = isinstance(filt, All)
+    values = []
+    for value in _flatten(attribute, filt, related_vias):
+        # True is the identity of conjunction, and makes disjunction always
+        # true.  It is vice versa for false.
+        destiny = value.destiny()
+        if destiny is conjunction:
+            continue
+        if destiny is not None:
+            return _get_constant(destiny)
+
+        if not any(repr(v) == repr(value) for v in values):
+            values.append(value)
+
+    values = _merge_comparisons(values, conjunction)
+    if conjunction and _is_single_valued(attribute, related_vias):
+        if _conflicts(attribute, values):
+            return _get_constant(False)
+
+    if len(values) == 1:
+        return values[0]
+
+    return type(filt)(*values)
+
+
+def _flatten(attribute, filt, related_vias):
+    """Optimize the values of the logical filter lifting the nested ones
+    of the same kind"""
+
+    for value in filt.values:
+        value = optimize_filter(attribute, value, related_vias)
+        if type(value) is type(filt):
+            yield from value.values
+        else:
+            yield value
+
+
+def _get_constant(destiny):
+    return All() if destiny else Any()
+
+
+def _merge_comparisons(values, conjunction):
+    """Merge the comparisons of the same direction
+
+    Only the most restrictive one of them matters for conjunction, and
+    the least restrictive one for disjunction.  This holds for the multi
+    attributes too, because a value satisfying the most restrictive one
+    satisfies all of them.
+    """
+    result = []
+    indexes = {}
+    for value in values:
+        direction = _get_direction(value)
+        if direction is None:
+            result.append(value)
+        elif direction not in indexes:
+            indexes[direction] = len(result)
+            result.append(value)
+        else:
+            index = indexes[direction]
+            result[index] = (max if conjunction else min)(
+                result[index], value, key=_get_restrictiveness
+            )
+
+    return result
+
+
+def _get_direction(filt):
+    for direction in (GreaterThanOrEquals, LessThanOrEquals):
+        if isinstance(filt, direction) and _is_number(filt.value):
+            return direction
+    return None
+
+
+def _get_restrictiveness(filt):
+    """Return the key to sort the comparisons of the same direction"""
+
+    strict = isinstance(filt, (GreaterThan, LessThan))
+    if isinstance(filt, GreaterThanOrEquals):
+        return filt.value, strict
+    return -filt.value, strict
+
+
+def _is_single_valued(attribute, related_vias):
+    """Check whether the objects can have at most one value to match
+
+    The attributes related via another attribute are not, because they
+    may be related to multiple objects.
+    """
+    if attribute.special:
+        return True
+    if attribute.multi or attribute.type in ('reverse', 'supernet'):
+        return False
+    return list(related_vias.get(attribute.attribute_id, [None])) == [None]
+
+
+def _conflicts(attribute, values):
+    """Check whether the conjunction of the values can never match"""
+
+    lower = upper = None
+    equals = set()
+    for value in values:
+        direction = _get_direction(value)
+        if direction is GreaterThanOrEquals:
+            lower = value
+        elif direction is LessThanOrEquals:
+            upper = value
+        elif _is_comparable_equality(attribute, value):
+            equals.add(value.value)
+
+    if len(equals) > 1:
+        return True
+    if lower is not None and upper is not None and (
+        lower.value > upper.value or lower.value == upper.value and (
+            isinstance(lower, GreaterThan) or isinstance(upper, LessThan)
+        )
+    ):
+        return True
+
+    return any(not _in_range(v, lower, upper) for v in equals)
+
+
+def _is_comparable_equality(attribute, filt):
+    """Check whether the filter is an equality we can compare to others
+
+    Different values of the same type can never be equal on the database
+    only for numbers and booleans.
+    """
+    if type(filt) is not BaseFilter:
+        return False
+    if attribute.type == 'number':
+        return _is_number(filt.value)
+    if attribute.type == 'boolean':
+        return isinstance(filt.value, bool)
+    return False
+
+
+def _in_range(value, lower, upper):
+    if lower is not None and (
+        value < lower.value or
+        value == lower.value and isinstance(lower, GreaterThan)
+    ):
+        return False
+    if upper is not None and (
+        value > upper.value or
+        value == upper.value and isinstance(upper, LessThan)
+    ):
+        return False
+    return True
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,151 @@
+"""Serveradmin - Metadata Cache
+
+The attributes, the servertypes and the relations between them are needed
+by every query and every commit, but they rarely change.  We keep them in
+memory of the process, and reload them only after they are changed.
+
+Changes are detected using the version on the database, which is set by
+the triggers of the metadata tables from a sequence, so it covers also
+the bulk changes through the querysets, and never repeats even if the
+transaction is rolled back.  Checking it costs a single row lookup.  It is
+updated within the transaction changing the metadata, so all processes see
+the new version at the same time with the new metadata.  The queries and
+the commits pin the metadata to check the version only once.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+
+from serveradmin.serverdb.models import (
+    Attribute,
+    Servertype,
+    ServertypeAttribute,
+)
+
+
+class Metadata:
+    """Snapshot of the metadata
+
+    The objects on this snapshot are shared by all users of it.  They
+    must be treated as read-only.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.servertypes = {
+            s.servertype_id: s for s in Servertype.objects.all()
+        }
+        self.attributes = {
+            a.attribute_id: a
+            for a in Attribute.objects.prefetch_related('target_servertype')
+        }
+        self.target_servertype_ids = {
+            a.attribute_id: [
+                s.servertype_id for s in a.target_servertype.all()
+            ]
+            for a in self.attributes.values()
+        }
+
+        # We compile the regexps already, so they are not compiled for every
+        # commit again.
+        for attribute in self.attributes.values():
+            if attribute.regexp:
+                attribute._get_compiled_regexp()
+
+        # The servertype attributes are indexed by both sides, as both are
+        # needed.  The foreign keys are pointed to the objects above, so
+        # following them doesn't hit the database.
+        self.servertype_attributes = {s: {} for s in self.servertypes}
+        self.attribute_servertypes = {a: {} for a in self.attributes}
+        for sa in ServertypeAttribute.objects.all():
+            if not self._resolve(sa):
+                continue
+            self.servertype_attributes[sa.servertype_id][sa.attribute_id] = sa
+            self.attribute_servertypes[sa.attribute_id][sa.servertype_id] = sa
+
+    def _resolve(self, sa):
+        """Point the foreign keys of the servertype attribute to our objects
+
+        The metadata is not loaded in a single snapshot.  It can be changed
+        while we are loading it.  We skip the servertype attributes we
+        couldn't resolve in this case.  The changed version would make us
+        load it again on the next access anyway.
+        """
+        related_ids = [
+            sa.attribute_id,
+            sa.related_via_attribute_id,
+            sa.consistent_via_attribute_id,
+        ]
+        if sa.servertype_id not in self.servertypes or any(
+            a is not None and a not in self.attributes for a in related_ids
+        ):
+            return False
+
+        sa.servertype = self.servertypes[sa.servertype_id]
+        sa.attribute = self.attributes[sa.attribute_id]
+        if sa.related_via_attribute_id is not None:
+            sa.related_via_attribute = (
+                self.attributes[sa.related_via_attribute_id]
+            )
+        if sa.consistent_via_attribute_id is not None:
+            sa.consistent_via_attribute = (
+                self.attributes[sa.consistent_via_attribute_id]
+            )
+
+        return True
+
+    def get_servertype(self, servertype_id):
+        """Get the servertype like Servertype.objects.get() would"""
+        try:
+            return self.servertypes[servertype_id]
+        except KeyError:
+            raise Servertype.DoesNotExist(
+                'Servertype "{}" does not exist'.format(servertype_id)
+            )
+
+
+_metadata = None
+_pinned_metadata = ContextVar('pinned_metadata', default=None)
+
+
+def get_metadata():
+    """Get the current metadata loading it if necessary"""
+    global _metadata
+
+    metadata = _pinned_metadata.get()
+    if metadata is not None:
+        return metadata
+
+    version = _get_version()
+    metadata = _metadata
+    if metadata is None or metadata.version != version:
+        metadata = _metadata = Metadata(version)
+
+    return metadata
+
+
+@contextmanager
+def pin_metadata(metadata=None):
+    """Keep using the same metadata within the block
+
+    The version is checked only once for the block instead of on every
+    access, or not at all, if the metadata is given.  The metadata might
+    be outdated by the end of the block.
+    """
+    if metadata is None:
+        metadata = get_metadata()
+    token = _pinned_metadata.set(metadata)
+    try:
+        yield
+    finally:
+        _pinned_metadata.reset(token)
+
+
+def _get_version():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT version FROM metadata_version')
+        return cursor.fetchone()[0]
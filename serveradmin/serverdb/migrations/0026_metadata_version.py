@@ -0,0 +1,84 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0025_rename_serverbooleanattribute_attribute_server_bool_attribu_25fb6c_idx_and_more'),
+    ]
+
+    operations = [
+        # Version of the metadata cached by the processes.  See the metadata
+        # module.  The table has a single row.  It is not a model, as it is
+        # not meant to be accessed through the ORM.  It is set from
+        # a sequence, so a version of a rolled back transaction never comes
+        # back.
+        migrations.RunSQL(
+            'CREATE SEQUENCE metadata_version_seq',
+            'DROP SEQUENCE metadata_version_seq',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE metadata_version ('
+            '   version bigint NOT NULL'
+            ')',
+            'DROP TABLE metadata_version',
+        ),
+        migrations.RunSQL(
+            'INSERT INTO metadata_version (version) '
+            "VALUES (nextval('metadata_version_seq'))",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION metadata_version_increment()
+            RETURNS trigger AS $$
+            BEGIN
+                UPDATE metadata_version
+                SET version = nextval('metadata_version_seq');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP FUNCTION metadata_version_increment()',
+        ),
+        # The triggers are on the statement level, so they cover also
+        # the bulk changes which don't send the signals of the models.
+        migrations.RunSQL(
+            """
+            CREATE TRIGGER servertype_metadata_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON servertype
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION metadata_version_increment();
+
+            CREATE TRIGGER attribute_metadata_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON attribute
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION metadata_version_increment();
+
+            CREATE TRIGGER attribute_target_servertype_metadata_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON attribute_target_servertype
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION metadata_version_increment();
+
+            CREATE TRIGGER servertype_attribute_metadata_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+            ON servertype_attribute
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION metadata_version_increment()
+            """,
+            """
+            DROP TRIGGER servertype_attribute_metadata_version
+            ON servertype_attribute;
+
+            DROP TRIGGER attribute_target_servertype_metadata_version
+            ON attribute_target_servertype;
+
+            DROP TRIGGER attribute_metadata_version ON attribute;
+
+            DROP TRIGGER servertype_metadata_version ON servertype
+            """,
+        ),
+    ]
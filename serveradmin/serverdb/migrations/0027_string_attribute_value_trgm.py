@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0026_metadata_version'),
+    ]
+
+    operations = [
+        # Add a pg_trgm based trigram index on the string attribute values
+        # like the one on the server hostname.  It supports the LIKE and
+        # the regular expression conditions of the Contains, StartsWith
+        # and Regexp filters.
+        migrations.RunSQL(
+            'CREATE INDEX server_string_attribute_value_trgm '
+            'ON server_string_attribute USING gin (value gin_trgm_ops)',
+            'DROP INDEX server_string_attribute_value_trgm',
+        ),
+    ]
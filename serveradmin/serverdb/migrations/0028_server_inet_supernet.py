@@ -0,0 +1,123 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0027_string_attribute_value_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerInetSupernet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute', models.ForeignKey(db_index=False, limit_choices_to={'type': 'inet'}, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='serverdb.attribute')),
+                ('server', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='serverdb.server')),
+                ('supernet', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='serverdb.server')),
+            ],
+            options={
+                'db_table': 'server_inet_supernet',
+                'unique_together': {('server', 'attribute', 'supernet')},
+            },
+        ),
+        # The rows of the server are recalculated both as the contained
+        # ones and as the containing ones on every change of its values.
+        # The transactions changing the values of the same attribute are
+        # serialized, as they wouldn't see the values of each other.  The
+        # query committer takes the same locks in advance in a consistent
+        # order to avoid deadlocks.
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION server_inet_supernet_lock(attribute_id text)
+            RETURNS void AS $$
+                SELECT pg_advisory_xact_lock(
+                    hashtext('server_inet_supernet'), hashtext(attribute_id)
+                )
+            $$ LANGUAGE sql;
+
+            CREATE FUNCTION server_inet_supernet_update(
+                changed_server_id integer, changed_attribute_id text
+            ) RETURNS void AS $$
+            BEGIN
+                DELETE FROM server_inet_supernet AS s
+                WHERE s.attribute_id = changed_attribute_id AND (
+                    s.server_id = changed_server_id OR
+                    s.supernet_id = changed_server_id
+                );
+                INSERT INTO server_inet_supernet (
+                    server_id, attribute_id, supernet_id
+                )
+                SELECT host.server_id, host.attribute_id, net.server_id
+                FROM server_inet_attribute AS host
+                JOIN server_inet_attribute AS net ON (
+                    net.attribute_id = host.attribute_id AND
+                    net.value >>= host.value
+                )
+                WHERE host.server_id = changed_server_id AND
+                      host.attribute_id = changed_attribute_id
+                ON CONFLICT DO NOTHING;
+                INSERT INTO server_inet_supernet (
+                    server_id, attribute_id, supernet_id
+                )
+                SELECT host.server_id, host.attribute_id, net.server_id
+                FROM server_inet_attribute AS net
+                JOIN server_inet_attribute AS host ON (
+                    host.attribute_id = net.attribute_id AND
+                    host.value <<= net.value
+                )
+                WHERE net.server_id = changed_server_id AND
+                      net.attribute_id = changed_attribute_id
+                ON CONFLICT DO NOTHING;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE FUNCTION server_inet_supernet_inet_attribute()
+            RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP != 'INSERT' THEN
+                    PERFORM server_inet_supernet_lock(OLD.attribute_id);
+                    PERFORM server_inet_supernet_update(
+                        OLD.server_id, OLD.attribute_id
+                    );
+                END IF;
+                IF TG_OP != 'DELETE' AND (
+                    TG_OP = 'INSERT' OR
+                    OLD.server_id != NEW.server_id OR
+                    OLD.attribute_id != NEW.attribute_id
+                ) THEN
+                    PERFORM server_inet_supernet_lock(NEW.attribute_id);
+                    PERFORM server_inet_supernet_update(
+                        NEW.server_id, NEW.attribute_id
+                    );
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER server_inet_supernet
+            AFTER INSERT OR UPDATE OR DELETE ON server_inet_attribute
+            FOR EACH ROW
+            EXECUTE FUNCTION server_inet_supernet_inet_attribute();
+            """,
+            """
+            DROP FUNCTION server_inet_supernet_inet_attribute CASCADE;
+            DROP FUNCTION server_inet_supernet_update;
+            DROP FUNCTION server_inet_supernet_lock;
+            """,
+        ),
+        migrations.RunSQL(
+            'INSERT INTO server_inet_supernet '
+            '   (server_id, attribute_id, supernet_id) '
+            'SELECT DISTINCT host.server_id, host.attribute_id, net.server_id '
+            'FROM server_inet_attribute AS host '
+            'JOIN server_inet_attribute AS net ON ('
+            '   net.attribute_id = host.attribute_id AND '
+            '   net.value >>= host.value'
+            ')',
+            migrations.RunSQL.noop,
+        ),
+    ]
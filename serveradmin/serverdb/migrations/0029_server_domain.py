@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+import django.db.models.expressions
+import django.db.models.functions.text
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0028_server_inet_supernet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='domain',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.GreaterThan(django.db.models.functions.text.StrIndex('hostname', models.Value('.')), 1), then=django.db.models.functions.text.Substr('hostname', django.db.models.expressions.CombinedExpression(django.db.models.functions.text.StrIndex('hostname', models.Value('.')), '+', models.Value(1))))), output_field=models.CharField(max_length=254, null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='server',
+            index=models.Index(fields=['domain'], name='server_domain_3485b5_idx'),
+        ),
+    ]
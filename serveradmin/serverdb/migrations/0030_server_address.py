@@ -0,0 +1,174 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:29
+
+import django.db.models.deletion
+import netfields.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0029_server_domain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_addr_type', models.CharField(choices=[('null', 'null: intern_ip must be empty, no inet attributes'), ('host', 'host: intern_ip and inet must be an ip address and unique across all objects per attribute'), ('loadbalancer', 'loadbalancer: intern_ip and inet must be an ip address'), ('network', 'network: intern_ip and inet must be an ip network, not overlapping with same servertype')], max_length=32)),
+                ('value', netfields.fields.InetAddressField(max_length=39)),
+                ('attribute', models.ForeignKey(db_constraint=False, db_index=False, limit_choices_to={'type': 'inet'}, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='serverdb.attribute')),
+                ('server', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='serverdb.server')),
+                ('servertype', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='serverdb.servertype')),
+            ],
+            options={
+                'db_table': 'server_address',
+            },
+        ),
+        # The range of the attribute ids the address is compared to.  The
+        # range of a single attribute overlaps only with itself, and the
+        # unbounded range of the intern_ip, which has no attribute, with all.
+        migrations.RunSQL(
+            'CREATE TYPE attribute_scope AS RANGE '
+            '(subtype = text, collation = "C")',
+            'DROP TYPE attribute_scope',
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION server_address_server() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP != 'INSERT' THEN
+                    DELETE FROM server_address
+                    WHERE server_id = OLD.server_id AND attribute_id IS NULL;
+                END IF;
+                IF (
+                    TG_OP = 'UPDATE' AND
+                    OLD.servertype_id != NEW.servertype_id
+                ) THEN
+                    UPDATE server_address
+                    SET servertype_id = NEW.servertype_id,
+                        ip_addr_type = servertype.ip_addr_type
+                    FROM servertype
+                    WHERE server_id = NEW.server_id AND
+                          servertype.servertype_id = NEW.servertype_id;
+                END IF;
+                IF TG_OP != 'DELETE' AND NEW.intern_ip IS NOT NULL THEN
+                    INSERT INTO server_address (
+                        server_id, servertype_id, ip_addr_type, value
+                    )
+                    SELECT NEW.server_id, servertype_id, ip_addr_type,
+                           NEW.intern_ip
+                    FROM servertype
+                    WHERE servertype_id = NEW.servertype_id;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER server_address_insert
+            AFTER INSERT ON server
+            FOR EACH ROW EXECUTE FUNCTION server_address_server();
+            CREATE TRIGGER server_address_update
+            AFTER UPDATE OF intern_ip, servertype_id ON server
+            FOR EACH ROW WHEN (
+                OLD.intern_ip IS DISTINCT FROM NEW.intern_ip OR
+                OLD.servertype_id != NEW.servertype_id
+            ) EXECUTE FUNCTION server_address_server();
+            CREATE TRIGGER server_address_delete
+            AFTER DELETE ON server
+            FOR EACH ROW EXECUTE FUNCTION server_address_server();
+            """,
+            'DROP FUNCTION server_address_server CASCADE',
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION server_address_inet_attribute()
+            RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP != 'INSERT' THEN
+                    DELETE FROM server_address
+                    WHERE server_id = OLD.server_id AND
+                          attribute_id = OLD.attribute_id AND
+                          value = OLD.value;
+                END IF;
+                IF TG_OP != 'DELETE' THEN
+                    INSERT INTO server_address (
+                        server_id, attribute_id, servertype_id, ip_addr_type,
+                        value
+                    )
+                    SELECT NEW.server_id, NEW.attribute_id,
+                           servertype_id, ip_addr_type, NEW.value
+                    FROM server JOIN servertype USING (servertype_id)
+                    WHERE server_id = NEW.server_id;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER server_address
+            AFTER INSERT OR UPDATE OR DELETE ON server_inet_attribute
+            FOR EACH ROW EXECUTE FUNCTION server_address_inet_attribute();
+            """,
+            'DROP FUNCTION server_address_inet_attribute CASCADE',
+        ),
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION server_address_servertype() RETURNS trigger AS $$
+            BEGIN
+                UPDATE server_address
+                SET ip_addr_type = NEW.ip_addr_type
+                WHERE servertype_id = NEW.servertype_id;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER server_address
+            AFTER UPDATE OF ip_addr_type ON servertype
+            FOR EACH ROW WHEN (OLD.ip_addr_type != NEW.ip_addr_type)
+            EXECUTE FUNCTION server_address_servertype();
+            """,
+            'DROP FUNCTION server_address_servertype CASCADE',
+        ),
+        migrations.RunSQL(
+            'INSERT INTO server_address '
+            '   (server_id, attribute_id, servertype_id, ip_addr_type, value) '
+            'SELECT server_id, NULL, servertype_id, ip_addr_type, intern_ip '
+            'FROM server JOIN servertype USING (servertype_id) '
+            'WHERE intern_ip IS NOT NULL '
+            'UNION ALL '
+            'SELECT server_id, attribute_id, servertype_id, ip_addr_type, '
+            '   value '
+            'FROM server_inet_attribute '
+            'JOIN server USING (server_id) '
+            'JOIN servertype USING (servertype_id)',
+            migrations.RunSQL.noop,
+        ),
+        # The existing conflicts have to be resolved before these can be
+        # added.  See is_unique_ip() and network_overlaps() for the rules.
+        migrations.RunSQL(
+            'ALTER TABLE server_address '
+            'ADD CONSTRAINT server_address_host_exclude '
+            '   EXCLUDE USING gist ('
+            '       value inet_ops WITH =,'
+            '       server_id WITH <>,'
+            "       attribute_scope(attribute_id, attribute_id, '[]') WITH &&"
+            '   )'
+            "   WHERE (ip_addr_type = 'host')",
+            'ALTER TABLE server_address '
+            'DROP CONSTRAINT server_address_host_exclude',
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE server_address '
+            'ADD CONSTRAINT server_address_network_exclude '
+            '   EXCLUDE USING gist ('
+            '       value inet_ops WITH &&,'
+            '       servertype_id WITH =,'
+            '       server_id WITH <>,'
+            "       attribute_scope(attribute_id, attribute_id, '[]') WITH &&"
+            '   )'
+            "   WHERE (ip_addr_type = 'network')",
+            'ALTER TABLE server_address '
+            'DROP CONSTRAINT server_address_network_exclude',
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0030_server_address'),
+    ]
+
+    operations = [
+        # Version of the servers set by the query committer on every commit.
+        # See the query_cache module.  The table has a single row.  It is
+        # set from a sequence, so a version of a rolled back transaction
+        # never comes back.
+        migrations.RunSQL(
+            'CREATE SEQUENCE commit_version_seq',
+            'DROP SEQUENCE commit_version_seq',
+        ),
+        migrations.RunSQL(
+            'CREATE TABLE commit_version ('
+            '   version bigint NOT NULL'
+            ')',
+            'DROP TABLE commit_version',
+        ),
+        migrations.RunSQL(
+            'INSERT INTO commit_version (version) '
+            "VALUES (nextval('commit_version_seq'))",
+            migrations.RunSQL.noop,
+        ),
+    ]
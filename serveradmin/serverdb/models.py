@@ -24,7 +24,9 @@ from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import StrIndex, Substr
+from django.db.models.lookups import GreaterThan
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from netaddr import EUI
@@ -511,10 +513,25 @@ class Server(models.Model):
     )
     intern_ip = netfields.InetAddressField(null=True, blank=True)
     servertype = models.ForeignKey(Servertype, on_delete=models.PROTECT)
+    # The hostname without the first label to find the servers of
+    # the domain attributes by equality
+    domain = models.GeneratedField(
+        expression=Case(
+            When(
+                GreaterThan(StrIndex("hostname", Value(".")), 1),
+                then=Substr(
+                    "hostname", StrIndex("hostname", Value(".")) + 1
+                ),
+            ),
+        ),
+        output_field=models.CharField(max_length=254, null=True),
+        db_persist=True,
+    )
 
     class Meta:
         app_label = "serverdb"
         db_table = "server"
+        indexes = [models.Index(fields=["domain"])]
 
     def __str__(self):
         return self.hostname
@@ -522,6 +539,18 @@ class Server(models.Model):
     def clean(self):
         super(Server, self).clean()
 
+        ip_addr_type = self.validate_intern_ip()
+        if ip_addr_type == "host":
+            is_unique_ip(self.intern_ip, self, ["host"])
+        elif ip_addr_type == "network":
+            network_overlaps(self.intern_ip, self, ["network"])
+
+    def validate_intern_ip(self):
+        """Validate the intern_ip without comparing it to the other ones
+
+        Returns the ip_addr_type of the servertype to let the caller check
+        the uniqueness or the overlaps accordingly.
+        """
         ip_addr_type = self.servertype.ip_addr_type
         if ip_addr_type == "null":
             if self.intern_ip is not None:
@@ -540,14 +569,12 @@ class Server(models.Model):
             if type(self.intern_ip) not in [IPv4Interface, IPv6Interface]:
                 self.intern_ip = inet_to_python(self.intern_ip)
 
-            if ip_addr_type == "host":
+            if ip_addr_type in ("host", "loadbalancer"):
                 is_ip_address(self.intern_ip)
-                is_unique_ip(self.intern_ip, self, ["host"])
             elif ip_addr_type == "network":
                 is_network(self.intern_ip)
-                network_overlaps(self.intern_ip, self, ["network"])
-            elif ip_addr_type == "loadbalancer":
-                is_ip_address(self.intern_ip)
+
+        return ip_addr_type
 
     def get_attributes(self, attribute):
         model = ServerAttribute.get_model(attribute.type)
@@ -573,9 +600,12 @@ class ServerAttribute(models.Model):
     def get_value(self):
         return self.value
 
-    def save_value(self, value):
+    def set_value(self, value):
         # Normally, there shouldn't be any transformation necessary.
         self.value = value
+
+    def save_value(self, value):
+        self.set_value(value)
         self.full_clean()
         self.save()
 
@@ -614,7 +644,7 @@ class ServerStringAttribute(ServerAttribute):
         unique_together = [["server", "attribute", "value"]]
         indexes = [models.Index(fields=["attribute", "value"])]
 
-    def save_value(self, value):
+    def set_value(self, value):
         for char in "'\"":
             if char in value:
                 raise ValidationError(
@@ -628,7 +658,7 @@ class ServerStringAttribute(ServerAttribute):
                     )
                 )
 
-        super().save_value(value)
+        super().set_value(value)
 
 
 class ServerRelationAttributeManager(models.Manager):
@@ -661,14 +691,22 @@ class ServerRelationAttribute(ServerAttribute):
         unique_together = [["server", "attribute", "value"]]
         indexes = [models.Index(fields=["attribute", "value"])]
 
-    def save_value(self, value):
-        try:
-            target_server = Server.objects.get(hostname=value)
-        except Server.DoesNotExist:
-            raise ValidationError('No server with hostname "{0}" exist.'.format(value))
+    def set_value(self, value):
+        # The target server can be passed when it is already fetched.
+        if isinstance(value, Server):
+            target_server = value
+        else:
+            try:
+                target_server = Server.objects.get(hostname=value)
+            except Server.DoesNotExist:
+                raise ValidationError(
+                    'No server with hostname "{0}" exist.'.format(value)
+                )
 
         target_servertypes = self.attribute.target_servertype.all()
-        if target_servertypes.exists() and target_server.servertype not in target_servertypes:
+        if target_servertypes and target_server.servertype_id not in {
+            st.pk for st in target_servertypes
+        }:
             raise ValidationError(
                 'Attribute "{0}" has to be from servertype "{1}".'.format(
                     self.attribute,
@@ -676,7 +714,7 @@ class ServerRelationAttribute(ServerAttribute):
                 )
             )
 
-        ServerAttribute.save_value(self, target_server)
+        ServerAttribute.set_value(self, target_server)
 
 
 class ServerBooleanAttribute(ServerAttribute):
@@ -696,6 +734,10 @@ class ServerBooleanAttribute(ServerAttribute):
     def get_value(self):
         return True
 
+    def set_value(self, value):
+        # There is no value to set, the existence of the row is the value.
+        pass
+
     def save_value(self, value):
         if value:
             self.save()
@@ -747,6 +789,20 @@ class ServerInetAttribute(ServerAttribute):
     def clean(self):
         super(ServerAttribute, self).clean()
 
+        ip_addr_type = self.validate_address()
+        if ip_addr_type == "host":
+            is_unique_ip(self.value, self.server, ["host"], self.attribute_id)
+        elif ip_addr_type == "network":
+            network_overlaps(
+                self.value, self.server, ["network"], self.attribute_id
+            )
+
+    def validate_address(self):
+        """Validate the address without comparing it to the other ones
+
+        Returns the ip_addr_type of the servertype to let the caller check
+        the uniqueness or the overlaps accordingly.
+        """
         if self.attribute.inet_address_family == Attribute.InetAddressFamilyChoice.IPV4:
             allowed_types = (IPv4Interface,)
         elif (
@@ -776,14 +832,93 @@ class ServerInetAttribute(ServerAttribute):
                 code="invalid value",
                 params={"attribute_id": self.attribute_id},
             )
-        elif ip_addr_type == "host":
+        elif ip_addr_type in ("host", "loadbalancer"):
             is_ip_address(self.value)
-            is_unique_ip(self.value, self.server, ["host"], self.attribute_id)
         elif ip_addr_type == "network":
             is_network(self.value)
-            network_overlaps(self.value, self.server, ["network"], self.attribute_id)
-        elif ip_addr_type == "loadbalancer":
-            is_ip_address(self.value)
+
+        return ip_addr_type
+
+
+class ServerInetSupernet(models.Model):
+    """The servers containing the inet attribute values of the servers
+
+    Every server is listed with the servers having a value of the same
+    inet attribute equal to or containing its value, including itself.
+    Triggers on the server_inet_attribute table maintain it to calculate
+    the supernet attributes without comparing the addresses of all the
+    servers on every query.  The servers are not constrained on
+    the database, so that maintaining it doesn't lock the servers being
+    changed concurrently.
+    """
+
+    server = models.ForeignKey(
+        Server,
+        db_index=False,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    attribute = models.ForeignKey(
+        Attribute,
+        db_index=False,
+        on_delete=models.CASCADE,
+        related_name="+",
+        limit_choices_to=dict(type="inet"),
+    )
+    supernet = models.ForeignKey(
+        Server,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+
+    class Meta:
+        app_label = "serverdb"
+        db_table = "server_inet_supernet"
+        unique_together = [["server", "attribute", "supernet"]]
+
+
+class ServerAddress(models.Model):
+    """The addresses of the servers to constrain them on the database
+
+    Every intern_ip and inet attribute value is listed with the servertype
+    and its ip_addr_type.  Triggers on the server, server_inet_attribute
+    and servertype tables maintain it.  The exclusion constraints on it
+    ensure that the host addresses are unique and the networks don't overlap
+    within the same servertype, the same what is_unique_ip() and
+    network_overlaps() check.  The intern_ip is compared to all addresses,
+    the attribute values only to the intern_ip and to the same attribute.
+    """
+
+    server = models.ForeignKey(
+        Server,
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="+",
+    )
+    attribute = models.ForeignKey(
+        Attribute,
+        null=True,
+        db_index=False,
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="+",
+        limit_choices_to=dict(type="inet"),
+    )
+    servertype = models.ForeignKey(
+        Servertype,
+        db_index=False,
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="+",
+    )
+    ip_addr_type = models.CharField(max_length=32, choices=IP_ADDR_TYPES)
+    value = netfields.InetAddressField()
+
+    class Meta:
+        app_label = "serverdb"
+        db_table = "server_address"
 
 
 class ServerMACAddressAttribute(ServerAttribute):
@@ -0,0 +1,78 @@
+"""Serveradmin - Query Budget
+
+The queries of the applications can be bounded by a statement timeout,
+the number of the matched objects and the number of the materialized
+attribute values.  The query executer and the query materializer account
+for them on the budget, if one is passed to them, and reject the query
+as soon as it exceeds any.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from contextlib import contextmanager
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+
+# The SQLSTATE of the statements cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+
+class QueryBudgetExceeded(ValidationError):
+    pass
+
+
+class QueryBudget:
+    def __init__(self, timeout=None, max_rows=None, max_cells=None):
+        """Bound the queries
+
+        The timeout is in milliseconds.  None means unlimited for all of
+        them.  The rows and the cells are accumulated for all queries
+        executed with the same budget.
+        """
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_cells = max_cells
+        self.rows = 0
+        self.cells = 0
+
+    def add_rows(self, num):
+        self.rows += num
+        if self.max_rows is not None and self.rows > self.max_rows:
+            raise QueryBudgetExceeded(
+                'Query matches more than {} objects'.format(self.max_rows)
+            )
+
+    def add_cells(self, num):
+        self.cells += num
+        if self.max_cells is not None and self.cells > self.max_cells:
+            raise QueryBudgetExceeded(
+                'Query materializes more than {} attribute values'
+                .format(self.max_cells)
+            )
+
+
+@contextmanager
+def apply_budget(budget):
+    """Apply the statement timeout of the budget, if there is one
+
+    This must be used within the transaction of the query, as the timeout
+    is set until the end of it.
+    """
+    if budget is None or budget.timeout is None:
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SET LOCAL statement_timeout = {:d}'.format(budget.timeout)
+        )
+    try:
+        yield
+    except OperationalError as error:
+        if getattr(error.__cause__, 'pgcode', None) != QUERY_CANCELED:
+            raise
+        raise QueryBudgetExceeded(
+            'Query exceeds the statement timeout of {} ms'
+            .format(budget.timeout)
+        )
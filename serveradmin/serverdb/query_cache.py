@@ -0,0 +1,178 @@
+"""Serveradmin - Query Result Cache
+
+Many clients send exactly the same queries over and over again.  This
+module caches their results encoded in JSON, so that those can be answered
+without executing them on the database.
+
+The entries are tagged with the versions of the servers and the metadata
+on the database.  The query committer sets the former on every commit, see
+query_committer.py.  Only the entries of the current versions are returned,
+so checking them costs a single row lookup, but all processes see
+the commits at the same time with their changes regardless of the backend.
+The changes not made through the query committer are only seen after
+the entries expire after the configured timeout.
+
+The number of the hits and the misses are logged periodically by every
+process.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from adminapi.request import json_encode_extra
+from serveradmin.serverdb.query_executer import execute_query
+
+logger = logging.getLogger(__package__)
+
+KEY_PREFIX = 'serveradmin:query_cache:'
+
+# Number of the lookups to log the hits and the misses after
+STATS_INTERVAL = 1000
+
+
+class LocalBackend:
+    """Size bounded LRU cache in the memory of the process"""
+
+    def __init__(self, size, timeout):
+        self._size = size
+        self._timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            expires, value = self._entries[key]
+            if expires < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = monotonic() + self._timeout, value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+
+class DjangoBackend:
+    """Adapter for the caches configured on Django"""
+
+    def __init__(self, name, timeout):
+        self._cache = caches[name]
+        self._timeout = timeout
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value, self._timeout)
+
+
+class QueryCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get_result(
+        self, filters, restrict, order_by, limit=None, offset=None, after=None,
+        budget=None,
+    ):
+        """Return the result of execute_query() encoded in JSON
+
+        The budget only applies when the query is executed.
+        """
+
+        key = _get_key(filters, restrict, order_by, limit, offset, after)
+
+        # The generation has to be taken before executing the query.
+        # Otherwise, we could store the results of the previous generation
+        # as the next one, if a commit happens in between.
+        generation = _get_generation()
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == generation:
+            self._count(hit=True)
+            return entry[1]
+
+        self._count(hit=False)
+        result = json.dumps(
+            execute_query(
+                filters, restrict, order_by, limit, offset, after,
+                budget=budget,
+            ),
+            default=json_encode_extra,
+        )
+        self.backend.set(key, (generation, result))
+
+        return result
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            hits, misses = self.hits, self.misses
+
+        if (hits + misses) % STATS_INTERVAL == 0:
+            logger.info('Query cache: %d hits, %d misses', hits, misses)
+
+
+def _get_generation():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.version, m.version '
+            'FROM commit_version AS c, metadata_version AS m'
+        )
+        return cursor.fetchone()
+
+
+def _get_key(filters, restrict, order_by, limit, offset, after):
+    """Serialize the query to a canonical form to be used as the key"""
+
+    query = json.dumps(
+        [filters, restrict, order_by, limit, offset, after],
+        default=json_encode_extra,
+        sort_keys=True,
+    )
+
+    return KEY_PREFIX + sha256(query.encode()).hexdigest()
+
+
+_query_cache = None
+
+
+def get_query_cache():
+    """Get the query cache as configured on the settings
+
+    Returns None, if it is disabled.
+    """
+    global _query_cache
+
+    if _query_cache is None and settings.QUERY_CACHE_BACKEND is not None:
+        if settings.QUERY_CACHE_BACKEND == 'local':
+            backend = LocalBackend(
+                settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TIMEOUT
+            )
+        else:
+            backend = DjangoBackend(
+                settings.QUERY_CACHE_BACKEND, settings.QUERY_CACHE_TIMEOUT
+            )
+        _query_cache = QueryCache(backend)
+
+    return _query_cache
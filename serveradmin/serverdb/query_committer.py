@@ -4,24 +4,30 @@ Copyright (c) 2023 InnoGames GmbH
 """
 
 import logging
+from collections import defaultdict
+from contextlib import contextmanager
 from itertools import chain
 from typing import Optional
 
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 
 from adminapi.dataset import DatasetCommit
 from adminapi.request import json_encode_extra
+from serveradmin.access_control.acl_cache import get_acls
 from serveradmin.apps.models import Application
+from serveradmin.serverdb.metadata import get_metadata, pin_metadata
 from serveradmin.serverdb.models import (
     Servertype,
     Attribute,
     Server,
     ServerAttribute,
+    ServerBooleanAttribute,
+    ServerInetAttribute,
     ServerRelationAttribute,
     ChangeCommit,
-    Change, ServertypeAttribute,
+    Change,
 )
 from serveradmin.serverdb.query_materializer import (
     QueryMaterializer,
@@ -31,6 +37,81 @@ from serveradmin.serverdb.signals import pre_commit_critical, pre_commit, post_c
 
 logger = logging.getLogger(__name__)
 
+# The SQLSTATEs of the violations of the unique and the exclusion
+# constraints
+UNIQUE_VIOLATION = '23505'
+EXCLUSION_VIOLATION = '23P01'
+
+# The other servers conflicting with the inet attribute values to be saved
+# which are passed as arrays.  The host addresses are compared by equality
+# and the networks by overlap, both to the intern_ip of the servers and
+# to the values of the same attribute.  The candidate values are included
+# in the latter to find the conflicts between them.
+INET_CONFLICTS_SQL = """
+WITH candidate AS (
+    SELECT c.*, server.servertype_id, servertype.ip_addr_type
+    FROM unnest(
+        %(server_ids)s::integer[],
+        %(attribute_ids)s::text[],
+        %(values)s::inet[]
+    ) WITH ORDINALITY AS c (server_id, attribute_id, value, index)
+    JOIN server USING (server_id)
+    JOIN servertype USING (servertype_id)
+), other AS (
+    SELECT server_id, attribute_id, value FROM server_inet_attribute
+    UNION ALL
+    SELECT server_id, attribute_id, value FROM candidate
+)
+SELECT candidate.index, server.hostname, NULL
+FROM candidate
+JOIN server ON (
+    server.intern_ip = candidate.value AND
+    server.server_id != candidate.server_id
+)
+JOIN servertype ON (
+    servertype.servertype_id = server.servertype_id AND
+    servertype.ip_addr_type = 'host'
+)
+WHERE candidate.ip_addr_type = 'host'
+UNION
+SELECT candidate.index, server.hostname, NULL
+FROM candidate
+JOIN server ON (
+    server.servertype_id = candidate.servertype_id AND
+    server.intern_ip && candidate.value AND
+    server.server_id != candidate.server_id
+)
+WHERE candidate.ip_addr_type = 'network'
+UNION
+SELECT candidate.index, server.hostname, other.attribute_id
+FROM candidate
+JOIN other ON (
+    other.attribute_id = candidate.attribute_id AND
+    other.value = candidate.value AND
+    other.server_id != candidate.server_id
+)
+JOIN server ON server.server_id = other.server_id
+JOIN servertype ON (
+    servertype.servertype_id = server.servertype_id AND
+    servertype.ip_addr_type = 'host'
+)
+WHERE candidate.ip_addr_type = 'host'
+UNION
+SELECT candidate.index, server.hostname, other.attribute_id
+FROM candidate
+JOIN other ON (
+    other.attribute_id = candidate.attribute_id AND
+    other.value && candidate.value AND
+    other.server_id != candidate.server_id
+)
+JOIN server ON (
+    server.server_id = other.server_id AND
+    server.servertype_id = candidate.servertype_id
+)
+WHERE candidate.ip_addr_type = 'network'
+ORDER BY 1, 3 NULLS FIRST, 2
+"""
+
 
 class CommitError(ValidationError):
     pass
@@ -54,7 +135,13 @@ class CommitNewerData(CommitError):
 
 
 def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
-    """The main function to commit queries"""
+    """The main function to commit queries
+
+    Returns the DatasetCommit and the id of the ChangeCommit.  The created
+    and the deleted objects on the DatasetCommit have all attributes, but
+    the changed ones have only the special attributes, the changed ones
+    and the ones the ACLs of the user or the app filter on.
+    """
 
     # First send signals which failure means the commit can't be done.
     # Exceptions raised in those signals will propagate to here
@@ -67,13 +154,31 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
         commit_query, created=created, changed=changed, deleted=deleted
     )
 
-    # TODO: Find out which attributes we actually need
-    attribute_lookup = {a.pk: a for a in Attribute.objects.all()}
+    # The metadata is pinned, so its version is checked only once for
+    # the whole commit.
+    with pin_metadata():
+        commit, commit_id = _commit(created, changed, deleted, app, user)
+
+    post_commit.send_robust(
+        commit_query,
+        commit_id=commit_id,
+        created=created, changed=changed, deleted=deleted,
+    )
+
+    return commit, commit_id
+
+
+def _commit(created, changed, deleted, app, user):
+    attribute_lookup = dict(get_metadata().attributes)
     joined_attributes = {
         a: None
         for a
         in list(attribute_lookup.values()) + list(Attribute.specials.values())
     }
+    acl_entities = _get_acl_entities(user, app)
+    changed_attributes = _get_changed_attributes(
+        attribute_lookup, changed, acl_entities
+    )
 
     # TODO: We rely on the "protocol" that everything that creates or changes
     #       one or more Server(s) uses this API or also acquires an exclusive
@@ -88,7 +193,7 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
     #       # "repeatable read".
     with transaction.atomic():
         changed_servers = _fetch_servers(set(c['object_id'] for c in changed))
-        unchanged_objects = _materialize(changed_servers, joined_attributes)
+        unchanged_objects = _materialize(changed_servers, changed_attributes)
 
         deleted_servers = _fetch_servers(deleted)
         deleted_objects = _materialize(deleted_servers, joined_attributes)
@@ -113,29 +218,25 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
         # engine (Web API) which currently does not use forms at all.
         _validate(attribute_lookup, changed, unchanged_objects)
 
+        _lock_inet_supernets(
+            attribute_lookup, created, changed, deleted_objects
+        )
         # Changes should be applied in order to prevent integrity errors.
-        _delete_attributes(attribute_lookup, changed, changed_servers, deleted)
+        _delete_attributes(attribute_lookup, changed, deleted)
         _delete_servers(changed, deleted, deleted_servers)
         created_servers = _create_servers(attribute_lookup, created)
-        created_objects = _materialize(created_servers, joined_attributes)
         _update_servers(changed, changed_servers)
         _upsert_attributes(attribute_lookup, changed, changed_servers)
-        changed_objects = _materialize(changed_servers, joined_attributes)
+        created_objects = _materialize(created_servers, joined_attributes)
+        changed_objects = _materialize(changed_servers, changed_attributes)
 
-        # TODO Improve this function by checking only attributes of ACLs that
-        #      have actually changed and not all.
         _access_control(
             user, app, unchanged_objects,
-            created_objects, changed_objects, deleted_objects
+            created_objects, changed_objects, deleted_objects, acl_entities,
         )
 
         commit_id = _log_changes(user, app, changed, created_objects, deleted_objects)
-
-    post_commit.send_robust(
-        commit_query,
-        commit_id=commit_id,
-        created=created, changed=changed, deleted=deleted,
-    )
+        _increment_commit_version()
 
     return DatasetCommit(
         list(created_objects.values()),
@@ -144,6 +245,29 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
     ), commit_id
 
 
+def _get_changed_attributes(attribute_lookup, changed, acl_entities):
+    """Find out the attributes of the changed objects we need
+
+    Those are the attributes changed by the commit to validate them and
+    the attributes of the ACL filters to check them before and after
+    the changes.  The changes are logged from the change payload, so
+    the others don't need to be materialized.  The created and deleted
+    objects are still materialized entirely, because they are logged
+    with all of their attributes to recreate them.
+    """
+    attribute_ids = {a for c in changed for a in c}
+    for entity_class, entity_name, groups in acl_entities:
+        for acl in groups:
+            attribute_ids.update(acl.filters)
+
+    joined_attributes = {a: None for a in Attribute.specials.values()}
+    for attribute_id in attribute_ids:
+        if attribute_id in attribute_lookup:
+            joined_attributes[attribute_lookup[attribute_id]] = None
+
+    return joined_attributes
+
+
 def _validate(attribute_lookup, changed, changed_objects):
     servertype_attributes = _get_servertype_attributes(changed_objects)
 
@@ -183,7 +307,14 @@ def _validate(attribute_lookup, changed, changed_objects):
         raise CommitNewerData(f'Newer data available for attribute {newer}', newer)
 
 
-def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
+def _delete_attributes(attribute_lookup, changed, deleted):
+    """Delete the attribute values changed by the commit
+
+    The values of the single attributes are deleted also when they are
+    updated, as _upsert_attributes inserts the new ones.  The deletes are
+    grouped by the models, so that every table is touched by a single
+    statement for all objects.
+    """
     # We first have to delete all of the relation attributes
     # to avoid integrity errors.  Other attributes will just go away
     # with the servers.
@@ -194,6 +325,8 @@ def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
             .delete()
         )
 
+    deleted_attributes = defaultdict(list)
+    removed_values = defaultdict(list)
     for changes in changed:
         object_id = changes['object_id']
 
@@ -201,21 +334,69 @@ def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
             if attribute_id in Attribute.specials:
                 continue
 
-            server = changed_servers[object_id]
             attribute = attribute_lookup[attribute_id]
-            action = change['action']
+            if change['action'] == 'multi':
+                removed_values[attribute].extend(
+                    (object_id, v) for v in change['remove']
+                )
+            else:
+                model = ServerAttribute.get_model(attribute.type)
+                deleted_attributes[model].append((object_id, attribute_id))
 
-            if action == 'delete' or (
-                action == 'update' and change['new'] is None
-            ):
-                server.get_attributes(attribute).delete()
-            elif action == 'multi' and change['remove']:
-                for server_attribute in server.get_attributes(attribute):
-                    value = server_attribute.get_value()
-                    if isinstance(value, Server):
-                        value = value.hostname
-                    if value in change['remove']:
-                        server_attribute.delete()
+    for model, rows in deleted_attributes.items():
+        _delete_rows(model, ('server_id', 'attribute_id'), rows)
+    for model, rows in _get_removed_rows(removed_values).items():
+        _delete_rows(model, ('server_id', 'attribute_id', 'value'), rows)
+
+
+def _get_removed_rows(removed_values):
+    """Convert the removed values of the multi attributes to the rows
+
+    The values are converted to the database representation, so that
+    they are compared by the database.  The ones which cannot be converted
+    are skipped, as they cannot match any stored value.
+    """
+    target_ids = _get_server_ids({
+        v
+        for a, values in removed_values.items()
+        if a.type == 'relation'
+        for _, v in values
+    })
+
+    removed_rows = defaultdict(list)
+    for attribute, values in removed_values.items():
+        model = ServerAttribute.get_model(attribute.type)
+        field = model._meta.get_field('value')
+        for object_id, value in values:
+            if attribute.type == 'relation':
+                value = target_ids.get(value)
+                if value is None:
+                    continue
+            else:
+                try:
+                    value = field.get_db_prep_value(
+                        field.to_python(value), connection
+                    )
+                except ValidationError:
+                    continue
+            removed_rows[model].append((object_id, attribute.pk, value))
+
+    return removed_rows
+
+
+def _delete_rows(model, columns, rows):
+    """Delete the rows of the model matching any of the given tuples"""
+
+    row_sql = '({})'.format(', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE ({}) IN ({})'.format(
+                model._meta.db_table,
+                ', '.join(columns),
+                ', '.join([row_sql] * len(rows)),
+            ),
+            list(chain.from_iterable(rows)),
+        )
 
 
 def _delete_servers(changed, deleted, deleted_servers):
@@ -238,7 +419,8 @@ def _delete_servers(changed, deleted, deleted_servers):
 
 
 def _create_servers(attribute_lookup, created):
-    created_servers = {}
+    created_servers = []
+    values = []
     for attributes in created:
         if not attributes.get('hostname'):
             raise CommitError('"hostname" attribute is required.')
@@ -253,16 +435,28 @@ def _create_servers(attribute_lookup, created):
         attributes = dict(_get_real_attributes(attributes, attribute_lookup))
         _validate_real_attributes(servertype, attributes)
 
-        server = _insert_server(hostname, intern_ip, servertype, attributes)
+        server = _new_server(hostname, intern_ip, servertype, created_servers)
+        for attribute, value in attributes.items():
+            if attribute.multi:
+                values.extend((server, attribute, v) for v in value)
+            else:
+                values.append((server, attribute, value))
 
         created_server = {k.pk: v for k, v in attributes.items()}
         created_server['hostname'] = hostname
         created_server['servertype'] = servertype.pk
         created_server['intern_ip'] = intern_ip
 
-        created_servers[server.server_id] = server
+        created_servers.append(server)
 
-    return created_servers
+    # The addresses of the created servers are only compared to the others
+    # by the database.
+    with _map_address_conflicts(lambda: _check_servers(created_servers)):
+        for server in created_servers:
+            server.save()
+    _insert_attributes(values)
+
+    return {s.server_id: s for s in created_servers}
 
 
 def _update_servers(changed, changed_servers):
@@ -283,44 +477,238 @@ def _update_servers(changed, changed_servers):
             setattr(server, attribute.special.field, change.get('new'))
             really_changed.add(server)
 
-    for server in really_changed:
-        server.full_clean()
-        server.save()
+    with _map_address_conflicts(lambda: _check_servers(really_changed)):
+        for server in really_changed:
+            _clean_server(server)
+            server.save()
 
 
 def _upsert_attributes(attribute_lookup, changed, changed_servers):
+    """Insert the new attribute values of the commit
+
+    The previous values of the single attributes are already deleted by
+    _delete_attributes.
+    """
+    values = []
     for changes in changed:
-        object_id = changes['object_id']
+        server = changed_servers[changes['object_id']]
 
         for attribute_id, change in changes.items():
             if attribute_id in Attribute.specials:
                 continue
 
             attribute = attribute_lookup[attribute_id]
-            server = changed_servers[object_id]
-
             action = change['action']
             if action == 'multi':
-                for value in change['add']:
-                    server.add_attribute(attribute, value)
-                continue
+                values.extend((server, attribute, v) for v in change['add'])
+            elif action in ('new', 'update') and change['new'] is not None:
+                values.append((server, attribute, change['new']))
 
-            if action not in ('new', 'update'):
-                continue
-            if change['new'] is None:
-                continue
+    _insert_attributes(values)
 
-            try:
-                server_attribute = server.get_attributes(attribute).get()
-            except ServerAttribute.get_model(attribute.type).DoesNotExist:
-                server.add_attribute(attribute, change['new'])
-            else:
-                server_attribute.save_value(change['new'])
+
+def _insert_attributes(values):
+    """Insert the attribute values grouped by the models
+
+    All values are validated before any of them is inserted.  The relation
+    targets are fetched with a single query and the rows of every model
+    are inserted with a single statement.  The inet values are compared
+    to the other addresses by the database.
+    """
+    target_servers = _get_servers({
+        v for s, a, v in values if a.type == 'relation'
+    })
+
+    server_attributes = defaultdict(list)
+    for server, attribute, value in values:
+        model = ServerAttribute.get_model(attribute.type)
+        if model is ServerBooleanAttribute and not value:
+            continue
+
+        server_attribute = model(server=server, attribute=attribute)
+        if model is ServerRelationAttribute:
+            value = target_servers.get(value, value)
+        server_attribute.set_value(value)
+        _clean_server_attribute(server_attribute)
+        server_attributes[model].append(server_attribute)
+
+    inet_attributes = server_attributes.get(ServerInetAttribute, [])
+    with _map_address_conflicts(
+        lambda: _validate_inet_attributes(inet_attributes)
+    ):
+        for model, objs in server_attributes.items():
+            _bulk_create(model, objs)
+
+
+def _bulk_create(model, objs):
+    """Insert the attribute values of the model
+
+    Adding the values of the multi attributes which already exist is
+    a no-op like adding them to a set.  The previous values of the others
+    are already deleted, so their conflicts are reported as ValidationError.
+    """
+    model.objects.bulk_create(
+        [o for o in objs if o.attribute.multi], ignore_conflicts=True
+    )
+    try:
+        model.objects.bulk_create([o for o in objs if not o.attribute.multi])
+    except IntegrityError as error:
+        if getattr(error.__cause__, 'pgcode', None) != UNIQUE_VIOLATION:
+            raise
+        raise ValidationError(
+            'Attribute value already exists: {}'
+            .format(error.__cause__.diag.message_detail)
+        )
+
+
+def _clean_server_attribute(server_attribute):
+    """Validate the attribute value without querying the database
+
+    The servers and the attributes are known to exist, checking them would
+    cost a query for every row.  The uniqueness is ensured by the database,
+    also for the inet values, see ServerAddress.
+    """
+    exclude = ['server', 'attribute']
+    if isinstance(server_attribute, ServerRelationAttribute):
+        exclude.append('value')
+    server_attribute.clean_fields(exclude=exclude)
+
+    if isinstance(server_attribute, ServerInetAttribute):
+        server_attribute.validate_address()
+    else:
+        server_attribute.clean()
+
+
+def _validate_inet_attributes(server_attributes):
+    """Check the inet attribute values for conflicts with a single query
+
+    They are compared to the intern_ip of the other servers, to the values
+    of the same attribute of the other servers, and to each other.  The host
+    addresses have to be unique among the host servertypes, and the networks
+    must not overlap within the same servertype.  This is the same what
+    is_unique_ip() and network_overlaps() check one by one.  All conflicts
+    are reported at once.  The database enforces the same, this is used to
+    explain its errors.
+    """
+    if not server_attributes:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(INET_CONFLICTS_SQL, {
+            'server_ids': [a.server.server_id for a in server_attributes],
+            'attribute_ids': [a.attribute_id for a in server_attributes],
+            'values': [str(a.value) for a in server_attributes],
+        })
+        conflicts = defaultdict(list)
+        for index, hostname, attribute_id in cursor.fetchall():
+            conflicts[index].append(
+                '{} ({})'.format(hostname, attribute_id or 'intern_ip')
+            )
+
+    if conflicts:
+        raise ValidationError([
+            "Can't set IP address {} on {}, conflicts with: {}".format(
+                server_attributes[i - 1].value,
+                server_attributes[i - 1].server.hostname,
+                ', '.join(d),
+            )
+            for i, d in sorted(conflicts.items())
+        ])
+
+
+@contextmanager
+def _map_address_conflicts(find_conflicts):
+    """Report the violations of the address constraints as ValidationError
+
+    The exclusion constraints of ServerAddress don't tell which objects
+    conflict.  The statements are executed in a savepoint, so that
+    the given function can look them up after a violation and raise
+    the ValidationError with the usual messages.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as error:
+        if getattr(error.__cause__, 'pgcode', None) != EXCLUSION_VIOLATION:
+            raise
+        find_conflicts()
+        raise ValidationError(
+            'IP address conflicts with another object: {}'
+            .format(error.__cause__.diag.message_detail)
+        )
+
+
+def _clean_server(server):
+    """Validate the server without comparing its intern_ip to the others
+
+    The database ensures the intern_ip doesn't conflict, see ServerAddress.
+    """
+    server.clean_fields()
+    server.validate_intern_ip()
+    server.validate_unique()
+
+
+def _check_servers(servers):
+    for server in servers:
+        server.clean()
+
+
+def _lock_inet_supernets(attribute_lookup, created, changed, deleted_objects):
+    """Lock the inet attributes changed by the commit
+
+    The triggers maintaining ServerInetSupernet lock the inet attributes
+    when their values change to serialize the concurrent changes.  We take
+    the same locks before changing anything in the order of the attributes
+    to avoid deadlocks.  The locks are held until the end of the transaction.
+    """
+    attribute_ids = set()
+    for attributes in chain(created, changed, deleted_objects.values()):
+        for attribute_id in attributes:
+            attribute = attribute_lookup.get(attribute_id)
+            if attribute is not None and attribute.type == 'inet':
+                attribute_ids.add(attribute_id)
+    if not attribute_ids:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT server_inet_supernet_lock(attribute_id) '
+            'FROM unnest(%s::text[]) AS attribute_id',
+            [sorted(attribute_ids)],
+        )
+
+
+def _get_acl_entities(
+    user: Optional[User], app: Optional[Application],
+) -> list:
+    """Get the compiled ACLs of the app or if not present of the user
+
+    Returns an empty list for the superusers, as they cannot violate
+    permissions.  Raises PermissionDenied if there is neither of them.
+    """
+
+    # superusers and apps can not violate permissions.
+    if (user and user.is_superuser) or (app and app.superuser):
+        return []
+
+    if app:
+        return [('application', app, get_acls(
+            app.access_control_groups.values_list('pk', flat=True)
+        ))]
+    if user:
+        return [('user', user, get_acls(
+            user.access_control_groups.values_list('pk', flat=True)
+        ))]
+
+    # This should not be possible as it means not authenticated but better
+    # safe than sorry.
+    raise PermissionDenied('Missing authentication!')
 
 
 def _access_control(
     user: Optional[User], app: Optional[Application], unchanged_objects: dict,
     created_objects: dict, changed_objects: dict, deleted_objects: dict,
+    entities: Optional[list] = None,
 ) -> None:
     """Enforce serveradmin ACLs
 
@@ -340,49 +728,48 @@ def _access_control(
     its ACLs, the error message can become rather complex, listing all the
     reasons all the users ACLs were not applicable.
 
+    The entities are taken from _get_acl_entities(), if they are not
+    given.
+
     Raises PermissionDenied if a change is not permissible.
     Returns None on success.
     """
 
-    # superusers and apps can not violate permissions.
-    if (user and user.is_superuser) or (app and app.superuser):
-        return None
-
-    entities = []
-    if app:
-        entities.append(('application', app, list(app.access_control_groups.all())))
-    elif user:
-        entities.append(('user', user, list(user.access_control_groups.all())))
-    else:
-        # This should not be possible as it means not authenticated but better
-        # safe than sorry.
-        raise PermissionDenied('Missing authentication!')
-
-    # Check all objects touched by this commit
-    for obj in chain(
-        created_objects.values(),
-        changed_objects.values(),
-        deleted_objects.values(),
-    ):
-        # Check app or if not present user permissions
-        for entity_class, entity_name, groups in entities:
-            acl_violations = {
-                acl: _acl_violations(unchanged_objects, obj, acl)
-                for acl in groups
-            }
-
-            # If all ACLs resulted in violations, none of them allowed the edit
-            # Build a verbose error message and abort the commit
-            if all(acl_violations.values()):
-                msg = (
-                    'Insufficient access rights to object "{}" for {} "{}": '
-                    .format(obj['hostname'], entity_class, entity_name)
-                )
-                for acl, violations in acl_violations.items():
-                    msg += ' '.join(violations)
+    # The ACLs are compiled and cached.  The metadata is pinned for
+    # the default values of the created objects, so checking the objects
+    # doesn't need any more queries.
+    with pin_metadata():
+        if entities is None:
+            entities = _get_acl_entities(user, app)
+        for obj in chain(
+            created_objects.values(),
+            changed_objects.values(),
+            deleted_objects.values(),
+        ):
+            _check_acls(entities, unchanged_objects, obj)
+
+
+def _check_acls(entities: list, unchanged_objects: dict, obj: dict) -> None:
+    """Check the object against the ACLs of all the entities"""
+    # Check app or if not present user permissions
+    for entity_class, entity_name, groups in entities:
+        acl_violations = {
+            acl: _acl_violations(unchanged_objects, obj, acl)
+            for acl in groups
+        }
+
+        # If all ACLs resulted in violations, none of them allowed the edit
+        # Build a verbose error message and abort the commit
+        if all(acl_violations.values()):
+            msg = (
+                'Insufficient access rights to object "{}" for {} "{}": '
+                .format(obj['hostname'], entity_class, entity_name)
+            )
+            for acl, violations in acl_violations.items():
+                msg += ' '.join(violations)
 
-                logger.debug(msg)
-                raise PermissionDenied(msg)
+            logger.debug(msg)
+            raise PermissionDenied(msg)
 
 
 def _acl_violations(touched_objects, pending_changes, acl):
@@ -405,13 +792,9 @@ def _acl_violations(touched_objects, pending_changes, acl):
     violations = []
 
     # Check whether the object matches all the attribute filters of the ACL
-    for attribute_id, attribute_filter in acl.get_filters().items():
-        # TODO: This relies on the object to have all attributes that are
-        #  present in the attribute_filter which currently works because
-        #  we fetch all attributes in commit_query (joined_attribtues).
-        #  This method would be better of not relying on the caller
-        #  making sure passing down all relevant attributes which isn't
-        #  even documented.
+    for attribute_id, attribute_filter in acl.filters.items():
+        # This relies on the object to have all attributes that are
+        # present in the attribute_filter.  See _get_changed_attributes().
         if pending_changes['object_id'] in touched_objects:
             # If the object already exists ensure the ACL matches the status
             # quo and not the wanted changes.
@@ -446,25 +829,20 @@ def _acl_violations(touched_objects, pending_changes, acl):
     else:
         old_object = get_default_attribute_values(pending_changes['servertype'])
 
-    # Gather attribute ids this ACL allows changing
-    attribute_ids = acl.get_permissible_attribute_ids()
+    # Attributes which are related via another servertype can be skipped
+    # because permission to change the value is checked at the target
+    # servertype where the actual change takes place.
+    related_via_attribute_ids = acl.related_via_attribute_ids.get(
+        pending_changes['servertype'], ()
+    )
 
     # Check whether all changed attributes are on this ACLs attribute whitelist
     for attribute_id, attribute_value in pending_changes.items():
         if (
-            attribute_id not in attribute_ids and
+            attribute_id not in acl.attribute_ids and
+            attribute_id not in related_via_attribute_ids and
             attribute_value != old_object[attribute_id]
         ):
-            is_related_via: bool = ServertypeAttribute.objects.filter(
-                servertype_id=pending_changes['servertype'],
-                attribute_id=attribute_id,
-                related_via_attribute__isnull=False
-            ).exists()
-            if is_related_via:
-                # Attributes which are related via another servertype can be
-                # skipped because permission to change the value is checked
-                # at the target servertype where the actual change takes place.
-                continue
 
             violations.append(
                 'Change is not covered by ACL "{}", Attribute "{}" was '
@@ -480,7 +858,11 @@ def _log_changes(user, app, changed, created_objects, deleted_objects) -> int:
     changes = list()
     commit = ChangeCommit(user=user, app=app)
 
-    excl_attrs = Attribute.objects.filter(history=False).values_list(flat=True)
+    excl_attrs = {
+        a.attribute_id
+        for a in get_metadata().attributes.values()
+        if not a.history
+    }
     for updates in changed:
         # At least one attribute aside from object_id has changed.
         if len(updates.keys() - excl_attrs) > 1:
@@ -516,11 +898,30 @@ def _log_changes(user, app, changed, created_objects, deleted_objects) -> int:
     return commit.id
 
 
+def _increment_commit_version():
+    """Let the query cache know about the commit
+
+    The version is updated at the end of the transaction to hold the lock
+    on its row as short as possible.  The other processes see the new
+    version together with the changes, even if the commit is a part of
+    an outer transaction.  See the query_cache module.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE commit_version SET version = nextval('commit_version_seq')"
+        )
+
+
 def _fetch_servers(object_ids):
     servers = {
         s.server_id: s
         for s
-        in Server.objects.select_for_update().filter(server_id__in=object_ids)
+        in (
+            Server.objects
+            .select_related('servertype')
+            .select_for_update(of=('self', ))
+            .filter(server_id__in=object_ids)
+        )
     }
     for object_id in object_ids:
         if object_id in servers:
@@ -530,6 +931,19 @@ def _fetch_servers(object_ids):
     return servers
 
 
+def _get_servers(hostnames):
+    if not hostnames:
+        return {}
+
+    return {
+        s.hostname: s for s in Server.objects.filter(hostname__in=hostnames)
+    }
+
+
+def _get_server_ids(hostnames):
+    return {h: s.server_id for h, s in _get_servers(hostnames).items()}
+
+
 def _materialize(servers, joined_attributes):
     return {
         o['object_id']: o
@@ -538,11 +952,13 @@ def _materialize(servers, joined_attributes):
 
 
 def _get_servertype_attributes(servers):
+    metadata = get_metadata()
     servertype_attributes = dict()
     for servertype_id in {s['servertype'] for s in servers.values()}:
-        servertype_attributes[servertype_id] = dict()
-        for sa in Servertype.objects.get(pk=servertype_id).attributes.all():
-            servertype_attributes[servertype_id][sa.attribute_id] = sa
+        metadata.get_servertype(servertype_id)
+        servertype_attributes[servertype_id] = (
+            metadata.servertype_attributes[servertype_id]
+        )
 
     return servertype_attributes
 
@@ -683,7 +1099,7 @@ def _build_error_message(violations_attribs, violations_readonly,
 
 def _get_servertype(attributes):
     try:
-        return Servertype.objects.get(pk=attributes['servertype'])
+        return get_metadata().get_servertype(attributes['servertype'])
     except Servertype.DoesNotExist:
         raise CommitError('Unknown servertype: ' + attributes['servertype'])
 
@@ -725,7 +1141,8 @@ def _validate_real_attributes(servertype, real_attributes):     # NOQA: C901
     violations_regexp = []
     violations_required = []
     servertype_attributes = set()
-    for sa in servertype.attributes.all():
+    metadata = get_metadata()
+    for sa in metadata.servertype_attributes[servertype.pk].values():
         attribute = sa.attribute
         servertype_attributes.add(attribute)
 
@@ -774,9 +1191,12 @@ def _validate_real_attributes(servertype, real_attributes):     # NOQA: C901
     )
 
 
-def _insert_server(hostname, intern_ip, servertype, attributes):
+def _new_server(hostname, intern_ip, servertype, created_servers):
 
-    if Server.objects.filter(hostname=hostname).exists():
+    if (
+        any(s.hostname == hostname for s in created_servers) or
+        Server.objects.filter(hostname=hostname).exists()
+    ):
         raise CommitError(f'Server with hostname "{hostname}" already exists')
 
     server = Server(
@@ -784,15 +1204,7 @@ def _insert_server(hostname, intern_ip, servertype, attributes):
         intern_ip=intern_ip,
         servertype=servertype,
     )
-    server.full_clean()
-    server.save()
-
-    for attribute, value in attributes.items():
-        if attribute.multi:
-            for single_value in value:
-                server.add_attribute(attribute, single_value)
-        else:
-            server.add_attribute(attribute, value)
+    _clean_server(server)
 
     return server
 
@@ -3,17 +3,276 @@
 Copyright (c) 2019 InnoGames GmbH
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db import DataError, connection, transaction
+from django.db import (
+    DataError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+
+from adminapi.filters import All, Any, GreaterThan
+from serveradmin.serverdb.filter_optimizer import optimize_filter
+from serveradmin.serverdb.metadata import get_metadata, pin_metadata
+from serveradmin.serverdb.models import Attribute
+from serveradmin.serverdb.query_budget import apply_budget
+from serveradmin.serverdb.query_profiler import profile_phase
+from serveradmin.serverdb.sql_generator import (
+    ORDER_BY_TYPES,
+    get_order_by_columns,
+    get_server_count_query,
+    get_server_query,
+)
+from serveradmin.serverdb.query_materializer import (
+    QueryMaterializer,
+    get_server_row,
+)
+from serveradmin.serverdb.statement_cache import execute
+
+# The temporary table to keep the servers matching the query
+SERVER_TABLE = 'query_server'
+
+# The threads to execute the queries for the coroutines
+_executor = None
+
+
+def execute_query(
+    filters, restrict, order_by, limit=None, offset=None, after=None,
+    profile=None, budget=None,
+):
+    """The main function to execute queries
+
+    The result can be paginated by "limit" and "offset" or by "after",
+    the hostname of the last object of the previous page.  The latter
+    is the keyset pagination which doesn't get slower on the later pages.
+
+    The generated SQL, its plan and the timings of the phases are recorded
+    on the profile, if one is given.  See the query profiler module.
+    The query is bounded by the budget, if one is given.  See the query
+    budget module.
+    """
+
+    # The metadata is pinned, so its version is checked only once for
+    # the whole query.
+    with profile_phase(profile, 'metadata'):
+        metadata = get_metadata()
+    with pin_metadata(metadata):
+        with profile_phase(profile, 'metadata'):
+            prepared_query = _prepare_execution(
+                filters, restrict, order_by, limit, offset, after
+            )
+
+        # REPEATABLE READ isolation level ensures Postgres to give us
+        # a consistent snapshot for the database transaction.  We cannot set
+        # READ ONLY in here, because the matching servers are kept on
+        # a temporary table.
+        with transaction.atomic():
+            connection.cursor().execute(
+                'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'
+            )
+            with apply_budget(budget):
+                return _execute_prepared_query(
+                    *prepared_query, profile=profile, budget=budget
+                )
+
+
+async def execute_query_async(*args, **kwargs):
+    """Execute the query like execute_query() for the coroutines"""
+
+    return await run_async(execute_query, *args, **kwargs)
+
+
+async def run_async(func, *args, **kwargs):
+    """Run the function using the database without blocking the event loop
+
+    It is run on one of the threads reserved for the queries.  The threads
+    keep their database connections like the request threads do, so
+    the number of them bounds the number of the connections of the process
+    as a pool.  The coroutines wait for a free thread otherwise.
+    """
+
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            settings.ASYNC_QUERY_THREADS, thread_name_prefix='query'
+        )
+
+    return await sync_to_async(
+        _run_with_connection, thread_sensitive=False, executor=_executor
+    )(partial(func, *args, **kwargs))
+
+
+def _run_with_connection(func):
+    # The connection of the thread is reused until it is closed like after
+    # the requests respecting CONN_MAX_AGE and the errors.
+    close_old_connections()
+    return func()
+
+
+def execute_queries(queries, budget=None):
+    """Execute multiple queries in a single snapshot
+
+    The queries are given as the tuples of the arguments of execute_query().
+    They are executed in the same transaction, so their results are
+    consistent with each other, and the metadata is looked up only once for
+    all of them.  The budget is for all of them together.  Returns the list
+    of the results.
+    """
 
-from adminapi.filters import Any
-from serveradmin.serverdb.models import Attribute, ServertypeAttribute, Server
-from serveradmin.serverdb.sql_generator import get_server_query
-from serveradmin.serverdb.query_materializer import QueryMaterializer
+    with pin_metadata():
+        prepared_queries = [_prepare_execution(*q) for q in queries]
 
+        with transaction.atomic():
+            connection.cursor().execute(
+                'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'
+            )
+            with apply_budget(budget):
+                return _execute_prepared_queries(prepared_queries, budget)
+
+
+def _execute_prepared_queries(prepared_queries, budget):
+    return [
+        _execute_prepared_query(*prepared_query, budget=budget)
+        for prepared_query in prepared_queries
+    ]
+
+
+def _prepare_execution(
+    filters, restrict, order_by, limit=None, offset=None, after=None
+):
+    """Prepare the query and return the arguments to execute it"""
+
+    _check_pagination(limit, offset)
+    return _prepare_query(
+        filters, restrict, _get_order_by(order_by), after
+    ) + (limit, offset)
+
+
+def _execute_prepared_query(
+    filters, attribute_lookup, related_vias, materializer_args, sql_order_by,
+    limit, offset, profile=None, budget=None,
+):
+    """Execute the prepared query within the transaction"""
+
+    # The actual query execution procedure is 2 steps: first filtering
+    # the objects, and then materializing the requested attributes.
+    # The joined attributes are also handled on the materialization step.
+    # See the query materializer module for its details.  The functions
+    # on this module continues with the filtering step.
+    #
+    # When the ordering can be done by the database, the objects come
+    # already sorted from it, so we can limit them in there and only
+    # materialize the requested page.  Otherwise, the ordering has to be
+    # handled by the materializer, because some properties of
+    # the attribute values which might be relevant for ordering may be
+    # lost after the materialization.  We can only cut the page after
+    # the materializer has sorted all of them.
+    if sql_order_by is not None:
+        with profile_phase(profile, 'filter'):
+            servers = _get_servers(
+                filters, attribute_lookup, related_vias, limit, offset,
+                sql_order_by, profile,
+            )
+        if budget is not None:
+            budget.add_rows(len(servers))
+        return list(QueryMaterializer(
+            servers, *materializer_args, server_table=SERVER_TABLE,
+            profile=profile, budget=budget,
+        ))
+
+    with profile_phase(profile, 'filter'):
+        servers = _get_servers(
+            filters, attribute_lookup, related_vias, profile=profile
+        )
+    if budget is not None:
+        budget.add_rows(len(servers))
+    return _paginate(
+        QueryMaterializer(
+            servers, *materializer_args, server_table=SERVER_TABLE,
+            profile=profile, budget=budget,
+        ),
+        limit,
+        offset,
+    )
+
+
+def stream_query(
+    filters, restrict, order_by, limit=None, offset=None, after=None,
+    chunk_size=None, budget=None,
+):
+    """Execute the query and iterate the results chunk by chunk
+
+    In contrast to execute_query(), the matching objects are read from
+    the database through a server-side cursor and materialized in chunks,
+    so the memory usage is bounded by the chunk size instead of the size of
+    the result.  This is not possible, when the results cannot be ordered
+    by the database.  They are materialized altogether in this case.
+
+    The query is already executed before this function returns, so the
+    errors are raised by it, and not while iterating the results.  Only
+    exceeding the budget can be detected after the first chunk.
+
+    The transaction is kept open while iterating, so the returned generator
+    has to be closed, if it is not exhausted.  Nothing else can be done on
+    the connection until then.  This is for the responses of the API which
+    close it after sending the results.
+    """
+
+    _check_pagination(limit, offset)
+    metadata = get_metadata()
+    with pin_metadata(metadata):
+        (
+            prepared_filters, attribute_lookup, related_vias,
+            materializer_args, sql_order_by,
+        ) = _prepare_query(filters, restrict, _get_order_by(order_by), after)
+    if sql_order_by is None:
+        with pin_metadata(metadata):
+            results = execute_query(
+                filters, restrict, order_by, limit, offset, after,
+                budget=budget,
+            )
+        return (o for o in results)
+
+    if chunk_size is None:
+        chunk_size = settings.QUERY_CHUNK_SIZE
+
+    results = _stream_servers(
+        prepared_filters,
+        attribute_lookup,
+        related_vias,
+        materializer_args,
+        sql_order_by,
+        limit,
+        offset,
+        chunk_size,
+        budget,
+        metadata,
+    )
+
+    # The first iteration starts the transaction and fetches the first chunk.
+    next(results)
+
+    return results
+
+
+def _prepare_query(filters, restrict, order_by, after):
+    """Prepare everything we need to know before executing the query
+
+    Returns the filters, the attribute lookup, the related vias,
+    the arguments for the query materializer and the ordering to be done
+    by the database.  The latter is None, if the materializer has to
+    order the objects.
+    """
 
-def execute_query(filters, restrict, order_by):
-    """The main function to execute queries"""
+    if after is not None:
+        filters = _add_after_filter(filters, order_by, after)
 
     # We need the restrict argument in slightly different structure.
     if restrict is None:
@@ -41,28 +300,7 @@ def execute_query(filters, restrict, order_by):
         _update_attribute_lookup(attribute_lookup, attribute_ids)
     _check_attributes_exist(attribute_ids, attribute_lookup)
 
-    # If we have real attributes on the query filter, we can use them to
-    # get the possible servertypes.  This is necessary to eliminate
-    # not-desired objects.  We also use them to eliminate the servertype
-    # attribute relations passed to the SQL generator module in "related_vias".
-    # This is an optimization that matters, because all of those in
-    # "related_vias" hit the database as complicated sub-queries.
-    related_vias = {}
-    real_attribute_ids = [a for a in filters if a not in Attribute.specials]
-    if real_attribute_ids:
-        servertype_attributes = list(ServertypeAttribute.objects.filter(
-            attribute_id__in=real_attribute_ids
-        ))
-        servertype_ids = _get_possible_servertype_ids(servertype_attributes)
-        filters = dict(filters)
-        servertype_ids = _override_servertype_filter(filters, servertype_ids)
-        servertype_attributes = [
-            sa for sa in servertype_attributes
-            if sa.servertype_id in servertype_ids
-        ]
-        _update_related_vias(
-            related_vias, servertype_attributes, attribute_lookup
-        )
+    filters, related_vias = _prepare_filters(filters, attribute_lookup)
 
     # Here we prepare the join dictionary for the query materializer.
     # For None on the restrict argument, we just use the complete list of
@@ -77,28 +315,193 @@ def execute_query(filters, restrict, order_by):
             }
         materializer_args = [cast(joins)]
 
-    if order_by is not None:
+    sql_order_by = _get_sql_order_by(order_by, attribute_lookup)
+    if sql_order_by is None:
         materializer_args.append([attribute_lookup[a] for a in order_by])
 
-    # REPEATABLE READ isolation level ensures Postgres to give us a consistent
-    # snapshot for the database transaction.  We also set READ ONLY as this
-    # is a query operation.  Perhaps this is also enabling some optimization
-    # on the Postgres side.
+    return (
+        filters, attribute_lookup, related_vias, materializer_args,
+        sql_order_by,
+    )
+
+
+def _get_sql_order_by(order_by, attribute_lookup):
+    """Get the ordering to be done by the database
+
+    The database can order by the special attributes and the single valued
+    attributes stored on the servers themselves.  The others are left to
+    the query materializer.  Returns the attributes with the servertypes
+    having them for the SQL generator module, or None.
+    """
+
+    if order_by is None:
+        return []
+
+    attribute_servertypes = get_metadata().attribute_servertypes
+    sql_order_by = []
+    for attribute_id in order_by:
+        attribute = attribute_lookup[attribute_id]
+        servertype_attributes = attribute_servertypes.get(
+            attribute_id, {}
+        ).values()
+        if not attribute.special and (
+            attribute.multi or
+            attribute.type not in ORDER_BY_TYPES or
+            any(sa.related_via_attribute_id for sa in servertype_attributes)
+        ):
+            return None
+
+        sql_order_by.append(
+            (attribute, [sa.servertype_id for sa in servertype_attributes])
+        )
+
+    return sql_order_by
+
+
+def _stream_servers(
+    filters, attribute_lookup, related_vias, materializer_args, sql_order_by,
+    limit, offset, chunk_size, budget, metadata,
+):
+    """Materialize the matching servers chunk by chunk
+
+    This generator yields None once, after the first chunk is fetched, and
+    the materialized objects after that.  The transaction is kept open until
+    the generator is exhausted or closed.  The metadata is pinned only
+    between the yields, as the caller runs in between.
+    """
+
     with transaction.atomic():
         connection.cursor().execute(
             'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'
         )
+        with apply_budget(budget):
+            with pin_metadata(metadata):
+                attribute_filters = _get_attribute_filters(
+                    filters, attribute_lookup, related_vias
+                )
+                if attribute_filters is not None:
+                    # Server-side cursors cannot be declared for prepared
+                    # statements.
+                    sql_query, params = get_server_query(
+                        attribute_filters, related_vias, limit, offset,
+                        sql_order_by,
+                    )
+            if attribute_filters is None:
+                yield
+                return
+
+            with connection.chunked_cursor() as cursor:
+                try:
+                    cursor.execute(sql_query, params)
+                    rows = cursor.fetchmany(chunk_size)
+                except DataError as error:
+                    raise ValidationError(error)
+                if budget is not None:
+                    budget.add_rows(len(rows))
+
+                yield
+
+                while rows:
+                    servers = [get_server_row(*row[:4]) for row in rows]
+                    with pin_metadata(metadata):
+                        objects = list(QueryMaterializer(
+                            servers, *materializer_args, budget=budget
+                        ))
+                    yield from objects
+                    rows = cursor.fetchmany(chunk_size)
+                    if budget is not None:
+                        budget.add_rows(len(rows))
+
+
+def execute_count(filters, after=None, budget=None):
+    """Count the objects matching the filters
+
+    Only the filtering step of the query execution is done in here.  Nothing
+    is materialized, so this is a single query to the database.  Only
+    the statement timeout of the budget applies to it.
+    """
 
-        # The actual query execution procedure is 2 steps: first filtering
-        # the objects, and then materializing the requested attributes.
-        # The joined attributes and ordering are also handled on
-        # the materialization step.  Ordering has to be handled by it, because
-        # some properties of the attribute values which might be relevant
-        # for ordering may be lost after the materialization.  See the query
-        # materializer module for its details.  The functions on this module
-        # continues with the filtering step.
-        servers = _get_servers(filters, attribute_lookup, related_vias)
-        return list(QueryMaterializer(servers, *materializer_args))
+    if after is not None:
+        filters = _add_after_filter(filters, None, after)
+
+    with pin_metadata():
+        attribute_ids = set(_collect_attribute_ids(filters=filters))
+        attribute_lookup = dict(Attribute.specials)
+        if any(a not in attribute_lookup for a in attribute_ids):
+            _update_attribute_lookup(attribute_lookup, attribute_ids)
+        _check_attributes_exist(attribute_ids, attribute_lookup)
+
+        filters, related_vias = _prepare_filters(filters, attribute_lookup)
+        attribute_filters = _get_attribute_filters(
+            filters, attribute_lookup, related_vias
+        )
+        if attribute_filters is None:
+            return 0
+
+        sql_query, params = get_server_count_query(
+            attribute_filters, related_vias
+        )
+    try:
+        with transaction.atomic(), apply_budget(budget):
+            with connection.cursor() as cursor:
+                execute(cursor, sql_query, params)
+                return cursor.fetchone()[0]
+    except DataError as error:
+        raise ValidationError(error)
+
+
+def _check_pagination(limit, offset):
+    """Check whether the pagination arguments are sane"""
+
+    for name, value in (('limit', limit), ('offset', offset)):
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValidationError('"{}" must be an integer'.format(name))
+        if value < 0:
+            raise ValidationError('"{}" must not be negative'.format(name))
+
+
+def _get_order_by(order_by):
+    """Get the ordering to be done by the query materializer
+
+    Ordering by the hostname is what the SQL query does anyway, so we don't
+    need to sort again after the materialization.  This also allows us to
+    push the pagination down to the database.
+    """
+
+    if order_by is not None and list(order_by) == ['hostname']:
+        return None
+
+    return order_by
+
+
+def _add_after_filter(filters, order_by, after):
+    """Add the filter for the keyset pagination
+
+    The keyset pagination is nothing more than an additional filter on
+    the hostname, so it only works when the results are ordered by it.
+    """
+
+    if order_by is not None:
+        raise ValidationError(
+            'Pagination with "after" requires ordering by hostname'
+        )
+
+    filters = dict(filters)
+    if 'hostname' in filters:
+        filters['hostname'] = All(filters['hostname'], GreaterThan(after))
+    else:
+        filters['hostname'] = GreaterThan(after)
+
+    return filters
+
+
+def _paginate(results, limit, offset):
+    start = offset or 0
+    stop = None if limit is None else start + limit
+
+    return list(islice(results, start, stop))
 
 
 def _get_joins(restrict):
@@ -135,13 +538,13 @@ def _collect_attribute_ids(joins=None, filters=None, order_by=None):
 
 
 def _update_attribute_lookup(attribute_lookup, attribute_ids=None):
+    attributes = get_metadata().attributes
     if attribute_ids is None:
-        queryset = Attribute.objects.all()
+        attribute_lookup.update(attributes)
     else:
-        queryset = Attribute.objects.filter(attribute_id__in=attribute_ids)
-
-    for attribute in queryset:
-        attribute_lookup[attribute.attribute_id] = attribute
+        for attribute_id in attribute_ids:
+            if attribute_id in attributes:
+                attribute_lookup[attribute_id] = attributes[attribute_id]
 
 
 def _check_attributes_exist(attribute_ids, attribute_lookup):
@@ -152,6 +555,39 @@ def _check_attributes_exist(attribute_ids, attribute_lookup):
             raise ObjectDoesNotExist('No attribute "{}"'.format(attribute_id))
 
 
+def _prepare_filters(filters, attribute_lookup):
+    """Prepare the filters and the related_vias for the SQL generator module
+
+    If we have real attributes on the query filter, we can use them to
+    get the possible servertypes.  This is necessary to eliminate
+    not-desired objects.  We also use them to eliminate the servertype
+    attribute relations passed to the SQL generator module in "related_vias".
+    This is an optimization that matters, because all of those in
+    "related_vias" hit the database as complicated sub-queries.
+    """
+    related_vias = {}
+    real_attribute_ids = [a for a in filters if a not in Attribute.specials]
+    if real_attribute_ids:
+        attribute_servertypes = get_metadata().attribute_servertypes
+        servertype_attributes = [
+            sa
+            for a in real_attribute_ids
+            for sa in attribute_servertypes.get(a, {}).values()
+        ]
+        servertype_ids = _get_possible_servertype_ids(servertype_attributes)
+        filters = dict(filters)
+        servertype_ids = _override_servertype_filter(filters, servertype_ids)
+        servertype_attributes = [
+            sa for sa in servertype_attributes
+            if sa.servertype_id in servertype_ids
+        ]
+        _update_related_vias(
+            related_vias, servertype_attributes, attribute_lookup
+        )
+
+    return filters, related_vias
+
+
 def _get_possible_servertype_ids(servertype_attributes):
     """Get the servertypes that can possible match with the query with
     the given attributes
@@ -231,8 +667,64 @@ def _update_related_vias(
         _update_related_vias(related_vias, to_be_looked_up, attribute_lookup)
 
 
-def _get_servers(filters, attribute_lookup, related_vias):
-    """Evaluate the filters to fetch the matching servers"""
+def _get_servers(
+    filters, attribute_lookup, related_vias, limit=None, offset=None,
+    order_by=(), profile=None,
+):
+    """Evaluate the filters to fetch the matching servers
+
+    The matching servers are kept on a temporary table until the end of
+    the transaction.  The query materializer joins it instead of passing
+    the ids of possibly many thousands of servers back to the database.
+    The table of the previous query of the same transaction is dropped
+    first.
+    The table is created by EXPLAIN ANALYZE, when profiling, so the plan
+    is of the very execution.
+    """
+
+    attribute_filters = _get_attribute_filters(
+        filters, attribute_lookup, related_vias
+    )
+    if attribute_filters is None:
+        return []
+
+    # If you managed to read this so far, the last step is refreshingly
+    # easy: get and execute the raw SQL query.
+    sql_query, params = get_server_query(
+        attribute_filters, related_vias, limit, offset, order_by
+    )
+    create_sql = 'CREATE TEMPORARY TABLE {} ON COMMIT DROP AS '.format(
+        SERVER_TABLE
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(SERVER_TABLE))
+            if profile is None:
+                execute(cursor, sql_query, params, create_sql)
+            else:
+                profile.sql = sql_query
+                profile.params = params
+                cursor.execute(
+                    'EXPLAIN (ANALYZE, BUFFERS) ' + create_sql + sql_query,
+                    params,
+                )
+                profile.plan = '\n'.join(r[0] for r in cursor.fetchall())
+            cursor.execute(
+                'SELECT server_id, hostname, intern_ip, servertype_id'
+                ' FROM {} ORDER BY {}'.format(
+                    SERVER_TABLE, ', '.join(get_order_by_columns(order_by))
+                )
+            )
+            return [get_server_row(*row) for row in cursor.fetchall()]
+    except DataError as error:
+        raise ValidationError(error)
+
+
+def _get_attribute_filters(filters, attribute_lookup, related_vias):
+    """Prepare the filters to be passed to the SQL generator module
+
+    Returns None, if the filters are destined to fail.
+    """
 
     # From now on, we will pass the filters dictionary using the attribute
     # objects as the keys.  The SQL generator module will repeatedly need
@@ -240,24 +732,21 @@ def _get_servers(filters, attribute_lookup, related_vias):
     attribute_filters = []
     for attribute_id, filt in filters.items():
 
-        # Before we actually execute the query, we can check the destiny of
-        # the filters.  If one is destined to fail, we can just return empty
-        # result.  If some are destined to pass, we can just remove them.
+        # Before we actually execute the query, we can simplify the filters
+        # and check their destiny.  If one is destined to fail, we can just
+        # return empty result.  If some are destined to pass, we can just
+        # remove them.  See the filter optimizer module for the details.
         # We could do this much earlier, even before preparing the attribute
         # lookup, but we don't because we still want to raise an error for
         # nonexistent attributes.
+        attribute = attribute_lookup[attribute_id]
+        filt = optimize_filter(attribute, filt, related_vias)
         destiny = filt.destiny()
         if destiny is False:
-            return []
+            return None
         if destiny is True:
             continue
 
-        attribute_filters.append((attribute_lookup[attribute_id], filt))
+        attribute_filters.append((attribute, filt))
 
-    # If you managed to read this so far, the last step is refreshingly
-    # easy: get and execute the raw SQL query.
-    sql_query = get_server_query(attribute_filters, related_vias)
-    try:
-        return list(Server.objects.defer('intern_ip').raw(sql_query))
-    except DataError as error:
-        raise ValidationError(error)
+    return attribute_filters
@@ -10,46 +10,105 @@ Copyright (c) 2019 InnoGames GmbH
 
 import logging
 
+from datetime import date, datetime, timezone
+from decimal import Decimal
 from ipaddress import IPv4Address, IPv6Address
+from itertools import chain
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
 from adminapi.dataset import DatasetObject
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.query_profiler import profile_phase
 from serveradmin.serverdb.models import (
-    Servertype,
     Attribute,
-    ServertypeAttribute,
     Server,
     ServerAttribute,
-    ServerRelationAttribute, ServerInetAttribute,
+    ServerRelationAttribute, ServerInetAttribute, ServerInetSupernet,
+    ServerMACAddressAttribute,
 )
 
 logger = logging.getLogger(__package__)
 
+# The marker for the attributes the servers don't have, as opposed to
+# the ones they have, but are not set
+MISSING = object()
+
+
+class ServerRow:
+    """Compact representation of a server
+
+    The query materializer deals with lots of servers, so it uses these
+    instead of the model instances.  They are equal, when their ids are.
+    """
+
+    __slots__ = ("server_id", "hostname", "intern_ip", "servertype_id")
+
+    def __init__(self, server_id, hostname, intern_ip, servertype_id):
+        self.server_id = server_id
+        self.hostname = hostname
+        self.intern_ip = intern_ip
+        self.servertype_id = servertype_id
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ServerRow) and
+            self.server_id == other.server_id
+        )
+
+    def __hash__(self):
+        return hash(self.server_id)
+
+    def __str__(self):
+        return self.hostname
+
+    def __repr__(self):
+        return "ServerRow({!r})".format(self.hostname)
+
 
 class QueryMaterializer:
-    def __init__(self, servers, joined_attributes, order_by_attributes=[]):
-        self._servers = servers
+    def __init__(
+        self, servers, joined_attributes, order_by_attributes=[],
+        server_table=None, profile=None, budget=None,
+    ):
+        """Materialize the attributes of the servers
+
+        The servers may be kept on a table on the database by the caller
+        additionally.  The attribute values are then selected by joining
+        it instead of passing the ids of all of the servers to the queries.
+
+        The values are kept in lists indexed by the slots assigned to
+        the attributes, and the objects are only built while iterating.
+        The phases are timed on the profile, if one is given, and
+        the attribute values are accounted for on the budget, before
+        fetching them.
+        """
+        self._servers = [_to_server_row(s) for s in servers]
+        self._server_table = server_table
         self._joined_attributes = joined_attributes
         self._order_by_attributes = order_by_attributes
-        # XXX: Optimize this query out
-        self._servertype_lookup = {
-            servertype.servertype_id: servertype
-            for servertype in Servertype.objects.all()
-        }
+        self._profile = profile
+        self._budget = budget
+        self._metadata = get_metadata()
+        self._servertype_lookup = self._metadata.servertypes
+        self._objects = {}
 
-        self._server_attributes = {}
         servers_by_type = {}
         for server in self._servers:
-            self._server_attributes[server] = {
-                Attribute.specials["object_id"]: server.server_id,
-                Attribute.specials["hostname"]: server.hostname,
-                Attribute.specials["intern_ip"]: server.intern_ip,
-                Attribute.specials["servertype"]: server.servertype_id,
-            }
             servers_by_type.setdefault(server.servertype_id, []).append(server)
 
         self._select_attributes(servers_by_type.keys())
+        if budget is not None:
+            budget.add_cells(sum(
+                len(servers_by_type[s])
+                for ids in self._servertype_ids_by_attribute.values()
+                for s in ids
+            ))
         self._initialize_attributes(servers_by_type)
         self._add_attributes(servers_by_type)
-        self._add_related_attributes(servers_by_type)
+        with profile_phase(profile, "attributes.related"):
+            self._add_related_attributes(servers_by_type)
 
     def __iter__(self):
         servers = self._servers
@@ -61,11 +120,16 @@ class QueryMaterializer:
                     for a in self._order_by_attributes
                 )
 
-            servers = sorted(servers, key=order_by_key)
+            with profile_phase(self._profile, "sorting"):
+                servers = sorted(servers, key=order_by_key)
 
-        join_results = self._get_join_results()
+        with profile_phase(self._profile, "joins"):
+            levels = self._materialize_joins()
         return (
-            DatasetObject(self._get_attributes(s, join_results), s.server_id)
+            DatasetObject(
+                self._get_attributes(s, self._joined_attributes, levels),
+                s.server_id,
+            )
             for s in servers
         )
 
@@ -74,237 +138,314 @@ class QueryMaterializer:
         self._servertype_ids_by_attribute = {}
         self._related_servertype_attributes = []
         attributes = {a.attribute_id: a for a in self._joined_attributes}
-        for sa in ServertypeAttribute.objects.filter(
-            servertype_id__in=servertype_ids,
-            attribute__in=self._joined_attributes,
-        ):
-            attribute = attributes[sa.attribute_id]
-            self._select_servertype_attribute(attribute, sa)
+        servertype_attributes = self._metadata.servertype_attributes
+        selected = set()
+        for servertype_id in sorted(servertype_ids):
+            for sa in servertype_attributes.get(servertype_id, {}).values():
+                if sa.attribute_id in attributes:
+                    attribute = attributes[sa.attribute_id]
+                    self._select_servertype_attribute(attribute, sa, selected)
+
+        # Every selected attribute gets its slot on the value lists
+        self._slots = {
+            a: i for i, a in enumerate(self._servertype_ids_by_attribute)
+        }
 
-    def _select_servertype_attribute(self, attribute, sa):
-        self._attributes_by_type.setdefault(attribute.type, set()).add(attribute)
-        self._servertype_ids_by_attribute.setdefault(attribute, []).append(
-            sa.servertype_id
-        )
+    def _select_servertype_attribute(self, attribute, sa, selected):
+        """Select the attribute of the servertype with its relations
 
-        related_via_attribute_id = sa.related_via_attribute_id
-        if related_via_attribute_id:
-            # TODO: Order the list in a way to support recursive related
-            # attributes.
-            self._related_servertype_attributes.append((attribute, sa))
-
-            # If we have related attributes in the attribute list, we have
-            # to add the relations in there, too.  We are going to use
-            # those to query the related attributes.
-            # TODO: Optimize this to avoid recursion and selecting related
-            # attribute in here
-            sa = (
-                ServertypeAttribute.objects.filter(
-                    servertype_id=sa.servertype_id,
-                    attribute_id=related_via_attribute_id,
-                )
-                .prefetch_related("attribute")
-                .get()
+        If we have related attributes in the attribute list, we have to
+        add the relations in there, too.  We are going to use those to
+        query the related attributes.  They may be related via another
+        attribute themselves.
+        """
+        while (sa.attribute_id, sa.servertype_id) not in selected:
+            selected.add((sa.attribute_id, sa.servertype_id))
+            self._attributes_by_type.setdefault(attribute.type, set()).add(
+                attribute
+            )
+            self._servertype_ids_by_attribute.setdefault(attribute, []).append(
+                sa.servertype_id
             )
-            self._select_servertype_attribute(sa.attribute, sa)
+
+            related_via_attribute_id = sa.related_via_attribute_id
+            if not related_via_attribute_id:
+                break
+            self._related_servertype_attributes.append(sa)
+            sa = self._metadata.servertype_attributes[sa.servertype_id][
+                related_via_attribute_id
+            ]
+            attribute = sa.attribute
 
     def _initialize_attributes(self, servers_by_type):
+        self._values = {
+            s.server_id: [MISSING] * len(self._slots) for s in self._servers
+        }
         for attribute, servertype_ids in self._servertype_ids_by_attribute.items():
             init = attribute.initializer()
+            slot = self._slots[attribute]
             for servertype_id in servertype_ids:
                 for server in servers_by_type[servertype_id]:
-                    self._server_attributes[server][attribute] = init()
+                    self._values[server.server_id][slot] = init()
 
     def _add_attributes(self, servers_by_type):
         """Add the attributes to the results"""
+        stored_attributes = []
         for key, attributes in self._attributes_by_type.items():
             if key == "supernet":
-                for attribute in attributes:
-                    self._add_supernet_attribute(
-                        attribute,
-                        (
-                            s
-                            for st in self._servertype_ids_by_attribute[attribute]
-                            for s in servers_by_type[st]
-                        ),
-                    )
+                with profile_phase(self._profile, "attributes.supernet"):
+                    for attribute in attributes:
+                        self._add_supernet_attribute(attribute)
             elif key == "domain":
-                for attribute in attributes:
-                    self._add_domain_attribute(
-                        attribute,
-                        [
-                            s
-                            for st in self._servertype_ids_by_attribute[attribute]
-                            for s in servers_by_type[st]
-                        ],
-                    )
+                with profile_phase(self._profile, "attributes.domain"):
+                    for attribute in attributes:
+                        self._add_domain_attribute(attribute)
             elif key == "reverse":
-                reversed_attributes = {a.reversed_attribute_id: a for a in attributes}
-                for sa in (
-                    ServerRelationAttribute.objects.filter(
-                        value_id__in=self._server_attributes.keys(),
-                        attribute_id__in=reversed_attributes.keys(),
-                    )
-                    .prefetch_related("server")
-                    .defer(
-                        "server__intern_ip",
-                        "server__servertype",
-                    )
-                ):
-                    self._add_attribute_value(
-                        sa.value,
-                        reversed_attributes[sa.attribute_id],
-                        sa.server,
-                    )
+                with profile_phase(self._profile, "attributes.reverse"):
+                    self._add_reverse_attributes(attributes)
             else:
-                attribute_lookup = {a.attribute_id: a for a in attributes}
-                for sa in (
-                    ServerAttribute.get_model(key)
-                    .objects.filter(
-                        server__in=self._server_attributes.keys(),
-                        attribute__in=attributes,
-                    )
-                    .prefetch_related("server")
-                    .defer(
-                        "server__intern_ip",
-                        "server__servertype",
-                    )
-                ):
-                    self._add_attribute_value(
-                        sa.server,
-                        attribute_lookup[sa.attribute_id],
-                        sa.get_value(),
-                    )
-
-    def _add_related_attributes(self, servers_by_type):
-        for attribute, sa in self._related_servertype_attributes:
-            self._add_related_attribute(attribute, sa, servers_by_type)
-
-    def _add_domain_attribute(self, attribute, servers):
-        domain_names = {s.hostname.split(".", 1)[-1] for s in servers}
-        domain_lookup = {
-            domain.hostname: domain
-            for domain in Server.objects.filter(
-                servertype__in=attribute.target_servertype.all(),
-                hostname__in=domain_names,
+                stored_attributes.extend(attributes)
+
+        if stored_attributes:
+            with profile_phase(self._profile, "attributes.stored"):
+                self._add_stored_attributes(stored_attributes)
+
+    def _add_reverse_attributes(self, attributes):
+        """Add the servers relating to the servers by the reversed
+        attributes"""
+        reversed_attributes = {a.reversed_attribute_id: a for a in attributes}
+        for value_id, attribute_id, *server in (
+            ServerRelationAttribute.objects.filter(
+                value_id__in=self._get_server_ids(),
+                attribute_id__in=reversed_attributes.keys(),
+            ).values_list(
+                "value_id",
+                "attribute_id",
+                "server__server_id",
+                "server__hostname",
+                "server__intern_ip",
+                "server__servertype_id",
             )
-        }
-
-        for server in servers:
-            self._server_attributes[server][attribute] = domain_lookup.get(
-                server.hostname.split(".", 1)[-1]
+        ):
+            self._add_attribute_value(
+                value_id,
+                reversed_attributes[attribute_id],
+                ServerRow(*server),
             )
 
-    def _add_supernet_attribute(self, attribute: Attribute, servers_in):
-        """Calculate the supernet attribute of given servers
+    def _add_stored_attributes(self, attributes):
+        """Add the attributes stored on the attribute tables"""
+        server_ids_sql, params = self._get_server_ids_sql("sa.server_id")
+        for server_id, attribute, value in _query_attribute_values(
+            attributes, server_ids_sql, params
+        ):
+            self._add_attribute_value(server_id, attribute, value)
+
+    def _get_server_ids(self):
+        """Get the ids of the servers to filter the ORM queries by
 
-        Get inet attributes of given servers_in (call them hosts), narrow them down to
-        given address family if required. For every attribute found, get inet attributes
-        of servers of given servertype and those servers (call them nets), so that
-        the host's IP address or prefix fits within the net's IP address or prefix.
+        A sub-query is returned instead, when the servers are kept on
+        a table.
         """
+        if self._server_table is None:
+            return list(self._values.keys())
+        return RawSQL("SELECT server_id FROM " + self._server_table, ())
+
+    def _get_server_ids_sql(self, column):
+        """Get the condition and the parameters to filter the raw queries
+        by the servers"""
+        if self._server_table is None:
+            return column + " = ANY(%(server_ids)s)", {
+                "server_ids": list(self._values.keys())
+            }
+        return "{} IN (SELECT server_id FROM {})".format(
+            column, self._server_table
+        ), {}
 
+    def _add_domain_attribute(self, attribute):
+        """Find the servers named as the domains of the servers
+
+        The domains are stored on the servers, so they can be joined by
+        equality.  See Server.domain.
+        """
+        server_ids_sql, params = self._get_server_ids_sql("server.server_id")
+        q = f"""
+            SELECT
+                server.server_id AS host_server_id,
+                domain.server_id,
+                domain.hostname,
+                domain.intern_ip,
+                domain.servertype_id
+            FROM server
+            JOIN server AS domain ON (domain.hostname = server.domain)
+            WHERE
+                domain.servertype_id = ANY(%(target_servertypes)s)
+                AND server.servertype_id = ANY(%(host_servertypes)s)
+                AND {server_ids_sql}
+        """
+        params.update({
+            "target_servertypes": (
+                self._metadata.target_servertype_ids[attribute.attribute_id]
+            ),
+            "host_servertypes": self._servertype_ids_by_attribute[attribute],
+        })
+
+        slot = self._slots[attribute]
+        with connection.cursor() as cursor:
+            cursor.execute(q, params)
+            for host_server_id, *domain in cursor:
+                self._values[host_server_id][slot] = get_server_row(*domain)
+
+    def _add_supernet_attribute(self, attribute: Attribute):
+        """Calculate the supernet attribute of the servers
+
+        Get the servers containing the inet attributes of the servers of
+        the servertypes having the attribute (call them hosts), narrowed
+        down to given address family if required, from the precalculated
+        ServerInetSupernet, and keep the ones (call them nets) of the target
+        servertypes.
+        """
+
+        server_ids_sql, params = self._get_server_ids_sql("host.server_id")
         q = f"""
             SELECT
+                host.server_id AS host_server_id,
+                host.hostname AS host_hostname,
+                host_attr.attribute_id AS host_attr_name,
                 net.server_id,
                 net.hostname,
                 net.intern_ip,
-                net.servertype_id,
-                net_attr.inet_address_family,
-                host_attr.inet_address_family,
-                host.server_id AS host_server_id,
-                host_attr.attribute_id AS host_attr_name
+                net.servertype_id
             FROM server AS host
-            JOIN {ServerInetAttribute._meta.db_table} AS host_addr ON (host.server_id = host_addr.server_id)
-            JOIN {ServerInetAttribute._meta.db_table} AS net_addr ON (host_addr.value <<= net_addr.value AND host_addr.attribute_id = net_addr.attribute_id)
-            JOIN {Server._meta.db_table} AS net ON (net_addr.server_id = net.server_id)
-            JOIN {Attribute._meta.db_table} AS net_attr ON (net_attr.attribute_id = net_addr.attribute_id)
-            JOIN {Attribute._meta.db_table} AS host_attr ON (host_attr.attribute_id = host_addr.attribute_id)
+            JOIN {ServerInetSupernet._meta.db_table} AS supernet
+                ON (host.server_id = supernet.server_id)
+            JOIN {Server._meta.db_table} AS net
+                ON (supernet.supernet_id = net.server_id)
+            JOIN {Attribute._meta.db_table} AS host_attr
+                ON (host_attr.attribute_id = supernet.attribute_id)
             WHERE
                 net.servertype_id = ANY(%(target_servertypes)s)
-                AND host.server_id = any(%(hosts)s)
+                AND host.servertype_id = ANY(%(host_servertypes)s)
+                AND {server_ids_sql}
         """
 
         if attribute.inet_address_family:
             q += """
-                AND net_attr.inet_address_family = %(address_family)s
                 AND host_attr.inet_address_family = %(address_family)s
             """
 
-        servers_by_id = {s.server_id: s for s in servers_in}
-
-        supernets = Server.objects.raw(
-            q,
-            {
-                "target_servertypes": list(
-                    attribute.target_servertype.values_list(
-                        'servertype_id', flat=True
+        params.update({
+            "target_servertypes": (
+                self._metadata.target_servertype_ids[attribute.attribute_id]
+            ),
+            "address_family": attribute.inet_address_family,
+            "host_servertypes": self._servertype_ids_by_attribute[attribute],
+        })
+
+        slot = self._slots[attribute]
+        host_attr_names = {}
+        with connection.cursor() as cursor:
+            cursor.execute(q, params)
+            for host_server_id, host_hostname, host_attr_name, *net in cursor:
+                cur_supernet = get_server_row(*net)
+                values = self._values[host_server_id]
+                prev_supernet = values[slot]
+                if prev_supernet and prev_supernet != cur_supernet:
+                    # TODO: Raise an exception once all data is cleaned up
+                    # and conflicting AF-unaware attributes are removed.
+                    logger.warning(
+                        f"Conflicting supernet {attribute} for "
+                        f"{host_hostname}: "
+                        f"{host_attr_names[host_server_id]}->{prev_supernet}"
+                        f" vs {host_attr_name}->{cur_supernet}"
                     )
-                ),
-                "address_family": attribute.inet_address_family,
-                "hosts": list(servers_by_id.keys()),
-            },
-            translations={
-                "net.server_id": "server_id",
-                "net.hostname": "hostname",
-                "net.intern_ip": "intern_ip",
-                "net.servertype_id": "servertype_id",
-            },
-        )
-        for cur_supernet in supernets:
-            cur_server = servers_by_id[cur_supernet.host_server_id]
-            prev_supernet = self._server_attributes.get(cur_server, {}).get(attribute)
-            if prev_supernet and prev_supernet != cur_supernet:
-                # TODO: Raise an exception once all data is cleaned up and conflicting
-                # AF-unaware attributes are removed.
-                logger.warning(
-                    f"Conflicting supernet {attribute} for {cur_server.hostname}: "
-                    f"{prev_supernet.host_attr_name}->{prev_supernet} vs {cur_supernet.host_attr_name}->{cur_supernet}"
-                )
-            self._server_attributes[cur_server][attribute] = cur_supernet
-
-    def _add_related_attribute(self, attribute, servertype_attribute, servers_by_type):
-        related_via_attribute = servertype_attribute.related_via_attribute
-
-        # First, index the related servers for fast access later
-        servers_by_related = {}
-        for target in servers_by_type[servertype_attribute.servertype_id]:
-            attributes = self._server_attributes[target]
-            if related_via_attribute in attributes:
-                if related_via_attribute.multi:
-                    for source in attributes[related_via_attribute]:
-                        servers_by_related.setdefault(source, []).append(target)
+                values[slot] = cur_supernet
+                host_attr_names[host_server_id] = host_attr_name
+
+    def _add_related_attributes(self, servers_by_type):
+        for servertype_attributes in self._get_related_hops():
+            self._add_related_hop(servertype_attributes, servers_by_type)
+
+    def _get_related_hops(self):
+        """Order the related servertype attributes topologically
+
+        Yields the lists of them to be fetched together.  They are related
+        via the attributes either stored on the servers, or fetched on
+        the previous hops.
+        """
+        pending = self._related_servertype_attributes
+        while pending:
+            related = {(sa.attribute_id, sa.servertype_id) for sa in pending}
+            hop = []
+            rest = []
+            for sa in pending:
+                if (sa.related_via_attribute_id, sa.servertype_id) in related:
+                    rest.append(sa)
                 else:
-                    source = attributes[related_via_attribute]
-                    servers_by_related.setdefault(source, []).append(target)
-
-        # Then, query and set the related attributes
-        for sa in (
-            ServerAttribute.get_model(attribute.type)
-            .objects.filter(
-                server__hostname__in=servers_by_related.keys(),
-                attribute=attribute,
-            )
-            .prefetch_related("server")
-            .defer(
-                "server__intern_ip",
-                "server__servertype",
-            )
-        ):
-            for target in servers_by_related[sa.server]:
-                self._add_attribute_value(target, attribute, sa.get_value())
+                    hop.append(sa)
 
-    def _add_attribute_value(self, server, attribute, value):
-        if attribute.multi:
-            try:
-                self._server_attributes[server][attribute].add(value)
-            except KeyError:
-                # If the attribute is removed from the servertype but
-                # left on the servers, this error would occur.  It is not
-                # really expected, but we don't want to crash either.
-                pass
-        else:
-            self._server_attributes[server][attribute] = value
+            # This can only happen with circular relations which wouldn't
+            # resolve to anything anyway.
+            if not hop:
+                break
+
+            yield hop
+            pending = rest
+
+    def _add_related_hop(self, servertype_attributes, servers_by_type):
+        """Add the related attributes by a single query
+
+        The values of the attributes are queried from the related servers,
+        and added to the servers related to them.
+        """
+        attributes = {}
+        targets = {}
+        for sa in servertype_attributes:
+            attributes[sa.attribute_id] = sa.attribute
+            related_via_attribute = sa.related_via_attribute
+            slot = self._slots[related_via_attribute]
+            for target in servers_by_type[sa.servertype_id]:
+                value = self._values[target.server_id][slot]
+                if value is MISSING or value is None:
+                    continue
+                if not related_via_attribute.multi:
+                    value = (value, )
+                for source in value:
+                    targets.setdefault(
+                        (source.server_id, sa.attribute_id), []
+                    ).append(target.server_id)
+
+        if not targets:
+            return
+
+        for server_id, attribute, value in _query_attribute_values(
+            attributes.values(),
+            "sa.server_id = ANY(%(server_ids)s)",
+            {"server_ids": list({s for s, a in targets})},
+        ):
+            for target in targets.get((server_id, attribute.attribute_id), ()):
+                self._add_attribute_value(target, attribute, value)
+
+    def _add_attribute_value(self, server_id, attribute, value):
+        values = self._values[server_id]
+        slot = self._slots[attribute]
+        if not attribute.multi:
+            values[slot] = value
+        # If the attribute is removed from the servertype but left on
+        # the servers, it would be missing.  It is not really expected,
+        # but we don't want to crash either.
+        elif values[slot] is not MISSING:
+            values[slot].add(value)
+
+    def _get_value(self, server, attribute):
+        if attribute.special:
+            value = getattr(server, attribute.special.field)
+            if attribute.special.field == "intern_ip":
+                value = Server._meta.get_field("intern_ip").to_python(value)
+            return value
+        if attribute not in self._slots:
+            return MISSING
+        return self._values[server.server_id][self._slots[attribute]]
 
     def _get_order_by_attribute(self, server, attribute):
         """Return a tuple to sort items by the key
@@ -315,22 +456,31 @@ class QueryMaterializer:
         mind that some datatypes are not sortable with each other, some
         not even with None, so we have to so something in here.
         """
-        if attribute not in self._server_attributes[server]:
+        value = self._get_value(server, attribute)
+        if value is MISSING:
             return 1, None
-        value = self._server_attributes[server][attribute]
         if value is None:
             return -1, None
         if attribute.multi:
             return 0, tuple(_sort_key(v) for v in value)
         return 0, _sort_key(value)
 
-    def _get_attributes(self, server, join_results):  # NOQA: C901
+    def _get_attributes(  # NOQA: C901
+        self, server, joined_attributes, levels
+    ):
         servertype = self._servertype_lookup[server.servertype_id]
-        server_attributes = self._server_attributes[server]
-        for attribute, value in server_attributes.items():
-            if attribute not in self._joined_attributes:
+        for attribute, value in chain(
+            (
+                (a, self._get_value(server, a))
+                for a in Attribute.specials.values()
+                if a in joined_attributes
+            ),
+            zip(self._slots, self._values[server.server_id]),
+        ):
+            if attribute not in joined_attributes or value is MISSING:
                 continue
 
+            join = joined_attributes[attribute]
             if attribute.type == "inet":
                 if value is None:
                     yield attribute.attribute_id, None
@@ -342,61 +492,226 @@ class QueryMaterializer:
                         yield attribute.attribute_id, value.network
             elif value is None:
                 yield attribute.attribute_id, None
-            elif attribute in join_results:
+            elif join is not None:
                 if attribute.multi:
                     yield attribute.attribute_id, [
-                        join_results[attribute][v] for v in value
+                        levels[0]._get_object(v, join, levels[1:])
+                        for v in value
                     ]
                 else:
-                    yield (attribute.attribute_id, join_results[attribute][value])
+                    yield attribute.attribute_id, levels[0]._get_object(
+                        value, join, levels[1:]
+                    )
             elif attribute.multi:
                 yield attribute.attribute_id, {
-                    v.hostname if isinstance(v, Server) else v for v in value
+                    v.hostname if isinstance(v, ServerRow) else v
+                    for v in value
                 }
-            elif isinstance(value, Server):
+            elif isinstance(value, ServerRow):
                 yield attribute.attribute_id, value.hostname
             else:
                 yield attribute.attribute_id, value
 
-    def _get_join_results(self):
-        results = dict()
-        for attribute, joined_attributes in self._joined_attributes.items():
-            if joined_attributes is None:
+    def _get_object(self, server, joined_attributes, levels):
+        """Get the object of a joined server
+
+        The same server can be joined many times by the same attributes.
+        We build the object only once for them.
+        """
+        key = id(joined_attributes), server.server_id
+        if key not in self._objects:
+            self._objects[key] = DatasetObject(
+                self._get_attributes(server, joined_attributes, levels),
+                server.server_id,
+            )
+
+        return self._objects[key]
+
+    def _materialize_joins(self):
+        """Materialize the servers to join level by level
+
+        The servers to join are collected from all of the joined attributes
+        on the same level of the joins, and materialized together with
+        all of the attributes requested from them.  This way, the number of
+        queries only depends on the depth of the joins.  Returns
+        the materializers of the levels.
+        """
+        levels = []
+        nodes = [(self, self._servers, self._joined_attributes)]
+        while True:
+            joins = [
+                (materializer._get_servers_to_join(servers, attribute), join)
+                for materializer, servers, joined_attributes in nodes
+                for attribute, join in joined_attributes.items()
+                if join is not None
+            ]
+            servers = set().union(*(s for s, j in joins))
+            if not servers:
+                return levels
+
+            materializer = type(self)(
+                servers, {a: None for s, j in joins for a in j},
+                budget=self._budget,
+            )
+            levels.append(materializer)
+            nodes = [(materializer, s, j) for s, j in joins]
+
+    def _get_servers_to_join(self, servers, attribute):
+        servers_to_join = set()
+        for server in servers:
+            value = self._get_value(server, attribute)
+            if value is MISSING or value is None:
                 continue
 
-            servers = self._get_servers_to_join(attribute)
-            server_objs = type(self)(servers, joined_attributes)
-            results[attribute] = dict(zip(servers, server_objs))
+            if attribute.multi:
+                servers_to_join.update(value)
+            else:
+                servers_to_join.add(value)
+
+        return servers_to_join
+
+
+def _query_attribute_values(attributes, server_ids_sql, params):
+    """Query the values of the attributes stored on the attribute tables
+
+    They are all fetched by a single query.  The rows are decoded by
+    the converters of their types instead of building model instances
+    for them.  Yields the server ids, the attributes and the values.
+    """
+    attribute_lookup = {
+        a.attribute_id: a for a in attributes if a.type in VALUE_SQL
+    }
+    if not attribute_lookup:
+        return
+
+    # Many servers share the same values.  We decode them only once, and
+    # let them share the objects.
+    decoded_values = {}
+
+    params = dict(params, attribute_ids=list(attribute_lookup.keys()))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _get_attribute_values_sql(
+                {a.type for a in attribute_lookup.values()}, server_ids_sql
+            ),
+            params,
+        )
+        for server_id, attribute_id, value, *related in cursor:
+            attribute = attribute_lookup[attribute_id]
+            key = attribute.type, value, related[0]
+            if key in decoded_values:
+                value = decoded_values[key]
+            elif attribute.type == "relation":
+                value = decoded_values[key] = get_server_row(*related)
+            else:
+                value = decoded_values[key] = (
+                    VALUE_CONVERTERS[attribute.type](value)
+                )
+            yield server_id, attribute, value
+
 
-        return results
+def _get_attribute_values_sql(attribute_types, server_ids_sql):
+    """Get the query to select the values of the attributes of the servers
 
-    def _get_servers_to_join(self, attribute):
-        servers = set()
-        for server_attributes in self._server_attributes.values():
-            if attribute in server_attributes:
-                value = server_attributes[attribute]
-                if value is None:
-                    continue
+    The values of all attribute tables are selected together as text.
+    The relations additionally select the related server.
+    """
+    queries = []
+    for attribute_type in sorted(attribute_types):
+        model = ServerAttribute.get_model(attribute_type)
+        if attribute_type == "relation":
+            related_sql = (
+                "rel.server_id, rel.hostname, rel.intern_ip, rel.servertype_id"
+            )
+            join_sql = " JOIN server AS rel ON (rel.server_id = sa.value)"
+        else:
+            related_sql = "NULL::integer, NULL::text, NULL::inet, NULL::text"
+            join_sql = ""
+
+        queries.append(
+            "SELECT sa.server_id, sa.attribute_id, {}, {} FROM {} AS sa{}"
+            " WHERE {} AND sa.attribute_id = ANY(%(attribute_ids)s)".format(
+                VALUE_SQL[attribute_type],
+                related_sql,
+                model._meta.db_table,
+                join_sql,
+                server_ids_sql,
+            )
+        )
+
+    return " UNION ALL ".join(queries)
+
+
+def _decode_number(value):
+    value = Decimal(value)
+    return int(value) if value.as_tuple().exponent == 0 else float(value)
 
-                if attribute.multi:
-                    for server in value:
-                        servers.add(server)
-                else:
-                    servers.add(value)
 
-        return servers
+def _decode_datetime(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+# The expressions to select the values of the attribute tables as text, and
+# the converters to decode them to what the get_value() methods of
+# the models return.  The dates are formatted explicitly to be independent
+# of the settings of the database.
+VALUE_SQL = {
+    "string": "sa.value",
+    "boolean": "NULL::text",
+    "relation": "NULL::text",
+    "number": "sa.value::text",
+    "inet": "sa.value::text",
+    "macaddr": "sa.value::text",
+    "date": "to_char(sa.value, 'YYYY-MM-DD')",
+    "datetime": (
+        "to_char(sa.value AT TIME ZONE 'UTC', "
+        "'YYYY-MM-DD\"T\"HH24:MI:SS.US')"
+    ),
+}
+VALUE_CONVERTERS = {
+    "string": str,
+    "boolean": lambda value: True,
+    "number": _decode_number,
+    "inet": ServerInetAttribute._meta.get_field("value").to_python,
+    "macaddr": ServerMACAddressAttribute._meta.get_field("value").to_python,
+    "date": date.fromisoformat,
+    "datetime": _decode_datetime,
+}
+
+
+def get_server_row(server_id, hostname, intern_ip, servertype_id):
+    """Build the server row from the columns of the server table
+
+    The intern_ip is kept as it comes from the database, and only
+    converted when it is needed, because the address objects are large.
+    """
+
+    return ServerRow(server_id, hostname, intern_ip, servertype_id)
+
+
+def _to_server_row(value):
+    """Convert the server model instances to server rows"""
+
+    if isinstance(value, Server):
+        return ServerRow(
+            value.server_id, value.hostname, value.intern_ip,
+            value.servertype_id,
+        )
+
+    return value
 
 
 def _sort_key(value):
     if isinstance(value, (IPv4Address, IPv6Address)):
         return value.version, value
-    if isinstance(value, Server):
+    if isinstance(value, ServerRow):
         return value.hostname
     return value
 
 
 def get_default_attribute_values(servertype_id):
-    servertype = Servertype.objects.get(servertype_id=servertype_id)
+    metadata = get_metadata()
+    metadata.get_servertype(servertype_id)
     attribute_values = {}
 
     for attribute_id in Attribute.specials:
@@ -406,7 +721,7 @@ def get_default_attribute_values(servertype_id):
             value = None
         attribute_values[attribute_id] = value
 
-    for sa in servertype.attributes.all():
+    for sa in metadata.servertype_attributes[servertype_id].values():
         attribute_values[sa.attribute_id] = sa.get_default_value()
 
     return attribute_values
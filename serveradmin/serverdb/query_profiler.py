@@ -0,0 +1,53 @@
+"""Serveradmin - Query Profiler
+
+The query executer and the query materializer record what they have done
+on the profile, if one is passed to them.  This is used to inspect
+the slow queries.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class QueryProfile:
+    def __init__(self):
+        """Collect the SQL, the plan and the timings of a query
+
+        The timings are indexed by the phase of the query execution in
+        the order they have started.  The phases which are entered multiple
+        times are summed up.
+        """
+        self.sql = None
+        self.params = None
+        self.plan = None
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        self.timings.setdefault(name, 0)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += perf_counter() - start
+
+    def as_dict(self):
+        return {
+            'sql': self.sql,
+            'params': self.params,
+            'plan': self.plan,
+            'timings': {k: round(v, 6) for k, v in self.timings.items()},
+        }
+
+
+@contextmanager
+def profile_phase(profile, name):
+    """Time the phase on the profile, if there is one"""
+
+    if profile is None:
+        yield
+    else:
+        with profile.phase(name):
+            yield
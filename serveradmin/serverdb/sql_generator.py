@@ -2,11 +2,13 @@
 
 Copyright (c) 2019 InnoGames GmbH
 """
-# XXX: It is terrible to generate SQL this way.  We should make this use
-# parameterized queries at least.
+# XXX: It is terrible to generate SQL this way.  At least the values are
+# passed as parameters.
 # XXX: The code in this module is almost randomly split into functions.  Do
 # not try to guess what they would do.
 
+import re
+
 from adminapi.filters import (
     All,
     Any,
@@ -29,37 +31,174 @@ from serveradmin.serverdb import models
 from serveradmin.serverdb.models import (
     Server,
     ServerAttribute,
-    ServerRelationAttribute, ServerInetAttribute, Attribute,
+    ServerRelationAttribute, ServerInetAttribute, ServerInetSupernet,
+    Attribute,
+)
+from serveradmin.serverdb.metadata import get_metadata
+
+
+# The attribute types the servers can be ordered by on the database
+ORDER_BY_TYPES = [
+    'string',
+    'boolean',
+    'relation',
+    'number',
+    'inet',
+    'macaddr',
+    'date',
+    'datetime',
+]
+
+# The characters having special meaning in the regular expressions
+REGEXP_SPECIAL_CHARS = '.^$*+?()[]{}|\\'
+
+# The backslash escapes of the escape string constants of PostgreSQL
+ESCAPE_RE = re.compile(
+    r'\\(?:([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|u([0-9A-Fa-f]{4})|'
+    r'U([0-9A-Fa-f]{8})|(.))',
+    re.DOTALL,
 )
+ESCAPE_CHARS = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
 
 
 # XXX: The "related_vias" argument is carried all the way through most of
 # the functions to optimize related_via_attribute selection.  We should find
 # a nicer way to achieve this.
-def get_server_query(attribute_filters, related_vias):
+def get_server_query(
+    attribute_filters, related_vias, limit=None, offset=None, order_by=()
+):
+    """Get the query to select the servers matching the filters
+
+    Returns the SQL and the parameters for it.  The queries of the same
+    shape have the same SQL.  The servers are ordered by the attributes on
+    "order_by" and then by the hostname.  The attributes have to be either
+    special, or single valued ones of ORDER_BY_TYPES stored on the servers
+    themselves.  They are given together with the ids of the servertypes
+    having them.  The order keys are selected as additional columns, so
+    that the order can be restored.  See get_order_by_columns().
+    """
     sql = (
         'SELECT'
         ' server.server_id,'
         ' server.hostname,'
         ' server.intern_ip,'
         ' server.servertype_id'
-        ' FROM server'
     )
-    if attribute_filters:
-        sql += ' WHERE ' + ' AND '.join(
-            _get_sql_condition(a, f, related_vias)
-            for a, f in attribute_filters
+    join_sql = ''
+    order_keys = []
+    for index, (attribute, servertype_ids) in enumerate(order_by):
+        attribute_join_sql, attribute_order_keys = _get_order_by_sql(
+            attribute, servertype_ids, 'order{}'.format(index)
+        )
+        join_sql += attribute_join_sql
+        order_keys.extend(attribute_order_keys)
+    for order_key, column in zip(order_keys, get_order_by_columns(order_by)):
+        sql += ', {} AS {}'.format(order_key, column)
+    params = {}
+    sql += ' FROM server' + join_sql
+    sql += _get_where_sql(attribute_filters, related_vias, params)
+    sql += ' ORDER BY ' + ', '.join(order_keys + ['server.hostname'])
+    if limit is not None:
+        sql += ' LIMIT ' + _add_param(params, int(limit))
+    if offset:
+        sql += ' OFFSET ' + _add_param(params, int(offset))
+
+    return sql, params
+
+
+def get_order_by_columns(order_by):
+    """Get the columns to order the results of get_server_query() by"""
+
+    return [
+        'order_key{}'.format(i) for i in range(len(order_by) * 2)
+    ] + ['hostname']
+
+
+def _get_order_by_sql(attribute, servertype_ids, alias):
+    """Get the joins and the order keys to order by the attribute
+
+    The servers which don't have the attribute set come first, and
+    the ones which don't have the attribute at all come last, like on
+    the query materializer.  The first order key puts them in place, and
+    the second one orders the rest by the value.
+    """
+    if attribute.special:
+        column = 'server.' + attribute.special.field
+        return '', [
+            'CASE WHEN {} IS NULL THEN -1 ELSE 0 END'.format(column), column
+        ]
+
+    assert attribute.type in ORDER_BY_TYPES and not attribute.multi
+    join_sql = (
+        ' LEFT JOIN {0} AS {1}'
+        ' ON ({1}.server_id = server.server_id'
+        " AND {1}.attribute_id = '{2}')"
+        .format(
+            ServerAttribute.get_model(attribute.type)._meta.db_table,
+            alias,
+            attribute.attribute_id,
+        )
+    )
+    if servertype_ids:
+        has_attribute = 'server.servertype_id IN ({})'.format(
+            ', '.join("'{}'".format(s) for s in servertype_ids)
         )
-    sql += ' ORDER BY server.hostname'
+    else:
+        has_attribute = 'false'
+
+    # Boolean attributes are stored as the mere existence of a row, so
+    # the servers having the attribute are either true or false.
+    if attribute.type == 'boolean':
+        value = '{}.server_id IS NOT NULL'.format(alias)
+        return join_sql, [
+            'CASE WHEN {} OR {} THEN 0 ELSE 1 END'.format(
+                value, has_attribute
+            ),
+            value,
+        ]
+
+    if attribute.type == 'relation':
+        join_sql += (
+            ' LEFT JOIN server AS {0}_server'
+            ' ON ({0}_server.server_id = {0}.value)'.format(alias)
+        )
+        value = '{}_server.hostname'.format(alias)
+    else:
+        value = '{}.value'.format(alias)
 
-    return sql
+    return join_sql, [
+        'CASE WHEN {}.value IS NOT NULL THEN 0 WHEN {} THEN -1 ELSE 1 END'
+        .format(alias, has_attribute),
+        value,
+    ]
 
 
-def _get_sql_condition(attribute, filt, related_vias):
+def get_server_count_query(attribute_filters, related_vias):
+    params = {}
+    sql = 'SELECT count(*) FROM server' + _get_where_sql(
+        attribute_filters, related_vias, params
+    )
+
+    return sql, params
+
+
+def _get_where_sql(attribute_filters, related_vias, params):
+    if not attribute_filters:
+        return ''
+
+    return ' WHERE ' + ' AND '.join(
+        _get_sql_condition(a, f, related_vias, params)
+        for a, f in attribute_filters
+    )
+
+
+def _get_sql_condition(attribute, filt, related_vias, params):
     assert isinstance(filt, BaseFilter)
 
     if isinstance(filt, (Not, Any)):
-        return _logical_filter_sql_condition(attribute, filt, related_vias)
+        return _logical_filter_sql_condition(
+            attribute, filt, related_vias, params
+        )
 
     negate = False
     template = ''
@@ -81,16 +220,16 @@ def _get_sql_condition(attribute, filt, related_vias):
         negate = not filt.value
 
     elif isinstance(filt, Regexp):
-        template = '{0}::text ~ E' + _raw_sql_escape(filt.value)
+        template = _regexp_filter_template(filt, params)
     elif isinstance(filt, (GreaterThanOrEquals, LessThanOrEquals)):
-        template = _basic_comparison_filter_template(attribute, filt)
+        template = _basic_comparison_filter_template(attribute, filt, params)
     elif isinstance(filt, Overlaps):
-        template = _containment_filter_template(attribute, filt)
+        template = _containment_filter_template(attribute, filt, params)
     elif isinstance(filt, Empty):
         negate = True
         template = '{0} IS NOT NULL'
     else:
-        template = '{0} = ' + _raw_sql_escape(filt.value)
+        template = '{0} = ' + _add_value_param(params, filt.value)
 
     return _covered_sql_condition(attribute, template, negate, related_vias)
 
@@ -112,10 +251,10 @@ def _covered_sql_condition(attribute, template, negate, related_vias):
     )
 
 
-def _logical_filter_sql_condition(attribute, filt, related_vias):
+def _logical_filter_sql_condition(attribute, filt, related_vias, params):
     if isinstance(filt, Not):
         return 'NOT ({0})'.format(
-            _get_sql_condition(attribute, filt.value, related_vias)
+            _get_sql_condition(attribute, filt.value, related_vias, params)
         )
 
     if isinstance(filt, All):
@@ -141,19 +280,19 @@ def _logical_filter_sql_condition(attribute, filt, related_vias):
             simple_values.append(value)
         else:
             templates.append(
-                _get_sql_condition(attribute, value, related_vias)
+                _get_sql_condition(attribute, value, related_vias, params)
             )
 
     if simple_values:
         if len(simple_values) == 1:
             template = _get_sql_condition(
-                attribute, simple_values[0], related_vias
+                attribute, simple_values[0], related_vias, params
             )
         else:
             template = _covered_sql_condition(
                 attribute,
                 '{{0}} IN ({0})'.format(', '.join(
-                    _raw_sql_escape(v.value) for v in simple_values
+                    _add_value_param(params, v.value) for v in simple_values
                 )),
                 False,
                 related_vias,
@@ -163,7 +302,7 @@ def _logical_filter_sql_condition(attribute, filt, related_vias):
     return '({0})'.format(joiner.join(templates))
 
 
-def _basic_comparison_filter_template(attribute, filt):
+def _basic_comparison_filter_template(attribute, filt, params):
     if isinstance(filt, GreaterThan):
         operator = '>'
     elif isinstance(filt, LessThan):
@@ -174,17 +313,17 @@ def _basic_comparison_filter_template(attribute, filt):
         operator = '<='
 
     return '{{}} {} {}'.format(
-        operator, _raw_sql_escape(filt.value)
+        operator, _add_value_param(params, filt.value)
     )
 
 
-def _containment_filter_template(attribute, filt):
+def _containment_filter_template(attribute, filt, params):
     template = None     # To be formatted 2 times
     value = filt.value
 
     if attribute.type == 'inet':
         if isinstance(filt, StartsWith):
-            template = "{{0}} >>= {0} AND host({{0}}) = host(0{})"
+            template = "{{0}} >>= {0} AND host({{0}}) = host({0})"
         elif isinstance(filt, Contains):
             template = "{{0}} >>= {0}"
         elif isinstance(filt, ContainedOnlyBy):
@@ -213,13 +352,107 @@ def _containment_filter_template(attribute, filt):
             .format(type(filt).__name__, attribute)
         )
 
-    return template.format(_raw_sql_escape(value))
+    return template.format(_add_value_param(params, value))
+
+
+def _regexp_filter_template(filt, params):
+    """Translate the regexp to equality or LIKE when it is simple enough
+
+    Those are cheaper to evaluate, the equality can use the B-tree index
+    on the hostname, and the trigram indexes can always use the literals
+    of the LIKE patterns.  The most common servershell terms like "web.*"
+    or "^db01" are simple enough.
+    """
+    regexp = _unescape(filt.value)
+    parsed = _parse_simple_regexp(regexp)
+    if parsed is None:
+        return '{0}::text ~ ' + _add_param(params, regexp)
+
+    literals, start, end = parsed
+    if start and end and len(literals) == 1:
+        return '{0}::text = ' + _add_param(params, literals[0])
+
+    return '{0}::text LIKE ' + _add_param(
+        params,
+        ('' if start else '%') +
+        '%'.join(
+            literal
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_')
+            for literal in literals
+        ) +
+        ('' if end else '%'),
+    )
+
+
+def _unescape(value):
+    """Process the backslash escapes of the regexp
+
+    The regexps used to be passed inside escape string constants, so
+    the clients double the backslashes of the regexps.  We keep processing
+    the escapes the same way as PostgreSQL does for those.
+    """
+    value = str(value)
+    if value.endswith('\\'):
+        raise FilterValueError('Escape character cannot be used in the end')
+
+    def replace(match):
+        octal, hexadecimal, short_unicode, long_unicode, char = match.groups()
+        if char is not None:
+            return ESCAPE_CHARS.get(char, char)
+        if octal is not None:
+            return chr(int(octal, 8))
+        return chr(int(hexadecimal or short_unicode or long_unicode, 16))
+
+    return ESCAPE_RE.sub(replace, value)
+
+
+def _parse_simple_regexp(value):
+    """Split the regexp into the literals between the ".*"s
+
+    The anchors are only accepted on the ends.  None is returned when
+    the regexp uses anything else than the escaped characters which are
+    not alphanumeric.
+    """
+    literals = ['']
+    start = end = False
+    index = 0
+    while index < len(value):
+        char = value[index]
+        if (
+            char == '\\' and
+            index + 1 < len(value) and
+            not value[index + 1].isalnum()
+        ):
+            literals[-1] += value[index + 1]
+            index += 2
+            continue
+
+        if value.startswith('.*', index):
+            literals.append('')
+            index += 1
+        elif char == '^' and index == 0:
+            start = True
+        elif char == '$' and index == len(value) - 1:
+            end = True
+        elif char in REGEXP_SPECIAL_CHARS:
+            return None
+        else:
+            literals[-1] += char
+        index += 1
+
+    # The ".*"s on the ends make the anchors meaningless.
+    if len(literals) > 1:
+        start = start and literals[0] != ''
+        end = end and literals[-1] != ''
+        literals = [literal for literal in literals if literal]
+
+    return literals, start, end
 
 
 def _target_servertype_sql(alias: str, attribute: models.Attribute) -> str:
-    ids = list(
-        attribute.target_servertype.values_list('servertype_id', flat=True)
-    )
+    ids = get_metadata().target_servertype_ids[attribute.attribute_id]
     if len(ids) == 1:
         return f"{alias}.servertype_id = '{ids[0]}'"
     return "{}.servertype_id IN ({})".format(
@@ -232,19 +465,11 @@ def _condition_sql(attribute, template, related_vias):
         return template.format('server.' + attribute.special.field)
 
     if attribute.type == 'supernet':
-        return _supernet_exists_sql(
-            attribute, 'supernet',
-            '>>= server_addr.value',
-            (
-                _target_servertype_sql('supernet', attribute),
-                template.format('supernet.server_id'),
-            )
-        )
+        return _supernet_sql(attribute, template.format('supernet.server_id'))
     if attribute.type == 'domain':
         return _exists_sql(Server, 'sub', (
             _target_servertype_sql('sub', attribute),
-            r"server.hostname ~ ('\A[^\.]+\.' || regexp_replace("
-            r"sub.hostname, '(\*|\-|\.)', '\\\1', 'g') || '\Z')",
+            'sub.hostname = server.domain',
             template.format('sub.server_id'),
         ))
     if attribute.type == 'reverse':
@@ -280,13 +505,8 @@ def _real_condition_sql(attribute, template, related_vias):
             # The condition for directly attached attributes
             relation_condition = 'server.server_id = sub.server_id'
         elif related_via_attribute.type == 'supernet':
-            relation_condition = _supernet_exists_sql(
-                related_via_attribute, 'supernet',
-                '>>= server_addr.value',
-                (
-                    _target_servertype_sql('supernet', related_via_attribute),
-                    'supernet.server_id = sub.server_id'
-                ),
+            relation_condition = _supernet_sql(
+                related_via_attribute, 'supernet.server_id = sub.server_id'
             )
         elif related_via_attribute.type == 'reverse':
             relation_condition = _exists_sql(ServerRelationAttribute, 'rel1', (
@@ -330,6 +550,33 @@ def _exists_sql(model, alias, conditions):
     )
 
 
+def _supernet_sql(attribute, condition):
+    """Get the condition for the supernets of the server
+
+    The containment of the inet attribute values is precalculated by
+    the triggers.  See ServerInetSupernet.
+    """
+    if attribute.inet_address_family:
+        address_family_condition = (
+            "supernet_link.attribute_id IN ("
+            "   SELECT attribute_id FROM {} WHERE inet_address_family = '{}'"
+            ")"
+            .format(Attribute._meta.db_table, attribute.inet_address_family)
+        )
+    else:
+        address_family_condition = None
+
+    return _exists_sql(ServerInetSupernet, 'supernet_link', (
+        'supernet_link.server_id = server.server_id',
+        address_family_condition,
+        _exists_sql(Server, 'supernet', (
+            'supernet.server_id = supernet_link.supernet_id',
+            _target_servertype_sql('supernet', attribute),
+            condition,
+        )),
+    ))
+
+
 def _supernet_exists_sql(attribute: Attribute, supernet_alias: str, addr_match: str, where: tuple[str, ...]):
     if attribute.inet_address_family:
         af_join = (
@@ -363,20 +610,22 @@ def _supernet_exists_sql(attribute: Attribute, supernet_alias: str, addr_match:
     )
 
 
-def _raw_sql_escape(value):
-    try:
-        value = str(value)
-    except UnicodeEncodeError as error:
-        raise FilterValueError(str(error))
+def _add_param(params, value):
+    """Add the parameter to the query and return the placeholder for it
 
-    if "'" in value:
-        raise FilterValueError('Single quote cannot be used')
+    The parameters are named by their order, so the queries of the same
+    shape get the same SQL.
+    """
+    name = 'p{}'.format(len(params))
+    params[name] = value
+
+    return '%({})s'.format(name)
 
-    if value.endswith('\\'):
-        raise FilterValueError(
-            'Escape character cannot be used in the end'
-        )
 
-    value = value.replace('{', '{{').replace('}', '}}').replace('%', '%%')
+def _add_value_param(params, value):
+    """Add the value of a filter as a parameter to the query
 
-    return "'" + value + "'"
+    The values are passed as strings for PostgreSQL to cast them to
+    the types of the columns they are compared with.
+    """
+    return _add_param(params, str(value))
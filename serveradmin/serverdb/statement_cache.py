@@ -0,0 +1,89 @@
+"""Serveradmin - Prepared Statement Cache
+
+The SQL generator passes the values of the filters as parameters, so
+the queries of the same shape have the same SQL.  This module prepares
+the statements on the database connection the first time they are seen,
+and executes the prepared ones afterwards.  PostgreSQL switches to
+a generic plan for the statements executed repeatedly, and skips planning
+them from then on.
+
+The prepared statements live as long as the database connection, so
+the connections have to be persistent (see CONN_MAX_AGE) for the cache to
+be useful across the requests.  They don't work behind connection poolers
+which don't keep the same connection for the whole session.  Setting
+SQL_STATEMENT_CACHE_SIZE to 0 disables the cache for those.
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+import re
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+
+PLACEHOLDER_RE = re.compile(r'%\((\w+)\)s')
+
+# The caches by the connections of the database driver.  They go away
+# with the connections together with the statements prepared on them.
+_caches = WeakKeyDictionary()
+
+
+class StatementCache:
+    """Size bounded LRU cache of the statements prepared on a connection"""
+
+    def __init__(self):
+        self._statements = OrderedDict()
+        self._counter = 0
+
+    def execute(self, cursor, sql, params, prefix=''):
+        if sql in self._statements:
+            self._statements.move_to_end(sql)
+        else:
+            self._prepare(cursor, sql)
+        name, param_names = self._statements[sql]
+
+        statement = prefix + 'EXECUTE ' + name
+        if param_names:
+            statement += '({})'.format(
+                ', '.join('%({})s'.format(n) for n in param_names)
+            )
+        cursor.execute(statement, params)
+
+    def _prepare(self, cursor, sql):
+        # The placeholders are replaced with the positional parameters of
+        # PostgreSQL.  The types of them are inferred from the context.
+        param_names = list(dict.fromkeys(PLACEHOLDER_RE.findall(sql)))
+        positions = {n: i + 1 for i, n in enumerate(param_names)}
+
+        self._counter += 1
+        name = 'serveradmin_{}'.format(self._counter)
+        cursor.execute(
+            'PREPARE {} AS {}'.format(name, PLACEHOLDER_RE.sub(
+                lambda m: '${}'.format(positions[m.group(1)]), sql
+            )),
+            (),
+        )
+        self._statements[sql] = name, param_names
+
+        while len(self._statements) > settings.SQL_STATEMENT_CACHE_SIZE:
+            evicted_name = self._statements.popitem(last=False)[1][0]
+            cursor.execute('DEALLOCATE ' + evicted_name)
+
+
+def execute(cursor, sql, params, prefix=''):
+    """Execute the query prepared on the connection of the cursor
+
+    The prefix is prepended to the statement executing the query, like
+    "CREATE TABLE ... AS", which PostgreSQL supports with EXECUTE.
+    """
+    if not settings.SQL_STATEMENT_CACHE_SIZE:
+        cursor.execute(prefix + sql, params)
+        return
+
+    # The cursor delegates to the one of the driver, which knows
+    # the actual connection.
+    cache = _caches.get(cursor.connection)
+    if cache is None:
+        cache = _caches[cursor.connection] = StatementCache()
+    cache.execute(cursor, sql, params, prefix)
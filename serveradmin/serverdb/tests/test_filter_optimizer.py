@@ -0,0 +1,197 @@
+"""Serveradmin - Filter Optimizer tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase
+
+from adminapi.filters import (
+    All,
+    Any,
+    BaseFilter,
+    Contains,
+    Empty,
+    GreaterThan,
+    GreaterThanOrEquals,
+    LessThan,
+    LessThanOrEquals,
+    Not,
+    Regexp,
+)
+from serveradmin.serverdb.filter_optimizer import optimize_filter
+from serveradmin.serverdb.models import (
+    Attribute,
+    Server,
+    ServerStringAttribute,
+)
+from serveradmin.serverdb.query_executer import execute_query
+
+NUMBER = Attribute(attribute_id='number', type='number', multi=False)
+MULTI = Attribute(attribute_id='multi', type='number', multi=True)
+BOOLEAN = Attribute(attribute_id='boolean', type='boolean', multi=False)
+STRING = Attribute(attribute_id='string', type='string', multi=False)
+
+# The corpus of the filters to check for equivalence on the database,
+# indexed by attribute.
+CORPUS = {
+    'object_id': [
+        Any(Any(1, 2), 3),
+        All(All(GreaterThan(1), Not(5)), LessThan(6)),
+        All(GreaterThan(2), GreaterThanOrEquals(2), LessThanOrEquals(4)),
+        Any(GreaterThan(5), GreaterThan(2), LessThan(1), LessThan(2)),
+        All(GreaterThan(3), LessThan(3)),
+        All(GreaterThanOrEquals(3), LessThanOrEquals(3)),
+        All(1, 2),
+        All(3, GreaterThan(2)),
+        All(3, GreaterThan(3)),
+        Not(Not(Any(1, 1, 2))),
+        Not(Any(Any(), All(2, LessThan(1)))),
+        Any(All(), Regexp('x')),
+    ],
+    'game_world': [
+        All(GreaterThan(1), LessThan(10)),
+        All(GreaterThan(1), LessThan(1)),
+        Any(Not(Empty()), GreaterThan(5)),
+        Not(All(Not(Empty()), Not(Not(2)))),
+        All(1, 2),
+    ],
+    'os': [
+        All(Contains('eez'), Contains('eez'), Not(Not('squeeze'))),
+        All('squeeze', 'wheezy'),
+        Any(All('squeeze'), Any('wheezy', Any())),
+    ],
+    'database': [
+        All('a', 'b'),
+        All('a', 'c'),
+        Any(Any('a'), Not(Not('c'))),
+        Not(All('a', Not('b'))),
+    ],
+    'has_monitoring': [
+        All(True, False),
+        Any(True, False),
+        Not(Not(True)),
+    ],
+    'hostname': [
+        All(Regexp('^test'), Regexp('^test'), Not(Regexp('[02]$'))),
+        Any(Not(Any()), 'test0'),
+    ],
+}
+
+
+class TestOptimizeFilter(SimpleTestCase):
+    def assertOptimized(self, filt, expected, attribute=NUMBER):
+        self.assertEqual(
+            repr(optimize_filter(attribute, filt, {})), repr(expected)
+        )
+
+    def test_double_negation(self):
+        self.assertOptimized(Not(Not(1)), BaseFilter(1))
+        self.assertOptimized(Not(Not(Not(1))), Not(1))
+
+    def test_flatten(self):
+        self.assertOptimized(Any(Any(1, 2), 3), Any(1, 2, 3))
+        self.assertOptimized(All(All(1, All(2)), 3), All(1, 2, 3), MULTI)
+        self.assertOptimized(Any(All(1, 2), 3), Any(All(1, 2), 3), MULTI)
+
+    def test_deduplicate(self):
+        self.assertOptimized(Any(1, 2, 1, Any(2)), Any(1, 2))
+        self.assertOptimized(Any(1, 1.0, True), Any(1, 1.0, True))
+
+    def test_single_value(self):
+        self.assertOptimized(Any(Any(1)), BaseFilter(1))
+
+    def test_constants(self):
+        self.assertOptimized(Any(1, All()), All())
+        self.assertOptimized(Any(1, Any()), BaseFilter(1))
+        self.assertOptimized(All(1, Any()), Any())
+        self.assertOptimized(All(1, All()), BaseFilter(1))
+        self.assertOptimized(Not(Any(Any(), All(Any()))), All())
+
+    def test_merge_comparisons(self):
+        self.assertOptimized(
+            All(GreaterThan(1), GreaterThanOrEquals(3), LessThan(5)),
+            All(GreaterThanOrEquals(3), LessThan(5)),
+        )
+        self.assertOptimized(
+            All(GreaterThanOrEquals(3), GreaterThan(3)), GreaterThan(3)
+        )
+        self.assertOptimized(
+            Any(LessThan(3), LessThanOrEquals(3), LessThan(1)),
+            LessThanOrEquals(3),
+        )
+        self.assertOptimized(
+            All(GreaterThan(1), GreaterThan(2)), GreaterThan(2), MULTI
+        )
+
+    def test_not_merging_strings(self):
+        self.assertOptimized(
+            All(GreaterThan('a'), GreaterThan('b')),
+            All(GreaterThan('a'), GreaterThan('b')),
+            STRING,
+        )
+
+    def test_conflicts(self):
+        self.assertOptimized(All(GreaterThan(3), LessThan(3)), Any())
+        self.assertOptimized(All(GreaterThan(3), LessThanOrEquals(3)), Any())
+        self.assertOptimized(
+            All(GreaterThanOrEquals(3), LessThanOrEquals(3)),
+            All(GreaterThanOrEquals(3), LessThanOrEquals(3)),
+        )
+        self.assertOptimized(All(1, 2), Any())
+        self.assertOptimized(All(1, 1.0), All(1, 1.0))
+        self.assertOptimized(All(1, LessThan(1)), Any())
+        self.assertOptimized(All(True, False), Any(), BOOLEAN)
+        self.assertOptimized(Not(All(1, 2)), All())
+
+    def test_no_conflicts_on_multi_values(self):
+        self.assertOptimized(All(1, 2), All(1, 2), MULTI)
+        self.assertOptimized(
+            All(GreaterThan(3), LessThan(3)),
+            All(GreaterThan(3), LessThan(3)),
+            MULTI,
+        )
+
+    def test_no_conflicts_on_related_attributes(self):
+        self.assertEqual(
+            repr(optimize_filter(
+                NUMBER, All(1, 2), {'number': {None: [], STRING: []}}
+            )),
+            repr(All(1, 2)),
+        )
+
+    def test_no_conflicts_on_strings(self):
+        self.assertOptimized(All('a', 'b'), All('a', 'b'), STRING)
+
+
+class TestOptimizedQueries(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        server = Server.objects.get(hostname='test0')
+        database = Attribute.objects.get(attribute_id='database')
+        for value in ['a', 'b']:
+            ServerStringAttribute.objects.create(
+                server=server, attribute=database, value=value
+            )
+
+    def _query(self, attribute_id, filt):
+        return sorted(
+            o['hostname']
+            for o in execute_query({attribute_id: filt}, ['hostname'], None)
+        )
+
+    def test_equivalence(self):
+        for attribute_id, filters in CORPUS.items():
+            for filt in filters:
+                with self.subTest(attribute_id=attribute_id, filt=filt):
+                    with mock.patch(
+                        'serveradmin.serverdb.query_executer.optimize_filter',
+                        lambda a, f, r: f,
+                    ):
+                        expected = self._query(attribute_id, filt)
+                    self.assertEqual(
+                        self._query(attribute_id, filt), expected
+                    )
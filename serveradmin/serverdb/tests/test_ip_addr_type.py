@@ -5,9 +5,11 @@ Copyright (c) 2021 InnoGames GmbH
 
 import logging
 from ipaddress import IPv4Network
+from unittest import mock
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.test import TransactionTestCase
 from faker import Faker
 from faker.providers import internet
@@ -16,7 +18,11 @@ from adminapi import filters
 from adminapi.exceptions import DatasetError
 from serveradmin.dataset import Query, DatasetObject
 from serveradmin.serverdb.forms import ServertypeAttributeAdminForm
-from serveradmin.serverdb.models import ServertypeAttribute
+from serveradmin.serverdb.models import (
+    Server,
+    ServerInetAttribute,
+    ServertypeAttribute,
+)
 
 # TODO: Remove "InternIp" classes when intern_ip is gone.
 #
@@ -525,6 +531,146 @@ class TestIpAddrTypeNetworkForInetAttributes(TestIpAddrType):
         self.assertIsInstance(to_rename.commit(user=User.objects.first()), int)
 
 
+class TestIpAddrTypeForCommitBatch(TestIpAddrType):
+    """The inet attribute values of a commit are validated together"""
+
+    def _new_objects(self, query, servertype, values):
+        for intern_ip, value in values:
+            server = query.new_object(servertype)
+            server["hostname"] = self.faker.hostname()
+            server["intern_ip"] = intern_ip
+            server["ip_config_ipv4"] = value
+
+    def test_host_duplicate_within_commit(self):
+        query = Query()
+        self._new_objects(query, "host", [
+            ("10.0.0.1/32", "10.0.1.1/32"),
+            ("10.0.0.2/32", "10.0.1.1/32"),
+        ])
+        with self.assertRaises(ValidationError):
+            query.commit(user=User.objects.first())
+
+    def test_network_overlaps_within_commit(self):
+        query = Query()
+        self._new_objects(query, "route_network", [
+            ("10.0.0.0/30", "10.0.1.0/30"),
+            ("10.0.2.0/30", "10.0.1.0/28"),
+        ])
+        with self.assertRaises(ValidationError):
+            query.commit(user=User.objects.first())
+
+    def test_all_conflicts_reported(self):
+        query = Query()
+        self._new_objects(query, "host", [
+            ("10.0.0.1/32", "10.0.1.1/32"),
+            ("10.0.0.2/32", "10.0.1.2/32"),
+        ])
+        query.commit(user=User.objects.first())
+
+        query = Query()
+        self._new_objects(query, "host", [
+            ("10.0.0.3/32", "10.0.1.1/32"),
+            ("10.0.0.4/32", "10.0.1.2/32"),
+        ])
+        with self.assertRaises(ValidationError) as error:
+            query.commit(user=User.objects.first())
+        self.assertEqual(len(error.exception.messages), 2)
+
+    def test_host_swap_within_commit(self):
+        query = Query()
+        self._new_objects(query, "host", [
+            ("10.0.0.1/32", "10.0.1.1/32"),
+            ("10.0.0.2/32", "10.0.1.2/32"),
+        ])
+        query.commit(user=User.objects.first())
+
+        hosts = Query(
+            {"intern_ip": filters.Any("10.0.0.1", "10.0.0.2")},
+            ["intern_ip", "ip_config_ipv4"],
+        )
+        first, second = hosts
+        first["ip_config_ipv4"], second["ip_config_ipv4"] = (
+            second["ip_config_ipv4"], first["ip_config_ipv4"]
+        )
+        self.assertIsInstance(hosts.commit(user=User.objects.first()), int)
+
+
+class TestIpAddrTypeConstraints(TestIpAddrType):
+    """The database enforces the rules without the Python checks"""
+
+    def _commit(self, servertype, intern_ip, value):
+        server = self._get_server(servertype)
+        server["intern_ip"] = intern_ip
+        server["ip_config_ipv4"] = value
+        server.commit(user=User.objects.first())
+
+        return Server.objects.get(hostname=server["hostname"])
+
+    def test_host_intern_ip(self):
+        first = self._commit("host", "10.0.0.1/32", "10.0.1.1/32")
+        second = self._commit("host", "10.0.0.2/32", "10.0.1.2/32")
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Server.objects.filter(pk=second.pk).update(
+                    intern_ip=first.intern_ip
+                )
+
+    def test_host_inet_attribute(self):
+        first = self._commit("host", "10.0.0.1/32", "10.0.1.1/32")
+        second = self._commit("host", "10.0.0.2/32", "10.0.1.2/32")
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ServerInetAttribute.objects.filter(server=second).update(
+                    value="10.0.1.1/32"
+                )
+
+        # The intern_ip conflicts with all attributes
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ServerInetAttribute.objects.filter(server=second).update(
+                    value=first.intern_ip
+                )
+
+    def test_network_inet_attribute(self):
+        self._commit("route_network", "10.0.0.0/30", "10.0.1.0/30")
+        second = self._commit("route_network", "10.0.2.0/30", "10.0.3.0/30")
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ServerInetAttribute.objects.filter(server=second).update(
+                    value="10.0.1.0/28"
+                )
+
+    def test_deleted_server(self):
+        first = self._commit("host", "10.0.0.1/32", "10.0.1.1/32")
+        Query({"hostname": first.hostname}).delete().commit(
+            user=User.objects.first()
+        )
+
+        self.assertIsInstance(
+            self._commit("host", "10.0.0.1/32", "10.0.1.1/32"), Server
+        )
+
+    def test_no_python_checks(self):
+        with mock.patch(
+            "serveradmin.serverdb.models.is_unique_ip"
+        ) as is_unique_ip:
+            self._commit("host", "10.0.0.1/32", "10.0.1.1/32")
+        is_unique_ip.assert_not_called()
+
+    def test_conflict_message(self):
+        first = self._commit("host", "10.0.0.1/32", "10.0.1.1/32")
+
+        with self.assertRaises(ValidationError) as error:
+            self._commit("host", "10.0.0.2/32", "10.0.1.1/32")
+        self.assertIn(
+            "conflicts with: {} (ip_config_ipv4)".format(first.hostname),
+            str(error.exception),
+        )
+
+
 class TestIpAddrTypeHostForSupernetAttr(TestIpAddrType):
     def test_af_unaware_supernet_consistent(self):
         # AF-unaware supernet attribute will be properly calculated when
@@ -695,6 +841,73 @@ class TestIpAddrTypeHostForSupernetAttr(TestIpAddrType):
         self.assertEqual(server_q["supernet_ipv4"], pn_ipv4["hostname"])
         self.assertEqual(server_q["supernet_ipv6"], pn_ipv6["hostname"])
 
+    def test_supernet_follows_network_changes(self):
+        # The supernet is recalculated when the network changes after
+        # the server.
+
+        server = self._get_server("host")
+        server["intern_ip"] = "192.0.2.1"
+        server["ip_config_ipv4"] = "192.0.2.1"
+        server.commit(user=User.objects.first())
+
+        network = self._get_server("provider_network")
+        network["intern_ip"] = "192.0.2.0/24"
+        network["ip_config_ipv4"] = "192.0.2.0/24"
+        network.commit(user=User.objects.first())
+
+        def get_supernet():
+            return Query(
+                {"hostname": server["hostname"]}, ["supernet_ipv4"]
+            ).get()["supernet_ipv4"]
+
+        self.assertEqual(get_supernet(), network["hostname"])
+
+        network_q = Query(
+            {"hostname": network["hostname"]}, ["ip_config_ipv4"]
+        )
+        network_q.update(ip_config_ipv4=IPv4Network("198.51.100.0/24"))
+        network_q.commit(user=User.objects.first())
+        self.assertIsNone(get_supernet())
+
+        network_q.update(ip_config_ipv4=IPv4Network("192.0.2.0/24"))
+        network_q.commit(user=User.objects.first())
+        self.assertEqual(get_supernet(), network["hostname"])
+
+        network_q.delete()
+        network_q.commit(user=User.objects.first())
+        self.assertIsNone(get_supernet())
+
+    def test_supernet_follows_bulk_changes(self):
+        # The supernet is maintained also for the changes not going through
+        # the query committer.
+
+        server = self._get_server("host")
+        server["intern_ip"] = "192.0.2.1"
+        server["ip_config_ipv4"] = "192.0.2.1"
+        server.commit(user=User.objects.first())
+
+        network = self._get_server("provider_network")
+        network["intern_ip"] = "198.51.100.0/24"
+        network["ip_config_ipv4"] = "198.51.100.0/24"
+        network.commit(user=User.objects.first())
+
+        def get_supernet():
+            return Query(
+                {"hostname": server["hostname"]}, ["supernet_ipv4"]
+            ).get()["supernet_ipv4"]
+
+        self.assertIsNone(get_supernet())
+
+        values = ServerInetAttribute.objects.filter(
+            server__hostname=network["hostname"],
+            attribute_id="ip_config_ipv4",
+        )
+        values.update(value="192.0.2.0/24")
+        self.assertEqual(get_supernet(), network["hostname"])
+
+        values.delete()
+        self.assertIsNone(get_supernet())
+
 
 class TestIpAddrTypeHostForSupernetQuery(TestIpAddrType):
     def setUp(self):
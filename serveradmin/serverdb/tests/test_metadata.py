@@ -0,0 +1,95 @@
+"""Serveradmin - Metadata Cache tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from serveradmin.serverdb.metadata import get_metadata, pin_metadata
+from serveradmin.serverdb.models import (
+    Attribute,
+    Servertype,
+    ServertypeAttribute,
+)
+
+
+class TestMetadata(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def test_cached(self):
+        metadata = get_metadata()
+        with self.assertNumQueries(1):
+            self.assertIs(get_metadata(), metadata)
+
+    def test_indexes(self):
+        metadata = get_metadata()
+        sa = metadata.servertype_attributes['vm']['hypervisor']
+        self.assertIs(metadata.attribute_servertypes['hypervisor']['vm'], sa)
+        self.assertIs(sa.attribute, metadata.attributes['hypervisor'])
+        self.assertIs(sa.servertype, metadata.servertypes['vm'])
+
+    def test_invalidated_by_attribute_change(self):
+        metadata = get_metadata()
+        attribute = Attribute.objects.get(attribute_id='os')
+        attribute.readonly = True
+        attribute.save()
+        self.assertIsNot(get_metadata(), metadata)
+        self.assertTrue(get_metadata().attributes['os'].readonly)
+
+    def test_invalidated_by_servertype_attribute_delete(self):
+        get_metadata()
+        ServertypeAttribute.objects.filter(
+            servertype_id='vm', attribute_id='hypervisor'
+        ).delete()
+        self.assertNotIn(
+            'hypervisor', get_metadata().servertype_attributes['vm']
+        )
+
+    def test_invalidated_by_target_servertype_change(self):
+        get_metadata()
+        attribute = Attribute.objects.get(attribute_id='hypervisor')
+        attribute.target_servertype.add(Servertype.objects.get(pk='vm'))
+        self.assertIn(
+            'vm',
+            [
+                s.servertype_id for s in
+                get_metadata().attributes['hypervisor']
+                .target_servertype.all()
+            ],
+        )
+
+    def test_invalidated_by_bulk_update(self):
+        get_metadata()
+        Attribute.objects.filter(attribute_id='os').update(readonly=True)
+        self.assertTrue(get_metadata().attributes['os'].readonly)
+
+    def test_version_not_repeated_after_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Attribute.objects.filter(attribute_id='os').update(
+                    readonly=True
+                )
+                self.assertTrue(get_metadata().attributes['os'].readonly)
+                raise ValueError()
+
+        # Another change must not be taken as the rolled back one
+        Attribute.objects.filter(attribute_id='database').update(
+            readonly=True
+        )
+        self.assertFalse(get_metadata().attributes['os'].readonly)
+
+    def test_target_servertype_ids(self):
+        self.assertEqual(
+            get_metadata().target_servertype_ids['hypervisor'], ['hypervisor']
+        )
+
+    def test_pinned(self):
+        metadata = get_metadata()
+        with self.assertNumQueries(0):
+            with pin_metadata(metadata):
+                self.assertIs(get_metadata(), metadata)
+
+    def test_unknown_servertype(self):
+        with self.assertRaises(Servertype.DoesNotExist):
+            get_metadata().get_servertype('unknown')
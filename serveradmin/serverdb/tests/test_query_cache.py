@@ -0,0 +1,89 @@
+"""Serveradmin - Query Result Cache tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import (
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from adminapi.filters import BaseFilter, Regexp
+from serveradmin.dataset import Query
+from serveradmin.serverdb import query_cache
+from serveradmin.serverdb.models import Attribute
+from serveradmin.serverdb.query_cache import LocalBackend, get_query_cache
+
+
+class TestLocalBackend(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        backend = LocalBackend(2, 60)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_expires(self):
+        backend = LocalBackend(2, 60)
+        backend.set('a', 1)
+        with mock.patch.object(query_cache, 'monotonic', return_value=1e12):
+            self.assertIsNone(backend.get('a'))
+
+
+@override_settings(QUERY_CACHE_BACKEND='local')
+class TestQueryCache(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        query_cache._query_cache = None
+        self.addCleanup(setattr, query_cache, '_query_cache', None)
+
+    def _get_os(self):
+        result = get_query_cache().get_result(
+            {'hostname': BaseFilter('test0')}, ['hostname', 'os'], None
+        )
+        return json.loads(result)[0]['os']
+
+    def test_hit(self):
+        self.assertEqual(self._get_os(), self._get_os())
+        self.assertEqual(get_query_cache().misses, 1)
+        self.assertEqual(get_query_cache().hits, 1)
+
+    def test_different_queries(self):
+        cache = get_query_cache()
+        cache.get_result({'hostname': Regexp('^test')}, ['hostname'], None)
+        cache.get_result({'hostname': Regexp('^test')}, ['os'], None)
+        self.assertEqual(cache.misses, 2)
+
+    def test_invalidated_by_commit(self):
+        self.assertEqual(self._get_os(), 'wheezy')
+        query = Query({'hostname': 'test0'}, ['os'])
+        query.update(os='squeeze')
+        query.commit(user=User.objects.first())
+        self.assertEqual(self._get_os(), 'squeeze')
+        self.assertEqual(get_query_cache().misses, 2)
+
+    def test_invalidated_by_metadata_change(self):
+        self._get_os()
+        Attribute.objects.filter(attribute_id='os').update(readonly=True)
+        self._get_os()
+        self.assertEqual(get_query_cache().misses, 2)
+
+    def test_stats_logged(self):
+        with mock.patch.object(query_cache, 'STATS_INTERVAL', 2):
+            with self.assertLogs('serveradmin.serverdb', 'INFO') as logs:
+                self._get_os()
+                self._get_os()
+        self.assertEqual(
+            logs.output,
+            ['INFO:serveradmin.serverdb:Query cache: 1 hits, 1 misses'],
+        )
@@ -0,0 +1,240 @@
+"""Serveradmin - Query Committer tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from serveradmin.access_control.models import AccessControlGroup
+from serveradmin.dataset import Query
+from serveradmin.serverdb.models import (
+    Attribute,
+    Server,
+    ServerBooleanAttribute,
+    ServerNumberAttribute,
+    ServerRelationAttribute,
+    ServerStringAttribute,
+)
+from serveradmin.serverdb.query_committer import (
+    _insert_attributes,
+    commit_query,
+)
+
+
+class TestBulkCommit(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _commit(self, changed):
+        return commit_query(changed=changed, user=User.objects.get(pk=1))
+
+    def _object_id(self, hostname):
+        return Query({'hostname': hostname}, ['object_id']).get()['object_id']
+
+    def _values(self, model, attribute_id):
+        return {
+            (a.server.hostname, str(a.get_value()))
+            for a in model.objects.filter(attribute_id=attribute_id)
+        }
+
+    def test_update_many(self):
+        self._commit([
+            {
+                'object_id': self._object_id(h),
+                'game_world': {'action': 'update', 'old': o, 'new': n},
+            }
+            for h, o, n in [('test1', 1, 5), ('test2', 2, 6), ('test3', 10, 7)]
+        ])
+
+        self.assertEqual(
+            self._values(ServerNumberAttribute, 'game_world'),
+            {('test1', '5'), ('test2', '6'), ('test3', '7')},
+        )
+
+    def test_update_many_single_statements(self):
+        changed = [
+            {
+                'object_id': self._object_id(h),
+                'game_world': {'action': 'update', 'old': o, 'new': o + 1},
+            }
+            for h, o in [('test1', 1), ('test2', 2), ('test3', 10)]
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self._commit(changed)
+
+        table = ServerNumberAttribute._meta.db_table
+        for statement in ('DELETE FROM {}', 'INSERT INTO "{}"'):
+            statement = statement.format(table)
+            self.assertEqual(
+                sum(q['sql'].startswith(statement) for q in queries), 1
+            )
+
+    def test_update_to_none(self):
+        self._commit([{
+            'object_id': self._object_id('test1'),
+            'game_world': {'action': 'update', 'old': 1, 'new': None},
+        }])
+
+        self.assertEqual(
+            self._values(ServerNumberAttribute, 'game_world'),
+            {('test2', '2'), ('test3', '10')},
+        )
+
+    def test_multi(self):
+        object_id = self._object_id('test0')
+        self._commit([{
+            'object_id': object_id,
+            'database': {'action': 'multi', 'add': ['a', 'b'], 'remove': []},
+        }])
+        self._commit([{
+            'object_id': object_id,
+            'database': {
+                'action': 'multi', 'add': ['c'], 'remove': ['a', 'd'],
+            },
+        }])
+
+        self.assertEqual(
+            self._values(ServerStringAttribute, 'database'),
+            {('test0', 'b'), ('test0', 'c')},
+        )
+
+    def test_multi_existing_value(self):
+        object_id = self._object_id('test0')
+        for _ in range(2):
+            self._commit([{
+                'object_id': object_id,
+                'database': {'action': 'multi', 'add': ['a'], 'remove': []},
+            }])
+
+        self.assertEqual(
+            self._values(ServerStringAttribute, 'database'), {('test0', 'a')}
+        )
+
+    def test_single_existing_value(self):
+        server = Server.objects.get(hostname='test0')
+        value = server.get_attributes(Attribute.objects.get(pk='os')).get()
+        with self.assertRaisesMessage(ValidationError, 'already exists'):
+            _insert_attributes([(server, value.attribute, value.value)])
+
+    def test_boolean(self):
+        object_id = self._object_id('test1')
+        self._commit([{
+            'object_id': object_id,
+            'has_monitoring': {'action': 'update', 'old': False, 'new': True},
+        }])
+        self.assertEqual(
+            self._values(ServerBooleanAttribute, 'has_monitoring'),
+            {('test1', 'True')},
+        )
+
+        self._commit([{
+            'object_id': object_id,
+            'has_monitoring': {'action': 'update', 'old': True, 'new': False},
+        }])
+        self.assertFalse(ServerBooleanAttribute.objects.exists())
+
+    def test_relation_unknown_target(self):
+        with self.assertRaises(ValidationError):
+            self._commit([{
+                'object_id': self._object_id('vm-1'),
+                'hypervisor': {
+                    'action': 'update', 'old': 'hv-1', 'new': 'hv-2',
+                },
+            }])
+
+        self.assertEqual(
+            self._values(ServerRelationAttribute, 'hypervisor'),
+            {('vm-1', 'hv-1')},
+        )
+
+    def test_relation_wrong_servertype(self):
+        with self.assertRaises(ValidationError):
+            self._commit([{
+                'object_id': self._object_id('vm-1'),
+                'hypervisor': {
+                    'action': 'update', 'old': 'hv-1', 'new': 'test0',
+                },
+            }])
+
+    def test_invalid_value_inserts_nothing(self):
+        with self.assertRaises(ValidationError):
+            self._commit([
+                {
+                    'object_id': self._object_id('test1'),
+                    'game_world': {'action': 'update', 'old': 1, 'new': 3},
+                },
+                {
+                    'object_id': self._object_id('test0'),
+                    'database': {
+                        'action': 'multi', 'add': ['a"b'], 'remove': [],
+                    },
+                },
+            ])
+
+        self.assertEqual(
+            self._values(ServerNumberAttribute, 'game_world'),
+            {('test1', '1'), ('test2', '2'), ('test3', '10')},
+        )
+        self.assertFalse(
+            ServerStringAttribute.objects.filter(attribute='database').exists()
+        )
+
+
+class TestCommitAttributes(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.get(pk=1)
+        self.changed = [{
+            'object_id': Query(
+                {'hostname': 'test1'}, ['object_id']
+            ).get()['object_id'],
+            'game_world': {'action': 'update', 'old': 1, 'new': 2},
+        }]
+
+    def _restrict(self, query):
+        self.user.is_superuser = False
+        self.user.save()
+        acl = AccessControlGroup.objects.create(name='test', query=query)
+        acl.members.add(self.user)
+        acl.attributes.add(Attribute.objects.get(pk='game_world'))
+
+    def test_changed_attributes_only(self):
+        commit, _ = commit_query(changed=self.changed, user=self.user)
+
+        self.assertEqual(
+            set(commit.changed[0]),
+            set(Attribute.specials) | {'game_world'},
+        )
+
+    def test_acl_filter_attributes(self):
+        self._restrict('os=squeeze')
+        commit, _ = commit_query(changed=self.changed, user=self.user)
+
+        self.assertEqual(commit.changed[0]['os'], 'squeeze')
+
+    def test_acl_filter_attributes_not_matching(self):
+        self._restrict('os=wheezy')
+        with self.assertRaises(PermissionDenied):
+            commit_query(changed=self.changed, user=self.user)
+
+    def test_acls_queried_once(self):
+        self._restrict('os=squeeze')
+        with CaptureQueriesContext(connection) as queries:
+            commit_query(changed=self.changed, user=self.user)
+
+        self.assertEqual(
+            sum('access_control_version' in q['sql'] for q in queries), 1
+        )
+
+    def test_metadata_version_checked_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            commit_query(changed=self.changed, user=self.user)
+
+        self.assertEqual(
+            sum('metadata_version' in q['sql'] for q in queries), 1
+        )
@@ -0,0 +1,676 @@
+"""Serveradmin - Query Executer tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+from datetime import date, datetime, timezone
+from ipaddress import ip_interface
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from netaddr import EUI
+
+from adminapi.filters import (
+    Any,
+    BaseFilter,
+    Contains,
+    GreaterThan,
+    Not,
+    Regexp,
+)
+from serveradmin.dataset import Query
+from serveradmin.serverdb.models import (
+    Attribute,
+    Server,
+    ServerBooleanAttribute,
+    ServerDateAttribute,
+    ServerDateTimeAttribute,
+    ServerInetAttribute,
+    ServerMACAddressAttribute,
+    ServerStringAttribute,
+)
+from serveradmin.serverdb.query_executer import (
+    SERVER_TABLE,
+    _execute_prepared_query,
+    _prepare_execution,
+    execute_count,
+    execute_queries,
+    execute_query,
+    stream_query,
+)
+from serveradmin.serverdb.query_budget import (
+    QueryBudget,
+    QueryBudgetExceeded,
+    apply_budget,
+)
+from serveradmin.serverdb.query_profiler import QueryProfile
+
+
+class TestPagination(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _hostnames(self, *args, **kwargs):
+        return [
+            o['hostname']
+            for o in execute_query(
+                {'hostname': Regexp('^test')}, ['hostname'], *args, **kwargs
+            )
+        ]
+
+    def test_limit(self):
+        self.assertEqual(
+            self._hostnames(None, limit=2), ['test0', 'test1']
+        )
+
+    def test_limit_and_offset(self):
+        self.assertEqual(
+            self._hostnames(None, limit=2, offset=3), ['test3', 'test4']
+        )
+
+    def test_offset_beyond_results(self):
+        self.assertEqual(self._hostnames(None, offset=10), [])
+
+    def test_after(self):
+        self.assertEqual(
+            self._hostnames(None, limit=2, after='test1'), ['test2', 'test3']
+        )
+
+    def test_after_combined_with_hostname_filter(self):
+        self.assertEqual(
+            [
+                o['hostname']
+                for o in execute_query(
+                    {'hostname': Regexp('^test[0-2]$')},
+                    ['hostname'],
+                    None,
+                    after='test0',
+                )
+            ],
+            ['test1', 'test2'],
+        )
+
+    def test_limit_with_order_by(self):
+        self.assertEqual(
+            self._hostnames(['object_id'], limit=2, offset=1),
+            ['test1', 'test2'],
+        )
+
+    def test_after_with_order_by(self):
+        with self.assertRaises(ValidationError):
+            self._hostnames(['object_id'], after='test1')
+
+    def test_invalid_limit(self):
+        with self.assertRaises(ValidationError):
+            self._hostnames(None, limit=-1)
+        with self.assertRaises(ValidationError):
+            self._hostnames(None, limit='10')
+
+
+class TestOrderBy(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        ServerBooleanAttribute.objects.create(
+            server=Server.objects.get(hostname='test2'),
+            attribute=Attribute.objects.get(pk='has_monitoring'),
+        )
+        ServerDateAttribute.objects.create(
+            server=Server.objects.get(hostname='test0'),
+            attribute=Attribute.objects.get(pk='created'),
+            value=date(2026, 1, 2),
+        )
+
+    def _hostnames(self, order_by, **kwargs):
+        return [
+            o['hostname']
+            for o in execute_query(
+                {}, ['hostname'] + order_by, order_by, **kwargs
+            )
+        ]
+
+    def test_same_as_materializer(self):
+        for order_by in [
+            ['game_world'],
+            ['os'],
+            ['has_monitoring'],
+            ['hypervisor'],
+            ['created'],
+            ['intern_ip'],
+            ['servertype', 'game_world'],
+            ['os', 'object_id'],
+        ]:
+            with self.subTest(order_by=order_by):
+                with mock.patch(
+                    'serveradmin.serverdb.query_executer._get_sql_order_by',
+                    return_value=None,
+                ):
+                    expected = self._hostnames(order_by)
+                self.assertEqual(self._hostnames(order_by), expected)
+
+    @override_settings(SQL_STATEMENT_CACHE_SIZE=0)
+    def test_paginated_on_database(self):
+        with CaptureQueriesContext(connection) as context:
+            hostnames = self._hostnames(['game_world'], limit=2, offset=1)
+        self.assertEqual(hostnames, ['test2', 'test3'])
+        self.assertTrue(any(
+            'ORDER BY' in q['sql'] and 'LIMIT 2 OFFSET 1' in q['sql']
+            for q in context.captured_queries
+        ))
+
+    def test_stream(self):
+        self.assertEqual(
+            [
+                o['hostname']
+                for o in stream_query({}, ['hostname', 'os'], ['os'])
+            ],
+            self._hostnames(['os']),
+        )
+
+    def test_not_on_database(self):
+        with mock.patch(
+            'serveradmin.serverdb.query_executer._paginate'
+        ) as paginate:
+            self._hostnames(['database'])
+        paginate.assert_called_once()
+
+
+# The generated SQL is looked at without the prepared statements.
+@override_settings(SQL_STATEMENT_CACHE_SIZE=0)
+class TestRegexp(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    # The regexps simple enough to be translated to LIKE or equality
+    SIMPLE = [
+        ('hostname', 'test'),
+        ('hostname', 'test.*'),
+        ('hostname', '^test'),
+        ('hostname', '^test0$'),
+        ('hostname', '^test.*1$'),
+        ('hostname', '.*-1$'),
+        ('hostname', '^.*$'),
+        ('hostname', '^$'),
+        ('hostname', 'hv\\\\-'),
+        ('os', 'eez'),
+        ('os', '^sq.*ze$'),
+        ('hypervisor', '^hv'),
+    ]
+    # The ones we leave to the database
+    COMPLEX = [
+        ('hostname', 'test[01]'),
+        ('hostname', '^test.$'),
+        ('hostname', 'hv|vm'),
+        ('hostname', '(?i)TEST0'),
+        ('os', '^s.+e$'),
+    ]
+
+    def _query(self, attribute_id, value):
+        with CaptureQueriesContext(connection) as queries:
+            hostnames = sorted(
+                o['hostname'] for o in execute_query(
+                    {attribute_id: Regexp(value)}, ['hostname'], None
+                )
+            )
+        sql = next(
+            q['sql'] for q in queries if SERVER_TABLE + ' ON ' in q['sql']
+        )
+        return hostnames, sql
+
+    def test_equivalence(self):
+        for attribute_id, value in self.SIMPLE + self.COMPLEX:
+            with self.subTest(attribute_id=attribute_id, value=value):
+                with mock.patch(
+                    'serveradmin.serverdb.sql_generator._parse_simple_regexp',
+                    return_value=None,
+                ):
+                    expected, sql = self._query(attribute_id, value)
+                self.assertIn('::text ~', sql)
+                self.assertEqual(self._query(attribute_id, value)[0], expected)
+
+    def test_simple(self):
+        for attribute_id, value in self.SIMPLE:
+            with self.subTest(attribute_id=attribute_id, value=value):
+                sql = self._query(attribute_id, value)[1]
+                self.assertNotIn('::text ~', sql)
+
+    def test_escapes(self):
+        # The escapes are processed like on the escape string constants
+        # of PostgreSQL, on which the regexps used to be passed.
+        self.assertEqual(
+            self._query('hostname', '^test\\\\d$')[0],
+            ['test0', 'test1', 'test2', 'test3', 'test4'],
+        )
+        self.assertEqual(self._query('hostname', '^test\\d$')[0], [])
+        self.assertEqual(self._query('hostname', '^\\x74est0$')[0], ['test0'])
+
+    def test_no_sequential_scans(self):
+        # The typical servershell terms should be able to use the indexes.
+        # The table is too small for the planner to prefer them otherwise.
+        for attribute_id, value in [
+            ('hostname', 'web.*'),
+            ('hostname', '^db01'),
+            ('hostname', 'db01.*\\\\.example'),
+            ('hostname', 'test[01]'),
+            ('os', 'wheez'),
+        ]:
+            with self.subTest(attribute_id=attribute_id, value=value):
+                sql = self._query(attribute_id, value)[1]
+                with connection.cursor() as cursor:
+                    cursor.execute('SET enable_seqscan = off')
+                    cursor.execute('EXPLAIN ' + sql.split(' AS ', 1)[1])
+                    plan = '\n'.join(r[0] for r in cursor.fetchall())
+                    cursor.execute('RESET enable_seqscan')
+                self.assertNotIn('Seq Scan', plan)
+
+
+class TestRegexpBenchmark(TransactionTestCase):
+    """Compare the regexps translated to LIKE with the plain ones
+
+    The anchored terms use the indexes either way, because PostgreSQL
+    derives the prefix from the regexp as well, so the translated ones
+    only must not touch more buffers.  The others are evaluated on every
+    server, where LIKE is faster.  The best of a few runs are compared for
+    those to keep the load of the machine out.
+    """
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    # The typical servershell terms, and the number of the servers to
+    # query them among
+    INDEXED_TERMS = ['^web0042', '^db0001$']
+    SCANNED_TERMS = ['web0042.*', 'db.*0042']
+    SIZE = 5000
+    RUNS = 5
+
+    def setUp(self):
+        super().setUp()
+        Server.objects.bulk_create(
+            Server(
+                hostname='{}{:04}.example'.format(
+                    'web' if i % 2 else 'db', i // 2
+                ),
+                intern_ip='10.2.{}.{}'.format(i // 256, i % 256),
+                servertype_id='test0',
+            )
+            for i in range(self.SIZE)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE server')
+
+    def _get_sql(self, value):
+        with CaptureQueriesContext(connection) as queries:
+            execute_query({'hostname': Regexp(value)}, ['hostname'], None)
+        return next(
+            q['sql'] for q in queries if SERVER_TABLE + ' ON ' in q['sql']
+        )
+
+    def _explain(self, value):
+        """Return the buffers and the best time of the query
+
+        They are returned both for the query with the regexp translated
+        and for the plain one.
+        """
+        translated_sql = self._get_sql(value)
+        with mock.patch(
+            'serveradmin.serverdb.sql_generator._parse_simple_regexp',
+            return_value=None,
+        ):
+            plain_sql = self._get_sql(value)
+
+        results = []
+        with connection.cursor() as cursor:
+            for sql in (translated_sql, plain_sql):
+                plans = []
+                for run in range(self.RUNS):
+                    cursor.execute(
+                        'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' +
+                        sql.split(' AS ', 1)[1]
+                    )
+                    plans.append(cursor.fetchone()[0][0]['Plan'])
+                results.append((
+                    plans[0]['Shared Hit Blocks'] +
+                    plans[0]['Shared Read Blocks'],
+                    min(p['Actual Total Time'] for p in plans),
+                ))
+
+        return results
+
+    def test_indexed(self):
+        for value in self.INDEXED_TERMS:
+            with self.subTest(value=value):
+                translated, plain = self._explain(value)
+                self.assertLessEqual(translated[0], plain[0])
+
+    def test_scanned(self):
+        for value in self.SCANNED_TERMS:
+            with self.subTest(value=value):
+                translated, plain = self._explain(value)
+                self.assertLess(translated[1], plain[1])
+
+
+class TestStatementCache(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _hostnames(self, filters, **kwargs):
+        return [o['hostname'] for o in execute_query(
+            filters, ['hostname'], None, **kwargs
+        )]
+
+    def _prepared_statements(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT statement FROM pg_prepared_statements'
+                " WHERE name LIKE 'serveradmin%%'"
+            )
+            return [r[0] for r in cursor.fetchall()]
+
+    def test_same_shape(self):
+        self.assertEqual(
+            self._hostnames({'os': BaseFilter('wheezy')}, limit=5),
+            ['test0'],
+        )
+        prepared = self._prepared_statements()
+        self.assertEqual(
+            self._hostnames({'os': BaseFilter('squeeze')}, limit=2),
+            ['test1', 'test2'],
+        )
+        self.assertEqual(execute_count({'os': BaseFilter('squeeze')}), 3)
+        self.assertEqual(
+            len(self._prepared_statements()), len(prepared) + 1
+        )
+
+    @override_settings(SQL_STATEMENT_CACHE_SIZE=1)
+    def test_eviction(self):
+        self._hostnames({'os': BaseFilter('wheezy')})
+        self._hostnames({'hostname': BaseFilter('test0')})
+        self.assertEqual(len(self._prepared_statements()), 1)
+        self.assertEqual(
+            self._hostnames({'os': BaseFilter('wheezy')}), ['test0']
+        )
+
+
+class TestProfile(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _query(self, profile=None):
+        return execute_query(
+            {'hostname': Regexp('^(test1|vm-1)$')},
+            ['hostname', 'game_world', {'hypervisor': ['hostname']}],
+            None,
+            profile=profile,
+        )
+
+    def test_same_results(self):
+        self.assertEqual(self._query(QueryProfile()), self._query())
+
+    def test_explain(self):
+        profile = QueryProfile()
+        self._query(profile)
+        self.assertIn('FROM server', profile.sql)
+        self.assertIn('^(test1|vm-1)$', profile.params.values())
+        self.assertIn('actual time', profile.plan)
+        self.assertIn('Buffers', profile.plan)
+
+    def test_timings(self):
+        profile = QueryProfile()
+        self._query(profile)
+        self.assertEqual(list(profile.as_dict()['timings']), [
+            'metadata',
+            'filter',
+            'attributes.stored',
+            'attributes.related',
+            'joins',
+        ])
+
+
+class TestExecuteQueries(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    QUERIES = [
+        ({'hostname': Regexp('^test')}, ['hostname', 'os'], None),
+        ({'hostname': BaseFilter('vm-1')}, [{'hypervisor': ['hostname']}],
+         None),
+        ({'hostname': Regexp('^test')}, ['hostname'], ['os'], 2, 1),
+        ({'hostname': BaseFilter('nonexistent')}, ['hostname'], None),
+    ]
+
+    def test_same_as_single_queries(self):
+        self.assertEqual(
+            execute_queries(self.QUERIES),
+            [execute_query(*q) for q in self.QUERIES],
+        )
+
+    def test_single_metadata_lookup(self):
+        with CaptureQueriesContext(connection) as context:
+            execute_queries(self.QUERIES)
+        self.assertEqual(sum(
+            'metadata_version' in q['sql'] for q in context.captured_queries
+        ), 1)
+
+    def test_batch(self):
+        first, second = Query.batch([
+            Query({'hostname': 'test0'}, ['os']),
+            Query({'hostname': 'test2'}, ['os']),
+        ])
+        self.assertEqual(first.get()['os'], 'wheezy')
+        self.assertEqual(second.get()['os'], 'squeeze')
+
+
+class TestQueryBudget(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _query(self, budget, **kwargs):
+        return execute_query(
+            {'hostname': Regexp('^test')}, ['hostname', 'os'], None,
+            budget=budget, **kwargs
+        )
+
+    def test_within_budget(self):
+        budget = QueryBudget(timeout=10000, max_rows=5, max_cells=4)
+        self.assertEqual(len(self._query(budget)), 5)
+        self.assertEqual(budget.rows, 5)
+
+        # Not all of the servertypes have the attribute.
+        self.assertEqual(budget.cells, 4)
+
+    def test_max_rows(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, '4 objects'):
+            self._query(QueryBudget(max_rows=4))
+        self.assertEqual(len(self._query(QueryBudget(max_rows=4), limit=4)), 4)
+
+    def test_max_cells(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, '3 attribute'):
+            self._query(QueryBudget(max_cells=3))
+
+    def test_stream(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            stream_query(
+                {'hostname': Regexp('^test')}, ['hostname'], None,
+                budget=QueryBudget(max_rows=4),
+            )
+
+    def test_batch(self):
+        query = ({'hostname': Regexp('^test')}, ['hostname'], None)
+        with self.assertRaises(QueryBudgetExceeded):
+            execute_queries([query, query], QueryBudget(max_rows=8))
+
+    def test_timeout(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, '1 ms'):
+            with transaction.atomic(), apply_budget(QueryBudget(timeout=1)):
+                connection.cursor().execute('SELECT pg_sleep(1)')
+
+
+class TestCount(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def test_count_matches_query(self):
+        for filters in [
+            {},
+            {'hostname': Regexp('^test')},
+            {'os': BaseFilter('squeeze')},
+            {'os': Contains('eez')},
+            {'game_world': GreaterThan(1)},
+            {'hypervisor': BaseFilter('hv-1')},
+            {'vms': Not(Any())},
+        ]:
+            with self.subTest(filters=filters):
+                self.assertEqual(
+                    execute_count(filters),
+                    len(execute_query(filters, ['object_id'], None)),
+                )
+
+    def test_count_destined_to_fail(self):
+        self.assertEqual(execute_count({'hostname': Any()}), 0)
+
+    def test_count_after(self):
+        self.assertEqual(
+            execute_count({'hostname': Regexp('^test')}, 'test2'), 2
+        )
+
+
+class TestStream(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def test_stream_matches_query(self):
+        for args in [
+            ({}, None, None),
+            ({}, ['hostname', 'os', 'vms'], None),
+            ({'hostname': Regexp('^test')}, ['hostname', 'game_world'], None),
+            ({'os': BaseFilter('squeeze')}, ['hostname'], ['object_id']),
+            ({'hostname': Any()}, ['hostname'], None),
+        ]:
+            with self.subTest(args=args):
+                self.assertEqual(
+                    list(stream_query(*args, chunk_size=2)),
+                    execute_query(*args),
+                )
+
+    def test_stream_paginated(self):
+        self.assertEqual(
+            [
+                o['hostname']
+                for o in stream_query(
+                    {'hostname': Regexp('^test')},
+                    ['hostname'],
+                    None,
+                    limit=3,
+                    after='test0',
+                    chunk_size=2,
+                )
+            ],
+            ['test1', 'test2', 'test3'],
+        )
+
+    def test_stream_invalid_query(self):
+        with self.assertRaises(ValidationError):
+            stream_query({}, None, None, limit=-1)
+
+    def test_stream_closed(self):
+        results = stream_query({}, ['hostname'], None, chunk_size=2)
+        next(results)
+        results.close()
+        self.assertFalse(connection.in_atomic_block)
+
+    def test_commit_while_iterating(self):
+        user = User.objects.get(pk=1)
+        query = Query({'hostname': Regexp('^test[12]$')}, ['os'])
+        for obj in query:
+            obj['os'] = 'bullseye'
+            query.commit(user=user)
+        self.assertFalse(connection.in_atomic_block)
+
+        self.assertEqual(
+            [o['os'] for o in Query({'os': 'bullseye'}, ['os'])],
+            ['bullseye', 'bullseye'],
+        )
+
+
+class TestMaterialization(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        server = Server.objects.get(hostname='test0')
+        for model, attribute_id, value in [
+            (ServerStringAttribute, 'database', 'a'),
+            (ServerStringAttribute, 'database', 'b'),
+            (ServerDateAttribute, 'created', date(2026, 1, 2)),
+            (
+                ServerDateTimeAttribute,
+                'last_edited',
+                datetime(2026, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+            ),
+            (ServerMACAddressAttribute, 'mac_address', '00:11:22:33:44:55'),
+            (ServerInetAttribute, 'inet_address', '10.16.1.1/32'),
+        ]:
+            model.objects.create(
+                server=server,
+                attribute=Attribute.objects.get(attribute_id=attribute_id),
+                value=value,
+            )
+
+    def test_attribute_types(self):
+        obj = execute_query({'hostname': BaseFilter('test0')}, None, None)[0]
+        self.assertEqual(obj['os'], 'wheezy')
+        self.assertEqual(obj['database'], {'a', 'b'})
+        self.assertEqual(obj['created'], date(2026, 1, 2))
+        self.assertEqual(
+            obj['last_edited'],
+            datetime(2026, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+        )
+        self.assertEqual(obj['mac_address'], EUI('00:11:22:33:44:55'))
+        self.assertEqual(obj['inet_address'], ip_interface('10.16.1.1').ip)
+
+    def test_numbers_and_booleans(self):
+        objs = execute_query(
+            {'hostname': Regexp('^test[123]$')},
+            ['game_world', 'has_monitoring'],
+            ['hostname'],
+        )
+        self.assertEqual([o['game_world'] for o in objs], [1, 2, 10])
+        self.assertEqual(
+            [o['has_monitoring'] for o in objs], [False, False, False]
+        )
+
+    def test_relations(self):
+        obj = execute_query(
+            {'hostname': BaseFilter('vm-1')},
+            [{'hypervisor': ['hostname', 'intern_ip']}],
+            None,
+        )[0]
+        self.assertEqual(obj['hypervisor']['hostname'], 'hv-1')
+        self.assertEqual(
+            obj['hypervisor']['intern_ip'], ip_interface('10.0.1.1').ip
+        )
+
+    def test_server_table(self):
+        with CaptureQueriesContext(connection) as context:
+            objs = execute_query(
+                {'hostname': Regexp('^test')}, ['hostname', 'os'], None
+            )
+        self.assertEqual(len(objs), 5)
+        queries = [q['sql'] for q in context.captured_queries]
+        self.assertTrue(any(
+            q.startswith('SELECT') and SERVER_TABLE in q for q in queries
+        ))
+        self.assertFalse(any('server_id = ANY' in q for q in queries))
+
+    def test_percent_sign_in_filter(self):
+        self.assertEqual(
+            execute_query(
+                {'hostname': Regexp('^test0%?$')}, ['hostname'], None
+            ),
+            [{'hostname': 'test0'}],
+        )
+
+    def test_queries_in_one_transaction(self):
+        query = ({'hostname': Regexp('^test[01]$')}, ['hostname'], None)
+        with transaction.atomic():
+            for _ in range(2):
+                self.assertEqual(
+                    _execute_prepared_query(*_prepare_execution(*query)),
+                    [{'hostname': 'test0'}, {'hostname': 'test1'}],
+                )
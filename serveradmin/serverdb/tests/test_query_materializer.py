@@ -0,0 +1,259 @@
+"""Serveradmin - Query Materializer tests
+
+Copyright (c) 2026 InnoGames GmbH
+"""
+
+import tracemalloc
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from adminapi.filters import Any, BaseFilter
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.models import (
+    Attribute,
+    Server,
+    ServerNumberAttribute,
+    ServerRelationAttribute,
+    ServerStringAttribute,
+    Servertype,
+    ServertypeAttribute,
+)
+from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_materializer import (
+    QueryMaterializer,
+    get_server_row,
+)
+
+# The number of servers to materialize for the memory benchmark, and
+# the memory we allow for each of them.  It used to be above 1 KB with
+# the model instances and the dictionaries for every server.
+BENCHMARK_SIZE = 5000
+BENCHMARK_BYTES_PER_SERVER = 400
+
+
+class TestMemoryUsage(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+        servertype = Servertype.objects.get(pk='test0')
+        os = Attribute.objects.get(pk='os')
+        servers = Server.objects.bulk_create(
+            Server(
+                hostname='bench{}'.format(i),
+                intern_ip='10.1.{}.{}'.format(i // 256, i % 256),
+                servertype=servertype,
+            )
+            for i in range(BENCHMARK_SIZE)
+        )
+        ServerStringAttribute.objects.bulk_create(
+            ServerStringAttribute(server=s, attribute=os, value='wheezy')
+            for s in servers
+        )
+        self.joined_attributes = {
+            Attribute.specials['hostname']: None,
+            Attribute.specials['intern_ip']: None,
+            os: None,
+        }
+
+    def test_memory_usage(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT server_id, hostname, intern_ip, servertype_id'
+                " FROM server WHERE hostname LIKE 'bench%%'"
+            )
+            rows = cursor.fetchall()
+
+        tracemalloc.start()
+        try:
+            materializer = QueryMaterializer(
+                [get_server_row(*r) for r in rows], self.joined_attributes
+            )
+            usage = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(usage / len(rows), BENCHMARK_BYTES_PER_SERVER)
+
+        objs = {o['hostname']: o for o in materializer}
+        self.assertEqual(len(objs), BENCHMARK_SIZE)
+        self.assertEqual(objs['bench1']['os'], 'wheezy')
+        self.assertEqual(str(objs['bench1']['intern_ip']), '10.1.0.1')
+
+
+class TestRelatedAttributes(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+
+        # The containers are related to the hypervisors via the virtual
+        # machines, and to the game worlds via the hypervisors.
+        container = Servertype.objects.create(
+            servertype_id='container', ip_addr_type='null'
+        )
+        vm_host = Attribute.objects.create(
+            attribute_id='vm_host', type='relation', regexp=r'\A.*\Z'
+        )
+        game_world = Attribute.objects.get(pk='game_world')
+        hypervisor = Attribute.objects.get(pk='hypervisor')
+        for attribute, related_via_attribute in [
+            (game_world, hypervisor),
+            (hypervisor, vm_host),
+            (vm_host, None),
+        ]:
+            ServertypeAttribute.objects.create(
+                servertype=container,
+                attribute=attribute,
+                related_via_attribute=related_via_attribute,
+            )
+        ServertypeAttribute.objects.create(
+            servertype_id='hypervisor', attribute=game_world
+        )
+
+        ServerNumberAttribute.objects.create(
+            server=Server.objects.get(hostname='hv-1'),
+            attribute=game_world,
+            value=5,
+        )
+        ServerRelationAttribute.objects.create(
+            server=Server.objects.create(
+                hostname='container-1', servertype=container
+            ),
+            attribute=vm_host,
+            value=Server.objects.get(hostname='vm-1'),
+        )
+
+    def test_chained_related_attributes(self):
+        obj = execute_query(
+            {'hostname': BaseFilter('container-1')},
+            ['game_world', 'hypervisor'],
+            None,
+        )[0]
+        self.assertEqual(obj['hypervisor'], 'hv-1')
+        self.assertEqual(obj['game_world'], 5)
+        self.assertNotIn('vm_host', obj)
+
+
+class TestDomainAttributes(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def setUp(self):
+        super().setUp()
+
+        zone = Servertype.objects.create(
+            servertype_id='zone', ip_addr_type='null'
+        )
+        attribute = Attribute.objects.create(
+            attribute_id='zone',
+            type='domain',
+            readonly=True,
+            regexp=r'\A.*\Z',
+        )
+        attribute.target_servertype.add(zone)
+        ServertypeAttribute.objects.create(
+            servertype_id='test2', attribute=attribute
+        )
+
+        for hostname in ['example.com', 'a.example.com']:
+            Server.objects.create(hostname=hostname, servertype=zone)
+        for hostname in ['web.example.com', 'db.a.example.com']:
+            Server.objects.create(hostname=hostname, servertype_id='test2')
+
+    def _query(self, filters):
+        return {
+            o['hostname']: o['zone']
+            for o in execute_query(filters, ['hostname', 'zone'], None)
+        }
+
+    def test_domain(self):
+        self.assertEqual(
+            Server.objects.get(hostname='db.a.example.com').domain,
+            'a.example.com',
+        )
+        self.assertIsNone(Server.objects.get(hostname='test1').domain)
+
+    def test_materialization(self):
+        self.assertEqual(self._query({'servertype': BaseFilter('test2')}), {
+            'test1': None,
+            'test2': None,
+            'test3': None,
+            'web.example.com': 'example.com',
+            'db.a.example.com': 'a.example.com',
+        })
+
+    def test_filter(self):
+        self.assertEqual(
+            self._query({'zone': BaseFilter('example.com')}),
+            {'web.example.com': 'example.com'},
+        )
+
+    def test_metadata_queries(self):
+        get_metadata()
+        with CaptureQueriesContext(connection) as queries:
+            self._query({'zone': BaseFilter('example.com')})
+
+        # The version is checked once, and the target servertypes are
+        # taken from the metadata.
+        table = Attribute.target_servertype.through._meta.db_table
+        self.assertEqual(
+            sum('metadata_version' in q['sql'] for q in queries), 1
+        )
+        self.assertFalse(any(table in q['sql'] for q in queries))
+
+
+# The statements prepared by the first queries would be counted.
+@override_settings(SQL_STATEMENT_CACHE_SIZE=0)
+class TestJoins(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def _query(self, restrict):
+        with CaptureQueriesContext(connection) as context:
+            objs = execute_query(
+                {'hostname': Any('vm-1', 'hv-1')}, restrict, ['hostname']
+            )
+
+        return objs, len(context.captured_queries)
+
+    def test_nested_joins(self):
+        objs, num_queries = self._query([
+            'hostname',
+            {'hypervisor': ['hostname', {'vms': ['hostname']}]},
+        ])
+        hypervisor = objs[1]['hypervisor']
+        self.assertEqual(hypervisor['hostname'], 'hv-1')
+        self.assertEqual([o['hostname'] for o in hypervisor['vms']], ['vm-1'])
+
+    def test_joins_materialized_together(self):
+        os = Attribute.objects.get(pk='os')
+        for servertype_id in ['hypervisor', 'vm']:
+            ServertypeAttribute.objects.create(
+                servertype_id=servertype_id, attribute=os
+            )
+        ServerStringAttribute.objects.create(
+            server=Server.objects.get(hostname='hv-1'),
+            attribute=os,
+            value='buster',
+        )
+
+        # The first query loads the changed metadata.
+        get_metadata()
+        objs, num_queries = self._query(['vms', {'hypervisor': ['os']}])
+        objs, num_joined_queries = self._query([
+            {'vms': ['os']}, {'hypervisor': ['os']}
+        ])
+        self.assertEqual(num_joined_queries, num_queries)
+        self.assertEqual([dict(o) for o in objs[0]['vms']], [{'os': None}])
+        self.assertEqual(objs[1]['hypervisor'], {'os': 'buster'})
+
+    def test_same_server_joined_differently(self):
+        objs, num_queries = self._query([
+            {'hypervisor': ['hostname', {'vms': ['hostname']}]},
+            {'vms': [{'hypervisor': ['vms']}]},
+        ])
+        (vm, ) = objs[0]['vms']
+        self.assertEqual(vm['hypervisor'], {'vms': {'vm-1'}})
+        (vm, ) = objs[1]['hypervisor']['vms']
+        self.assertEqual(vm, {'hostname': 'vm-1'})
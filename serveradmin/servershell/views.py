@@ -32,7 +32,14 @@ from django.views.decorators.http import require_http_methods
 from django.views.defaults import bad_request
 
 from adminapi.datatype import DatatypeError
-from adminapi.filters import Any, ContainedOnlyBy, filter_classes
+from adminapi.filters import (
+    All,
+    Any,
+    BaseFilter,
+    ContainedOnlyBy,
+    Not,
+    filter_classes,
+)
 from adminapi.parse import parse_query
 from adminapi.request import json_encode_extra
 from serveradmin.dataset import Query
@@ -43,8 +50,9 @@ from serveradmin.serverdb.models import (
     Server
 )
 from serveradmin.serverdb.query_committer import commit_query
+from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_profiler import QueryProfile, profile_phase
 from serveradmin.servershell.helper import get_default_shown_attributes
-from serveradmin.servershell.merged_query_iterator import MergedQuery
 from serveradmin.servershell.utils import servershell_plugins
 
 MAX_DISTINGUISHED_VALUES = 50
@@ -138,6 +146,7 @@ def get_results(request):
     shown_attributes = request.GET.getlist('shown_attributes[]')
     deep_link = bool(strtobool(request.GET.get('deep_link', 'false')))
     pinned = request.GET.getlist('pinned[]')
+    profile = _get_profile(request)
 
     if request.session.get('save_attributes') and not deep_link:
         request.session['shown_attributes'] = shown_attributes
@@ -161,17 +170,11 @@ def get_results(request):
         restrict = shown_attributes.copy()
         if 'servertype' not in restrict:
             restrict.append('servertype')
-        main_query = Query(parse_query(term), restrict, order_by)
-
-        merged_query = MergedQuery([
-            Query({'object_id': Any(*pinned)}, restrict),
-            main_query,
-        ])
-
-        # TODO: Using len is terribly slow for large datasets because it has
-        #  to query all objects but we cannot use count which is available on
-        #  Django QuerySet
-        num_servers = len(list(merged_query))
+        filters = parse_query(term)
+        main_query = Query(filters, restrict, order_by)
+        num_servers, servers = _get_page(
+            filters, restrict, order_by, pinned, offset, limit, profile
+        )
     except (DatatypeError, ObjectDoesNotExist, ValidationError) as error:
         return HttpResponse(json.dumps({
             'status': 'error',
@@ -181,8 +184,6 @@ def get_results(request):
     # Query successful term must be valid here, so we can save it safely now.
     request.session['term'] = term
 
-    servers = list(islice(merged_query, offset, offset + limit))
-
     # Add information about available, editable attributes on servertypes
     servertype_ids = {s['servertype'] for s in servers}
 
@@ -202,13 +203,79 @@ def get_results(request):
     ):
         editable_attributes[sa.servertype_id].append(sa.attribute_id)
 
-    return HttpResponse(json.dumps({
+    return HttpResponse(_encode_results({
         'status': 'success',
         'understood': repr(main_query),
         'servers': servers,
         'num_servers': num_servers,
         'editable_attributes': editable_attributes,
-    }, default=json_encode_extra), content_type='application/x-json')
+    }, profile), content_type='application/x-json')
+
+
+def _get_profile(request):
+    """Get the profile for the explain mode, if it is requested
+
+    The explain mode reports the SQL of the query of the page, its plan and
+    the timings with the results.
+    """
+    if not strtobool(request.GET.get('explain', 'false')):
+        return None
+    if not request.user.is_superuser:
+        raise PermissionDenied('Only superusers can explain queries')
+
+    return QueryProfile()
+
+
+def _encode_results(results, profile):
+    """Encode the results adding the profile, if there is one
+
+    The profile is added after the serialization to include its timing.
+    """
+    with profile_phase(profile, 'serialization'):
+        response = json.dumps(results, default=json_encode_extra)
+    if profile is None:
+        return response
+
+    return (
+        response[:-1] + ', "explain": ' + json.dumps(profile.as_dict()) + '}'
+    )
+
+
+def _get_page(filters, restrict, order_by, pinned, offset, limit, profile):
+    """Get the total number of objects and the objects of the page
+
+    The pinned objects are shown in front of the query results, so we exclude
+    them from the query to fetch only the remaining objects of the page.
+    Only the query of the page is profiled, so it is executed directly
+    without the Query object which would otherwise wrap the values of
+    the filters.
+    """
+    filters = {
+        a: f if isinstance(f, BaseFilter) else BaseFilter(f)
+        for a, f in filters.items()
+    }
+    pinned_servers = list(Query({'object_id': Any(*pinned)}, restrict))
+    if pinned_servers:
+        not_pinned = Not(Any(*(s.object_id for s in pinned_servers)))
+        if 'object_id' in filters:
+            filters['object_id'] = All(filters['object_id'], not_pinned)
+        else:
+            filters['object_id'] = not_pinned
+
+    num_servers = len(pinned_servers) + Query(filters).count()
+
+    servers = pinned_servers[offset:offset + limit]
+    if len(servers) < limit:
+        servers.extend(execute_query(
+            filters,
+            restrict,
+            order_by,
+            limit=limit - len(servers),
+            offset=max(offset - len(pinned_servers), 0),
+            profile=profile,
+        ))
+
+    return num_servers, servers
 
 
 @login_required
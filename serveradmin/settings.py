@@ -184,6 +184,36 @@ LOGGING = {
 
 OBJECTS_PER_PAGE = 25
 
+# Number of objects to materialize at once while streaming query results
+QUERY_CHUNK_SIZE = 1000
+
+# Optional cache for the results of the queries through the API.  None
+# disables it, "local" keeps the results in the memory of the process and
+# anything else is taken as the name of a Django cache.  The commits
+# invalidate it immediately, the timeout (in seconds) limits how long
+# the results can be outdated by the changes made otherwise.
+QUERY_CACHE_BACKEND = None
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TIMEOUT = 60
+
+# Number of the generated queries to keep prepared on every database
+# connection, so that PostgreSQL can skip planning the repeated ones.  0
+# disables it, which is necessary behind connection poolers not supporting
+# prepared statements.  See serveradmin.serverdb.statement_cache.
+SQL_STATEMENT_CACHE_SIZE = 100
+
+# The queries through the API taking longer than this (in seconds) are
+# counted as slow for the applications.  The budgets to reject the queries
+# are configured on the applications.
+SLOW_QUERY_THRESHOLD = 10
+
+# Serve the queries through the API by the coroutine views, which is only
+# useful under ASGI.  See serveradmin.asgi.  The number of the threads
+# executing the queries for them bounds the database connections of every
+# process.  Set CONN_MAX_AGE on the database to keep them open.
+ASYNC_API = False
+ASYNC_QUERY_THREADS = 16
+
 GRAPHITE_SPRITE_WIDTH = 150
 GRAPHITE_SPRITE_HEIGHT = 100
 GRAPHITE_SPRITE_PARAMS = (